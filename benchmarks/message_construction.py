@@ -0,0 +1,95 @@
+"""
+Per-message cost of the validating constructors against the trusted construction path.
+
+    python benchmarks/message_construction.py --number 50000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+# run from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mrai.agent.llm.llm import LLM
+from mrai.agent.schema import Message, ToolCall
+from mrai.agent.tool.terminate_tool import Terminate
+from mrai.agent.tool.tool_registry import ToolRegistry
+
+TOOL = Terminate()
+TOOLS = ToolRegistry([TOOL])
+CONTENT = "The tool returned the following result. " * 20
+ARGUMENTS = {"reason": "done", "details": {"steps": 3}}
+PAYLOAD = {
+    "role": "assistant",
+    "content": CONTENT,
+    "tool_calls": [
+        {"id": "call_1", "type": "function", "function": {"name": TOOL.name, "arguments": json.dumps(ARGUMENTS)}},
+    ],
+}
+
+
+def validated_message() -> Message:
+    return Message(role="tool", content=CONTENT)
+
+
+def trusted_message() -> Message:
+    return Message.trusted(role="tool", content=CONTENT)
+
+
+def validated_tool_call_message() -> Message:
+    return Message(
+        role="assistant",
+        content=CONTENT,
+        tool_calls=[
+            ToolCall(
+                id="call_1",
+                type="function",
+                function=ToolCall.ToolCallFunction(name=TOOL.name, arguments=ARGUMENTS),
+                tool=TOOL
+            )
+        ]
+    )
+
+
+def trusted_tool_call_message() -> Message:
+    return Message.trusted(
+        role="assistant",
+        content=CONTENT,
+        tool_calls=[ToolCall.trusted(id="call_1", type="function", name=TOOL.name, arguments=ARGUMENTS, tool=TOOL)]
+    )
+
+
+def build_message() -> Message:
+    return LLM._build_message(PAYLOAD, TOOLS)
+
+
+CASES = [
+    ("message", validated_message, trusted_message),
+    ("message with a tool call", validated_tool_call_message, trusted_tool_call_message),
+]
+
+
+def per_call(fn, number: int, repeat: int) -> float:
+    """The best per-call time in microseconds"""
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="Calls per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurements, the best one is reported")
+    args = parser.parse_args()
+
+    assert validated_tool_call_message() == trusted_tool_call_message()
+    print(f"{'case':<28}{'validated µs':>14}{'trusted µs':>12}{'speedup':>10}")
+    for name, validated, trusted in CASES:
+        before = per_call(validated, args.number, args.repeat)
+        after = per_call(trusted, args.number, args.repeat)
+        print(f"{name:<28}{before:>14.2f}{after:>12.2f}{before / after:>9.1f}x")
+    print(f"{'LLM._build_message':<28}{'':>14}{per_call(build_message, args.number, args.repeat):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Prompt cache hit rate of a RealtimeCallAgentFlow run, with the default and the prefix_cache prompt layouts.
+The mock server reports the prompt prefix shared with its recent requests as cached, like a provider's prompt cache.
+
+    python benchmarks/prefix_cache_hit_rate.py --steps 4
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+
+# run from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mrai.agent.agent import RealtimeCallAgent
+from mrai.agent.flow.realtime_call_agent_flow import MemoryOrganizer, RealtimeCallAgentFlow
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockOpenAIServer, MockResponse, MockServerConfig
+from mrai.agent.schema import FlowInput
+
+AGENT_PROMPT = "You are the agent of the benchmark, follow the rules below. " * 20
+PERSONA = "A stable persona that only changes between sessions. " * 20
+
+
+class StepOrganizer(MemoryOrganizer):
+    """Update a volatile step counter and notes every step, keep the persona, stop after `steps` steps"""
+
+    def __init__(self, steps: int):
+        self.steps = steps
+        self.step = 0
+
+    async def organize(self, content_cache: str, observation: dict, memory: dict, flow_input: str):
+        self.step += 1
+        memory["step"] = self.step
+        memory["notes"] = {"b": 1, "a": self.step}
+        memory["persona"] = PERSONA
+        return self.step >= self.steps
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run(layout: str, steps: int) -> dict:
+    """One flow run against a fresh mock server, so the run starts with an empty prompt cache"""
+    port = free_port()
+    server = await MockOpenAIServer(MockServerConfig(
+        prompt_cache=True,
+        tool_call_style="tag",
+        responses=[MockResponse(content="ok")]
+    )).serve(port=port)
+    try:
+        llm = LLM(LLMConfig(
+            api_key="benchmark",
+            model="benchmark",
+            base_url=f"http://127.0.0.1:{port}/v1",
+            prompt_layout=layout,
+            # the prompt cache stats come from the usage of the streams
+            stream_usage=True
+        ))
+        flow = RealtimeCallAgentFlow(
+            {"primary": RealtimeCallAgent(llm, AGENT_PROMPT)},
+            StepOrganizer(steps),
+            stable_memory_keys=["system_prompt", "persona"]
+        )
+        flow.memory["system_prompt"] = "Answer briefly."
+        await flow.run(FlowInput(text="hello"))
+        return flow.prompt_cache_stats.snapshot()
+    finally:
+        server.should_exit = True
+
+
+async def compare(steps: int) -> dict:
+    # one event loop for every run, the mock servers share sse_starlette's exit event, which is bound to one loop
+    return {layout: await run(layout, steps) for layout in ("default", "prefix_cache")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--steps", type=int, default=4, help="Steps of the flow run")
+    args = parser.parse_args()
+
+    results = asyncio.run(compare(args.steps))
+    print(f"{'layout':<16}{'requests':>10}{'prompt tokens':>15}{'cached tokens':>15}{'hit rate':>10}")
+    for layout, stats in results.items():
+        print(
+            f"{layout:<16}{stats['requests']:>10}{stats['prompt_tokens']:>15}"
+            f"{stats['cached_tokens']:>15}{stats['hit_rate']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
 from abc import ABC, abstractmethod
 from typing import Generator, Iterator, Optional, Any, Union, AsyncIterator
 
-from pydantic import Field, BaseModel, ConfigDict
+from pydantic import Field, BaseModel, ConfigDict, field_validator
 
 from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.stream import StreamChunk, ToolCallComplete, ToolCallStarted
 from mrai.agent.schema import Callback, LLMResponse, Memory, Message, Tool, ToolCall
+from mrai.agent.memory.budget import ContextBudget
+from mrai.agent.memory.compaction import CompactionPolicy
+from mrai.agent.memory.retrieval import RetrievalIndex
+from mrai.agent.tool.tool_registry import ToolRegistry
 
 from loguru import logger
 
@@ -13,13 +18,23 @@ class Agent(ABC, BaseModel):
 
     memory: Memory = Field(default_factory=Memory)
     llm: LLM = Field(..., description="The LLM of the agent")
-    tools: list[Tool] = Field(default=[], description="The tools of the agent")
+    tools: ToolRegistry = Field(default_factory=ToolRegistry, description="The tools of the agent")
     callbacks: list[Callback] = Field(default=[], description="The callbacks of the agent")
     name: str = Field(default="Agent")
+
+    @field_validator("tools", mode="before")
+    @classmethod
+    def _to_tool_registry(cls, tools: Any) -> ToolRegistry:
+        return ToolRegistry.of(tools)
     
     @abstractmethod
-    async def action(self) -> Union[tuple[Optional[str], list[ToolCall]], AsyncIterator[str]]:
-        """The action of the agent"""
+    async def action(self, **llm_kwargs) -> Union[tuple[Optional[str], list[ToolCall]], AsyncIterator[str]]:
+        """
+        The action of the agent
+
+        Args:
+            llm_kwargs: Passed to the LLM call by the flow, e.g. flow_id
+        """
         pass
     
     @abstractmethod
@@ -34,30 +49,58 @@ class Agent(ABC, BaseModel):
 
 
 class SimpleAgent(Agent):
+
+    context_budget: Optional[ContextBudget] = Field(default=None, description="The token budget of the requests")
+
     def __init__(
         self,
         llm: LLM,
         prompt: str,
-        tools: Optional[list[Tool]] = None,
+        tools: Optional[Union[list[Tool], ToolRegistry]] = None,
         memory: Optional[Memory] = None,
         callbacks: Optional[list[Callback]] = None,
         name: Optional[str] = None,
+        context_budget: Optional[ContextBudget] = None,
+        compaction: Optional[CompactionPolicy] = None,
+        retrieval: Optional[RetrievalIndex] = None,
     ):
         super().__init__(
             llm=llm,
             memory=memory or Memory(),
-            tools=tools or [],
+            tools=ToolRegistry.of(tools),
             callbacks=callbacks or [],
-            name=name or "Agent"
+            name=name or "Agent",
+            context_budget=context_budget
         )
+        if context_budget is not None:
+            self.memory.set_token_counter(context_budget.counter)
         
-        # add system prompt
-        self.memory.add_message(Message(role="system", content=prompt))
+        # add system prompt, unless the memory is a restored session that starts with it
+        messages = self.memory.messages
+        if not (messages and messages[0].role == "system" and messages[0].content == prompt):
+            self.memory.add_message(Message(role="system", content=prompt))
+        if retrieval is not None:
+            self.memory.set_retrieval(retrieval)
+        if compaction is not None:
+            self.memory.set_compaction(compaction)
 
-    async def action(self) -> tuple[Optional[str], list[ToolCall]]:
-        """The action of the agent"""
-        messages_for_llm = self.memory.messages.copy()
-        assistant_message: Message = await self.llm.chat(messages=messages_for_llm, tools=self.tools)
+    async def action(self, **chat_kwargs) -> tuple[Optional[str], list[ToolCall]]:
+        """
+        The action of the agent
+
+        Args:
+            chat_kwargs: Passed to LLM.chat, e.g. flow_id
+        """
+        if self.memory.retrieval is not None:
+            messages_for_llm = self.memory.retrieval.select(self.memory)
+            if self.context_budget is not None:
+                messages_for_llm = self.context_budget.fit_messages(messages_for_llm)
+        elif self.context_budget is not None:
+            messages_for_llm = self.context_budget.fit(self.memory)
+        else:
+            messages_for_llm = self.memory.formatted_messages()
+        chat_kwargs.setdefault("agent_name", self.name)
+        assistant_message: Message = await self.llm.chat(messages=messages_for_llm, tools=self.tools, **chat_kwargs)
         # add the response to the memory
         self.memory.add_message(assistant_message)
         if assistant_message.content:
@@ -87,7 +130,7 @@ class RealtimeCallAgent(Agent):
         self,
         llm: LLM,
         prompt: str,
-        tools: Optional[list[Tool]] = None,
+        tools: Optional[Union[list[Tool], ToolRegistry]] = None,
         memory: Optional[Memory] = None,
         callbacks: Optional[list[Callback]] = None,
         name: Optional[str] = None,
@@ -95,30 +138,49 @@ class RealtimeCallAgent(Agent):
         super().__init__(
             llm=llm,
             memory=memory or Memory(),
-            tools=tools or [],
+            tools=ToolRegistry.of(tools),
             callbacks=callbacks or [],
             name=name or "Agent"
         )
         self.prompt = prompt
         
-    async def action(self) -> AsyncIterator[str]:
+    async def action(
+        self,
+        typed: bool = False,
+        **stream_kwargs
+    ) -> AsyncIterator[Union[str, StreamChunk, ToolCallStarted, ToolCallComplete]]:
         """
         ### Realtime call agent returns a stream of chunks, each chunk is a string
 
         the chunk is formatted as follows:
             <chunk_type>::<chunk_content>
-            
+
             the chunk_type can be one of the following:
             * content: the content of the chunk
             * reasoning_content: the reasoning content of the chunk
+
+        with typed, each chunk is a StreamChunk carrying the same type as its kind,
+        and when the LLM uses native tool calls, ToolCallStarted and ToolCallComplete events are yielded between the chunks
+
+        Args:
+            typed: Yield StreamChunk objects instead of strings, see LLM.stream_chat
+            stream_kwargs: Passed to LLM.stream_chat, e.g. coalesce_chars or flow_id
         """
-        messages_for_llm = self.memory.messages.copy()
-        async for chunk in self.llm.stream_chat(
+        stream_kwargs.setdefault("agent_name", self.name)
+        messages_for_llm = self.memory.formatted_messages()
+        stream = self.llm.stream_chat(
             messages=messages_for_llm,
             tools=self.tools,
-            flag=True
-        ):
-            yield chunk
+            flag=not typed,
+            typed=typed,
+            **stream_kwargs
+        )
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            # closing the action closes the upstream stream
+            await stream.aclose()
 
     
     def add_observation(self, observation: str) -> None:
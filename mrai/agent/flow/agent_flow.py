@@ -8,15 +8,15 @@ from typing import AsyncIterator, Union, Optional
 
 class AgentFlow(BaseFlow):
 
-    def __init__(self, agents: dict[str, Agent]):
-        super().__init__(agents)
+    def __init__(self, agents: dict[str, Agent], timeout: Optional[float] = None, call_timeout: Optional[float] = None):
+        super().__init__(agents, timeout=timeout, call_timeout=call_timeout)
 
 
     async def run(self, flow_input: FlowInput):
         valid_input = flow_input.get_valid_input()
         if valid_input is None:
             raise ValueError("Flow input is not valid")
-        #
+        self.start_deadline()
         primary_agent = self.agents.get("primary")
         if primary_agent is not None:
             primary_agent.add_user_message(valid_input)
@@ -26,7 +26,7 @@ class AgentFlow(BaseFlow):
         
     
     async def step(self, agent: Agent):
-        action_result: Union[tuple[Optional[str], list[ToolCall]], AsyncIterator[str]] = await agent.action()
+        action_result: Union[tuple[Optional[str], list[ToolCall]], AsyncIterator[str]] = await agent.action(**self.action_kwargs(agent))
         
         # Check if the result is the expected tuple format
         if not isinstance(action_result, tuple) or len(action_result) != 2:
@@ -59,7 +59,7 @@ class AgentFlow(BaseFlow):
             tool_call_result = tool_call.tool.execute(**tool_call.function.arguments)
             if tool_call_result:
                 # add the tool call result to the agent's memory
-                agent.memory.add_message(Message(role="tool", content=json.dumps({
+                agent.memory.add_message(Message.trusted(role="tool", content=json.dumps({
                     "name": tool_call.function.name,
                     "result": json.dumps(tool_call_result, ensure_ascii=False),
                     "arguments": tool_call.function.arguments
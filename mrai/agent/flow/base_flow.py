@@ -1,18 +1,38 @@
 
 
 from abc import ABC, abstractmethod
+import functools
+import inspect
+import uuid
+from typing import Callable, Optional
 
 from mrai.agent.agent import Agent
+from mrai.agent.llm.deadline import resolve_deadline
 from mrai.agent.schema import FlowInput
 from mrai.agent.tool.assign_agent_tool import AssignAgent
 from mrai.agent.tool.terminate_tool import Terminate
+from mrai.agent.tool.tool_registry import ToolRegistry
+
+
+@functools.lru_cache(maxsize=None)
+def _accepted_kwargs(action: Callable) -> Optional[frozenset]:
+    """The names of the keyword arguments action accepts, None when it takes **kwargs"""
+    parameters = inspect.signature(action).parameters.values()
+    if any(parameter.kind is inspect.Parameter.VAR_KEYWORD for parameter in parameters):
+        return None
+    return frozenset(
+        parameter.name for parameter in parameters
+        if parameter.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY)
+    )
 
 
 class BaseFlow(ABC):
-    def __init__(self, agents: dict[str, Agent]):
+    def __init__(self, agents: dict[str, Agent], timeout: Optional[float] = None, call_timeout: Optional[float] = None):
         """
         Args:
             agents: A dictionary of agents with their names as keys and Agent objects as values, the primary agent should be the key "primary"
+            timeout: The time limit of a run in seconds, its deadline is propagated to every LLM call of the run
+            call_timeout: The time limit of each LLM call in seconds
         >>> agent_list = {
         ...    "primary": Agent() # primary agent
         ...    "other": Agent(), # other agents
@@ -22,12 +42,44 @@ class BaseFlow(ABC):
         if "primary" not in agents:
             raise ValueError("Primary agent is required")
         self.agents = agents
+        # tags the telemetry of the LLM calls of the flow
+        self.flow_id = uuid.uuid4().hex
+        self.timeout = timeout
+        self.call_timeout = call_timeout
+        self.deadline: Optional[float] = None
         for agent in self.agents.values():
+            agent.tools = ToolRegistry.of(agent.tools)
             # add terminate tool to all agents
             agent.tools.append(Terminate())
             # add assign agent tool to all agents
             agent.tools.append(AssignAgent())
 
+    def start_deadline(self):
+        """Start the time limit of a run, to be called at the beginning of run"""
+        self.deadline = resolve_deadline(None, self.timeout)
+
+    def llm_kwargs(self) -> dict:
+        """The arguments of the LLM calls of the flow, passed through agent.action"""
+        return {
+            "flow_id": self.flow_id,
+            "deadline": self.deadline,
+            "timeout": self.call_timeout,
+        }
+
+    def action_kwargs(self, agent: Agent, **kwargs) -> dict:
+        """
+        The LLM arguments of the flow and kwargs, restricted to the ones agent.action accepts,
+        so an agent overriding action(self) still runs, without them
+
+        Args:
+            kwargs: The arguments of the flow for this action, e.g. stop
+        """
+        kwargs = {**kwargs, **self.llm_kwargs()}
+        accepted = _accepted_kwargs(type(agent).action)
+        if accepted is None:
+            return kwargs
+        return {key: value for key, value in kwargs.items() if key in accepted}
+
     @abstractmethod
     def run(self, input: FlowInput):
         """Run the flow"""
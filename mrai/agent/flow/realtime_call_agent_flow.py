@@ -1,13 +1,19 @@
 from abc import ABC, abstractmethod
 import json
 import re
-from typing import AsyncIterator, Callable, Literal
+from typing import AsyncIterator, Callable, Literal, Optional
 from mrai.agent.agent import Agent, RealtimeCallAgent
 from mrai.agent.flow.base_flow import BaseFlow
+from mrai.agent.llm.stream import StreamChunk, ToolCallComplete, ToolCallStarted
+from mrai.agent.llm.usage import PromptCacheStats
 from mrai.agent.schema import FlowInput, Memory, Message
 from loguru import logger
 
 
+TOOL_CALL_START_TAG = "<tool_call>"
+TOOL_CALL_END_TAG = "</tool_call>"
+
+
 class MemoryOrganizer(ABC):
     
     @abstractmethod
@@ -23,18 +29,41 @@ class RealtimeCallAgentFlow(BaseFlow):
         self, agents: dict[str, Agent],
         memory_organizer: MemoryOrganizer,
         tool_call: bool = True,
-        memory_build_type: Literal["auto", "manual"] = "auto"
+        memory_build_type: Literal["auto", "manual"] = "auto",
+        coalesce_chars: int = 0,
+        coalesce_interval: float = 0.0,
+        stable_memory_keys: Optional[list[str]] = None,
+        stop_at_tool_call: bool = True,
+        timeout: Optional[float] = None,
+        call_timeout: Optional[float] = None
     ):
+        """
+        Args:
+            coalesce_chars: Merge the streamed deltas into chunks of up to this many characters
+            coalesce_interval: Merge the streamed deltas for at most this many seconds, e.g. 0.05 to render at 20 fps
+            stable_memory_keys: With the prefix_cache prompt layout of the LLM, the memory keys that rarely change,
+                they are placed right after the agent prompt, defaults to ["system_prompt"]
+            stop_at_tool_call: With prompt-injected tool calls, stop the generation at </tool_call>,
+                the model does not generate the output the flow would throw away
+            timeout: The time limit of a run in seconds, its deadline is propagated to every LLM call of the run
+            call_timeout: The time limit of each LLM call in seconds
+        """
         self.memory = {}
+        self.stable_memory_keys = stable_memory_keys if stable_memory_keys is not None else ["system_prompt"]
+        # the provider's prompt cache hits of the calls of this flow
+        self.prompt_cache_stats = PromptCacheStats()
+        self.stop_at_tool_call = stop_at_tool_call
+        self.coalesce_chars = coalesce_chars
+        self.coalesce_interval = coalesce_interval
         self.memory_organizer = memory_organizer
-        super().__init__(agents)
+        super().__init__(agents, timeout=timeout, call_timeout=call_timeout)
         # realtime call agent flow can not assign agent to other agents
         for agent in agents.values():
-            agent.tools = [tool for tool in agent.tools if tool.name != "assign_agent"]
+            agent.tools.remove("assign_agent")
         if not tool_call:
             # if tool_call is False, remove all tools from all agents, including terminate tool
             for agent in agents.values():
-                agent.tools = []
+                agent.tools.clear()
         
         self.memory_build_type = memory_build_type
 
@@ -42,6 +71,7 @@ class RealtimeCallAgentFlow(BaseFlow):
         valid_input = flow_input.get_valid_input()
         if valid_input is None:
             raise ValueError("Flow input is not valid")
+        self.start_deadline()
         
         primary_agent = self.agents.get("primary")
         if primary_agent is not None:
@@ -58,7 +88,17 @@ class RealtimeCallAgentFlow(BaseFlow):
 
         print("-" * 100)
 
-        stream_generator = agent.action()
+        stop = None
+        if self.stop_at_tool_call and agent.tools and not agent.llm.config.native_tool_calls:
+            stop = [TOOL_CALL_END_TAG]
+        stream_generator = agent.action(**self.action_kwargs(
+            agent,
+            coalesce_chars=self.coalesce_chars,
+            coalesce_interval=self.coalesce_interval,
+            prompt_cache_stats=self.prompt_cache_stats,
+            stop=stop,
+            typed=True
+        ))
         if not isinstance(stream_generator, AsyncIterator):
             # if the agent action result is not an AsyncIterator, raise an error
             raise ValueError("Agent action must return a AsyncIterator")
@@ -67,37 +107,84 @@ class RealtimeCallAgentFlow(BaseFlow):
         other_content_cache = ""
         content_cache = ""
         observation = {}
-        async for chunk in stream_generator:
-            try:
-                formatted_chunk = await self.handle_chunk(chunk)
-                if formatted_chunk["type"] == "content":
-                    content_cache += formatted_chunk["content"]
-                else:
-                    other_content_cache += formatted_chunk["content"]
-                await self.handle_formatted_chunk(formatted_chunk)
-                interruption, tool_call = await self.after_new_chunk(content_cache, other_content_cache)
-                if interruption:
-                    terminate, tool_call_result = await self.handle_tool_call(tool_call)
+        try:
+            async for chunk in stream_generator:
+                try:
+                    if isinstance(chunk, ToolCallStarted):
+                        logger.info(f"🔧 「{agent.name}」 is calling tool: {chunk.name}")
+                        continue
+                    if isinstance(chunk, ToolCallComplete):
+                        # native tool call, no need to look for the <tool_call> tag
+                        tool_call = self.native_tool_call_to_dict(chunk)
+                        # the rest of the response is not needed, stop it before running the tool
+                        await self.close_stream(stream_generator)
+                        terminate, observation = await self.run_tool_call(tool_call)
+                        if terminate:
+                            return
+                        break
+                    if isinstance(chunk, StreamChunk):
+                        if chunk.kind == "content":
+                            content_cache += chunk.text
+                        else:
+                            other_content_cache += chunk.text
+                        await self.handle_stream_chunk(chunk)
+                    else:
+                        formatted_chunk = await self.handle_chunk(chunk)
+                        if formatted_chunk["type"] == "content":
+                            content_cache += formatted_chunk["content"]
+                        else:
+                            other_content_cache += formatted_chunk["content"]
+                        await self.handle_formatted_chunk(formatted_chunk)
+                    interruption, tool_call = await self.after_new_chunk(content_cache, other_content_cache)
+                    if interruption:
+                        await self.close_stream(stream_generator)
+                        terminate, observation = await self.run_tool_call(tool_call)
+                        if terminate:
+                            return
+                        break
+                except Exception as e:
+                    logger.exception(f"Error handling chunk: {e}")
                     observation = {
-                        "tool_call": tool_call,
-                        "tool_call_result": tool_call_result
+                        "error": str(e)
                     }
-                    if terminate:
-                        return
                     break
-            except Exception as e:
-                logger.exception(f"Error handling chunk: {e}")
-                observation = {
-                    "error": str(e)
-                }
-                break
-            
+            else:
+                if stop and self.has_unclosed_tool_call(content_cache):
+                    # the stop sequence cut </tool_call> off, restore it before parsing
+                    content_cache += TOOL_CALL_END_TAG
+                    try:
+                        interruption, tool_call = await self.after_new_chunk(content_cache, other_content_cache)
+                        if interruption:
+                            terminate, observation = await self.run_tool_call(tool_call)
+                            if terminate:
+                                return
+                    except Exception as e:
+                        logger.exception(f"Error handling the tool call: {e}")
+                        observation = {
+                            "error": str(e)
+                        }
+        finally:
+            # close the upstream stream right away, the provider stops generating
+            await self.close_stream(stream_generator)
+
+        logger.debug(f"Prompt cache of the flow: {self.prompt_cache_stats.snapshot()}")
         terminate = await self.memory_organizer.organize(content_cache, observation, self.memory, agent.user_input)
         if terminate == True:
             return
         await self.rebuild_memory(agent)
         await self.step(agent)
         
+    @staticmethod
+    def has_unclosed_tool_call(content: str) -> bool:
+        return content.rfind(TOOL_CALL_START_TAG) > content.rfind(TOOL_CALL_END_TAG)
+
+    @staticmethod
+    async def close_stream(stream: AsyncIterator):
+        """Close the stream of the agent action, which closes the upstream response"""
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
     async def rebuild_memory(self, agent: RealtimeCallAgent):
         """
         Based on the developer's reorganized Memory, construct prompts for the large model.
@@ -107,6 +194,11 @@ class RealtimeCallAgentFlow(BaseFlow):
         new_system_prompt = ""
         new_memory = Memory()
         copy_memory = self.memory.copy()
+        if self.memory_build_type == "auto" and agent.llm.config.prompt_layout == "prefix_cache":
+            for message in self.build_prefix_cache_messages(agent, copy_memory):
+                new_memory.add_message(message)
+            agent.set_memory(new_memory)
+            return
         if self.memory_build_type == "auto":
             sections = []
             if agent.prompt:
@@ -135,7 +227,7 @@ class RealtimeCallAgentFlow(BaseFlow):
             new_system_prompt = "\n\n".join(sections)
                 
         new_memory.add_message(
-            Message(
+            Message.trusted(
                 role="system",
                 content=new_system_prompt
             )
@@ -143,24 +235,80 @@ class RealtimeCallAgentFlow(BaseFlow):
         agent.set_memory(new_memory)
         
 
+    @staticmethod
+    def format_memory_section(key: str, value, sort_keys: bool = False) -> str:
+        if isinstance(value, str):
+            return f"<{key}>{value}</{key}>"
+        if isinstance(value, dict | list):
+            return f"<{key}>{json.dumps(value, ensure_ascii=False, indent=2, sort_keys=sort_keys)}</{key}>"
+        return f"<{key}>{str(value)}</{key}>"
+
+    def build_prefix_cache_messages(self, agent: RealtimeCallAgent, memory: dict) -> list[Message]:
+        """
+        Lay the prompt out from the most to the least stable part, so consecutive steps share the longest prefix:
+        the agent prompt, then the stable memory keys, then the other memory keys and the user input.
+        The LLM places the tool rule right after the first system message.
+        """
+        static_sections = []
+        if agent.prompt:
+            static_sections.append(agent.prompt)
+        stable_sections = []
+        for key in self.stable_memory_keys:
+            value = memory.get(key)
+            if not value:
+                continue
+            if key == "system_prompt":
+                static_sections.append(value)
+            else:
+                stable_sections.append(self.format_memory_section(key, value, sort_keys=True))
+        volatile_sections = []
+        for key, value in memory.items():
+            placed_elsewhere = key in self.stable_memory_keys or key == "user_input"
+            empty_system_prompt = key == "system_prompt" and not value
+            if placed_elsewhere or empty_system_prompt:
+                continue
+            if key == "system_prompt":
+                volatile_sections.append(value)
+            else:
+                volatile_sections.append(self.format_memory_section(key, value, sort_keys=True))
+        if agent.user_input:
+            volatile_sections.append(f"<user_input>{agent.user_input}</user_input>")
+
+        messages = [Message.trusted(role="system", content="\n\n".join(static_sections))]
+        if stable_sections:
+            messages.append(Message.trusted(role="system", content="\n\n".join(stable_sections)))
+        if volatile_sections:
+            messages.append(Message.trusted(role="system", content="\n\n".join(volatile_sections)))
+        return messages
+
     async def handle_chunk(self, chunk: str) -> dict:
-        if chunk.startswith("content::"):
-            return {
-                "type": "content",
-                "content": chunk[len("content::"):]
-            }
-        else:
-            return {
-                "type": chunk.split("::")[0],
-                "content": chunk.split("::")[1]
-            }
-            
+        """Parse a "<type>::<content>" string chunk, for agents that do not yield StreamChunk"""
+        chunk_type, _, content = chunk.partition("::")
+        return {
+            "type": chunk_type,
+            "content": content
+        }
+
+    async def handle_stream_chunk(self, chunk: StreamChunk):
+        """Handle a typed chunk, a subclass overriding handle_formatted_chunk gets it as a formatted chunk"""
+        if type(self).handle_formatted_chunk is not RealtimeCallAgentFlow.handle_formatted_chunk:
+            await self.handle_formatted_chunk({
+                "type": chunk.kind,
+                "content": chunk.text
+            })
+            return
+        self.print_chunk(chunk.kind, chunk.text)
+
     async def handle_formatted_chunk(self, formatted_chunk: dict):
         # TODO: handle the formatted chunk
-        if formatted_chunk.get("type") == "content":
-            print("\033[92m" + formatted_chunk.get("content","") + "\033[0m", flush=True, end="")
+        self.print_chunk(formatted_chunk.get("type"), formatted_chunk.get("content", ""))
+
+    @staticmethod
+    def print_chunk(kind: Optional[str], text: str):
+        if kind == "content":
+            print("\033[92m" + text + "\033[0m", flush=True, end="")
         else:
-            print("\033[90m" + formatted_chunk.get("content", "") + "\033[0m", flush=True, end="")
+            print("\033[90m" + text + "\033[0m", flush=True, end="")
             
             
             
@@ -197,6 +345,27 @@ class RealtimeCallAgentFlow(BaseFlow):
 
         return True, tool_call
     
+    @staticmethod
+    def native_tool_call_to_dict(tool_call: ToolCallComplete) -> dict:
+        """Convert a native tool call to the dict format of the <tool_call> tag"""
+        try:
+            arguments = tool_call.parse_arguments()
+        except ValueError as e:
+            logger.error(f"Failed to parse native tool call arguments: {e}")
+            return {"error": f"Failed to parse tool call JSON: {e}", "raw_content": tool_call.arguments}
+        return {
+            "name": tool_call.name,
+            "arguments": arguments
+        }
+
+    async def run_tool_call(self, tool_call: dict) -> tuple[bool, dict]:
+        """Handle the tool call, return whether to terminate and the observation of the step"""
+        terminate, tool_call_result = await self.handle_tool_call(tool_call)
+        return terminate, {
+            "tool_call": tool_call,
+            "tool_call_result": tool_call_result
+        }
+
     async def handle_tool_call(self, tool_call: dict) -> tuple[bool, dict]:
         """
         Handle the tool call.
@@ -215,9 +384,7 @@ class RealtimeCallAgentFlow(BaseFlow):
         if tool_call.get("name") == "terminate":
             return True, {}
         logger.info(f"Tool call: {tool_call}")
-        tools = self.agents["primary"].tools
-            
-        tool = next((tool for tool in tools if tool.name == tool_call.get("name", "")), None)
+        tool = self.agents["primary"].tools.get(tool_call.get("name", ""))
         if tool is None:
             return False, {
                 "success": False,
@@ -0,0 +1,237 @@
+import asyncio
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Union
+
+from mrai.agent.llm.stream import StreamChunk
+from mrai.agent.schema import Message, Tool
+from mrai.agent.tool.tool_registry import ToolRegistry
+
+if TYPE_CHECKING:
+    from mrai.agent.llm.llm import LLM
+
+Conversation = Sequence[Union[str, dict, Message]]
+
+
+def _start_workers(count: int, total: int, work) -> List[asyncio.Task]:
+    """Start min(count, total) workers sharing one iterator of the indices, each runs work(index) for the next index"""
+    indices: Iterator[int] = iter(range(total))
+
+    async def worker():
+        for index in indices:
+            await work(index)
+
+    return [asyncio.ensure_future(worker()) for _ in range(min(count, total))]
+
+
+class BatchItem:
+    """The result of one conversation of a batch, `error` is set instead of `result` when it failed"""
+
+    __slots__ = ("index", "result", "error", "latency")
+
+    def __init__(self, index: int, result: Any = None, error: Optional[BaseException] = None, latency: float = 0.0):
+        self.index = index
+        self.result = result
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        return f"BatchItem(index={self.index}, ok={self.ok}, latency={self.latency:.3f})"
+
+
+class BatchReport:
+    """Throughput of a batch run"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._latency_sum = 0.0
+
+    def record(self, item: BatchItem):
+        if item.ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self._latency_sum += item.latency
+
+    @property
+    def completed(self) -> int:
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def snapshot(self) -> dict:
+        elapsed = self.elapsed
+        return {
+            "total": self.total,
+            "completed": self.completed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "elapsed": elapsed,
+            "throughput": self.completed / elapsed if elapsed > 0 else 0.0,
+            "avg_latency": self._latency_sum / self.completed if self.completed else 0.0,
+        }
+
+
+class BatchRun:
+    """
+    Run many independent chat calls with bounded concurrency, yielding the results as they complete.
+    A failing conversation is reported on its own item and never stops the run.
+
+    >>> run = llm.chat_many(conversations, max_concurrency=16)
+    >>> async for item in run:
+    ...     results[item.index] = item.result if item.ok else None
+    >>> run.report.snapshot()
+    """
+
+    def __init__(self, llm: "LLM", conversations: Sequence[Conversation], tools: ToolRegistry, max_concurrency: int, chat_kwargs: Dict[str, Any]):
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be greater than 0")
+        self.llm = llm
+        self.conversations = conversations
+        self.tools = tools
+        self.max_concurrency = max_concurrency
+        self.chat_kwargs = chat_kwargs
+        self.report = BatchReport(len(conversations))
+
+    async def _run_one(self, index: int, results: "asyncio.Queue[BatchItem]"):
+        started_at = time.monotonic()
+        try:
+            message = await self.llm.chat(self.conversations[index], tools=self.tools, **self.chat_kwargs)
+            item = BatchItem(index, result=message, latency=time.monotonic() - started_at)
+        except Exception as e:
+            item = BatchItem(index, error=e, latency=time.monotonic() - started_at)
+        self.report.record(item)
+        await results.put(item)
+
+    async def __aiter__(self) -> AsyncIterator[BatchItem]:
+        results: asyncio.Queue[BatchItem] = asyncio.Queue()
+        self.report.started_at = time.monotonic()
+        # max_concurrency workers rather than a task per conversation
+        tasks = _start_workers(self.max_concurrency, len(self.conversations), lambda index: self._run_one(index, results))
+        try:
+            for _ in range(len(self.conversations)):
+                yield await results.get()
+        finally:
+            self.report.finished_at = time.monotonic()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+class StreamProgress:
+    """Progress of one stream of a stream_many run"""
+
+    __slots__ = ("index", "chunks", "chars", "started_at", "first_chunk_at", "finished_at", "error")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.chunks = 0
+        self.chars = 0
+        self.started_at: Optional[float] = None
+        self.first_chunk_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[BaseException] = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def snapshot(self) -> dict:
+        return {
+            "index": self.index,
+            "chunks": self.chunks,
+            "chars": self.chars,
+            "done": self.done,
+            "error": repr(self.error) if self.error is not None else None,
+            "time_to_first_chunk": (
+                self.first_chunk_at - self.started_at
+                if self.first_chunk_at is not None and self.started_at is not None else None
+            ),
+        }
+
+
+class StreamEvent:
+    """A chunk of one stream of a stream_many run, `done` is True on the last event of the stream"""
+
+    __slots__ = ("index", "chunk", "done", "error")
+
+    def __init__(self, index: int, chunk: Any = None, done: bool = False, error: Optional[BaseException] = None):
+        self.index = index
+        self.chunk = chunk
+        self.done = done
+        self.error = error
+
+    def __repr__(self) -> str:
+        return f"StreamEvent(index={self.index}, chunk={self.chunk!r}, done={self.done})"
+
+
+class StreamBatchRun:
+    """
+    Multiplex many stream_chat sessions with bounded concurrency.
+    Chunks of all the streams are yielded as they arrive, tagged with the index of their conversation,
+    each stream ends with an event where done is True.
+
+    >>> run = llm.stream_many(conversations, max_concurrency=8)
+    >>> async for event in run:
+    ...     buffers[event.index] += event.chunk or ""
+    >>> [progress.snapshot() for progress in run.progress]
+    """
+
+    def __init__(self, llm: "LLM", conversations: Sequence[Conversation], tools: ToolRegistry, max_concurrency: int, stream_kwargs: Dict[str, Any]):
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be greater than 0")
+        self.llm = llm
+        self.conversations = conversations
+        self.tools = tools
+        self.max_concurrency = max_concurrency
+        self.stream_kwargs = stream_kwargs
+        self.progress: List[StreamProgress] = [StreamProgress(index) for index in range(len(conversations))]
+        self.report = BatchReport(len(conversations))
+
+    async def _run_one(self, index: int, events: "asyncio.Queue[StreamEvent]"):
+        progress = self.progress[index]
+        progress.started_at = time.monotonic()
+        try:
+            async for chunk in self.llm.stream_chat(self.conversations[index], tools=self.tools, **self.stream_kwargs):
+                if progress.first_chunk_at is None:
+                    progress.first_chunk_at = time.monotonic()
+                progress.chunks += 1
+                if isinstance(chunk, str):
+                    progress.chars += len(chunk)
+                elif isinstance(chunk, StreamChunk):
+                    progress.chars += len(chunk.text)
+                await events.put(StreamEvent(index, chunk))
+        except Exception as e:
+            progress.error = e
+        progress.finished_at = time.monotonic()
+        self.report.record(BatchItem(index, error=progress.error, latency=progress.finished_at - progress.started_at))
+        await events.put(StreamEvent(index, done=True, error=progress.error))
+
+    async def __aiter__(self) -> AsyncIterator[StreamEvent]:
+        # bounded, a slow consumer applies back pressure on the streams
+        events: asyncio.Queue[StreamEvent] = asyncio.Queue(maxsize=self.max_concurrency * 64)
+        self.report.started_at = time.monotonic()
+        tasks = _start_workers(self.max_concurrency, len(self.conversations), lambda index: self._run_one(index, events))
+        remaining = len(self.conversations)
+        try:
+            while remaining:
+                event = await events.get()
+                if event.done:
+                    remaining -= 1
+                yield event
+        finally:
+            self.report.finished_at = time.monotonic()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
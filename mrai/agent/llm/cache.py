@@ -0,0 +1,211 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def make_cache_key(**parts: Any) -> str:
+    """Canonical hash of the request parts, the same request always gives the same key"""
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM.chat responses.
+    The first tier is a bounded in-memory LRU, the second one is an optional SQLite file that survives restarts.
+    Values are the plain payload of the assistant message, so they can be bound to the current tools on read.
+    The writes to the file are buffered and committed in batches by a writer thread, never on the event loop.
+
+    >>> cache = ResponseCache(max_entries=512, path="llm_cache.sqlite", ttl=24 * 3600)
+    >>> llm = LLM(config, cache=cache)
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        batch_size: int = 64,
+        flush_interval: Optional[float] = 1.0
+    ):
+        """
+        Args:
+            path: The SQLite file of the second tier, None to keep the memory tier only
+            batch_size: Wake the writer thread when this many writes are buffered
+            flush_interval: Commit the buffered writes at least this often in seconds, None to only commit by size
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be greater than 0")
+        if batch_size <= 0:
+            raise ValueError("batch_size must be greater than 0")
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # key -> (expires_at, payload)
+        self._memory: OrderedDict[str, tuple[Optional[float], dict]] = OrderedDict()
+        # key -> (created_at, expires_at, payload) to write, or None to delete, the last write of a key wins
+        self._pending: Dict[str, Optional[tuple[float, Optional[float], dict]]] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL)"
+            )
+            self._db.commit()
+            self._writer = threading.Thread(target=self._write_periodically, name="llm-cache-writer", daemon=True)
+            self._writer.start()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.stores = 0
+        self.commits = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return payload
+                del self._memory[key]
+                self.expired += 1
+
+            if self._db is not None:
+                if key in self._pending:
+                    # evicted from the memory tier before the writer got to it
+                    pending = self._pending[key]
+                    row = None if pending is None else (pending[2], pending[1])
+                else:
+                    row = self._db.execute(
+                        "SELECT payload, expires_at FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        row = (json.loads(row[0]), row[1])
+                if row is not None:
+                    payload, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        self._put_memory(key, expires_at, payload)
+                        self.disk_hits += 1
+                        return payload
+                    self._pending[key] = None
+                    self.expired += 1
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, payload: dict):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._put_memory(key, expires_at, payload)
+            if self._db is not None:
+                self._pending[key] = (now, expires_at, payload)
+                if len(self._pending) >= self.batch_size:
+                    self._wake.set()
+            self.stores += 1
+
+    def _flush(self):
+        """The caller holds the lock"""
+        if self._pending and self._db is not None:
+            rows = [
+                (key, json.dumps(write[2], ensure_ascii=False), write[0], write[1])
+                for key, write in self._pending.items() if write is not None
+            ]
+            deleted = [(key,) for key, write in self._pending.items() if write is None]
+            self._db.executemany(
+                "INSERT OR REPLACE INTO llm_cache (key, payload, created_at, expires_at) VALUES (?, ?, ?, ?)", rows
+            )
+            self._db.executemany("DELETE FROM llm_cache WHERE key = ?", deleted)
+            self._db.commit()
+            self._pending = {}
+            self.commits += 1
+
+    def _write_periodically(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                self._flush()
+
+    def flush(self):
+        """Commit the buffered writes"""
+        with self._lock:
+            self._flush()
+
+    def _put_memory(self, key: str, expires_at: Optional[float], payload: dict):
+        self._memory[key] = (expires_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def purge_expired(self) -> int:
+        """Remove the expired entries of both tiers, return the number of removed entries"""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for key in [key for key, (expires_at, _) in self._memory.items() if expires_at is not None and expires_at <= now]:
+                del self._memory[key]
+                removed += 1
+            if self._db is not None:
+                self._flush()
+                cursor = self._db.execute(
+                    "DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+                )
+                self._db.commit()
+                removed += cursor.rowcount
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._pending = {}
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "stores": self.stores,
+                "pending": len(self._pending),
+                "commits": self.commits,
+            }
+
+    def close(self):
+        """Commit the buffered writes, stop the writer thread and close the file"""
+        self._closed.set()
+        self._wake.set()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        with self._lock:
+            if self._db is not None:
+                self._flush()
+                self._db.close()
+                self._db = None
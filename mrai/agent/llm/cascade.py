@@ -0,0 +1,148 @@
+import inspect
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Union
+
+from loguru import logger
+
+from mrai.agent.llm.cache import ResponseCache
+from mrai.agent.llm.cassette import Cassette
+from mrai.agent.llm.llm import LLM, ToolCallError
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.semantic_cache import SemanticCache
+from mrai.agent.llm.telemetry import Telemetry
+from mrai.agent.schema import Message, Tool
+from mrai.agent.tool.tool_registry import ToolRegistry
+
+# accept or reject the response of a tier, the messages are the conversation it answers
+AcceptanceCheck = Callable[[Message, Sequence[Union[str, dict, Message]]], Union[bool, Awaitable[bool]]]
+
+
+class CascadeModelStats:
+    """The outcomes of the calls of one tier of a cascade"""
+
+    def __init__(self, model: str, level: int):
+        self.model = model
+        self.level = level
+        self.calls = 0
+        self.accepted = 0
+        # reason -> count, the reasons are unknown_tool, invalid_arguments and rejected
+        self.escalations: Dict[str, int] = {}
+        self.errors = 0
+        self._latency_sum = 0.0
+
+    def record(self, latency: float, escalation: Optional[str] = None, error: bool = False):
+        self.calls += 1
+        self._latency_sum += latency
+        if error:
+            self.errors += 1
+        elif escalation is not None:
+            self.escalations[escalation] = self.escalations.get(escalation, 0) + 1
+        else:
+            self.accepted += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "model": self.model,
+            "level": self.level,
+            "calls": self.calls,
+            "accepted": self.accepted,
+            "escalations": dict(self.escalations),
+            "errors": self.errors,
+            "success_rate": self.accepted / self.calls if self.calls else 0.0,
+            "avg_latency": self._latency_sum / self.calls if self.calls else 0.0,
+        }
+
+
+class CascadeLLM(LLM):
+    """
+    Answer chat calls with the cheapest model that gets them right.
+    The first config is tried first, the response is escalated to the next config when its tool calls can not be parsed,
+    when it calls an unknown tool, or when the acceptance check rejects it. The last config always answers.
+    The cascade is an LLM of the first config, stream_chat streams from the first config without escalation.
+
+    >>> llm = CascadeLLM(
+    ...     [LLMConfig(model="small", ...), LLMConfig(model="large", ...)],
+    ...     acceptance_check=lambda message, messages: bool(message.content or message.tool_calls)
+    ... )
+    >>> agent = SimpleAgent(llm=llm, prompt=...)
+    >>> llm.cascade_stats()
+    """
+
+    def __init__(
+        self,
+        configs: Sequence[LLMConfig],
+        acceptance_check: Optional[AcceptanceCheck] = None,
+        cache: Optional[ResponseCache] = None,
+        cassette: Optional[Cassette] = None,
+        telemetry: Optional[Telemetry] = None,
+        semantic_cache: Optional[SemanticCache] = None
+    ):
+        """
+        Args:
+            configs: The tiers of the cascade, from the cheapest to the strongest model
+            acceptance_check: Accept or reject the response of a tier, may be a coroutine function, it is not applied to the last tier
+        """
+        if not configs:
+            raise ValueError("A cascade needs at least one config")
+        super().__init__(configs[0], cache=cache, cassette=cassette, telemetry=telemetry, semantic_cache=semantic_cache)
+        self.acceptance_check = acceptance_check
+        self.tiers: List[LLM] = [self] + [
+            LLM(config, cache=cache, cassette=cassette, telemetry=telemetry, semantic_cache=semantic_cache)
+            for config in configs[1:]
+        ]
+        self._stats_lock = threading.Lock()
+        self._stats = [CascadeModelStats(tier.config.model, level) for level, tier in enumerate(self.tiers)]
+
+    async def _accept(self, message: Message, messages: Sequence[Union[str, dict, Message]]) -> bool:
+        if self.acceptance_check is None:
+            return True
+        accepted = self.acceptance_check(message, messages)
+        if inspect.isawaitable(accepted):
+            accepted = await accepted
+        return bool(accepted)
+
+    async def _tier_chat(self, tier: LLM, messages, tools: ToolRegistry, **chat_kwargs) -> Message:
+        if tier is self:
+            return await super().chat(messages, tools, **chat_kwargs)
+        return await tier.chat(messages, tools, **chat_kwargs)
+
+    async def chat(
+        self,
+        messages: Sequence[Union[str, dict, Message]],
+        tools: Union[ToolRegistry, list[Tool]] = [],
+        **chat_kwargs
+    ) -> Message:
+        """Chat through the tiers until one is accepted, chat_kwargs are passed to LLM.chat of every tier"""
+        tools = ToolRegistry.of(tools)
+        last_level = len(self.tiers) - 1
+        for level, tier in enumerate(self.tiers):
+            started_at = time.monotonic()
+            try:
+                message = await self._tier_chat(tier, messages, tools, **chat_kwargs)
+            except ToolCallError as e:
+                if level == last_level:
+                    self._record(level, started_at, error=True)
+                    raise
+                self._record(level, started_at, escalation=e.reason)
+                logger.info(f"Cascade escalates from {tier.config.model}: {e}")
+                continue
+            except Exception:
+                self._record(level, started_at, error=True)
+                raise
+
+            if level == last_level or await self._accept(message, messages):
+                self._record(level, started_at)
+                return message
+            self._record(level, started_at, escalation="rejected")
+            logger.info(f"Cascade escalates from {tier.config.model}: the response was rejected")
+        raise RuntimeError("The last tier of the cascade did not answer")
+
+    def _record(self, level: int, started_at: float, escalation: Optional[str] = None, error: bool = False):
+        with self._stats_lock:
+            self._stats[level].record(time.monotonic() - started_at, escalation=escalation, error=error)
+
+    def cascade_stats(self) -> List[dict]:
+        """The outcomes of each tier, from the cheapest to the strongest"""
+        with self._stats_lock:
+            return [stats.snapshot() for stats in self._stats]
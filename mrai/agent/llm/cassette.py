@@ -0,0 +1,199 @@
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+import weakref
+from typing import IO, Any, AsyncIterator, Dict, List, Literal, Optional
+
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from mrai.agent.llm.cache import make_cache_key
+
+
+class CassetteMissError(LookupError):
+    """A strict cassette has no recording for the request"""
+
+
+class _RecordingStream:
+    """Pass the chunks of a live stream through, recording them with the delay before each chunk"""
+
+    def __init__(self, cassette: "Cassette", key: str, stream: Any, requested_at: float):
+        self._cassette = cassette
+        self._key = key
+        self._stream = stream
+        self._last_at = requested_at
+        self._chunks: List[Dict[str, Any]] = []
+        self._saved = False
+
+    async def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:
+        try:
+            async for chunk in self._stream:
+                now = time.monotonic()
+                self._chunks.append({"delay": round(now - self._last_at, 4), "data": chunk.model_dump(mode="json")})
+                self._last_at = now
+                yield chunk
+        finally:
+            self._save()
+
+    def _save(self):
+        if not self._saved:
+            self._saved = True
+            self._cassette.add(self._key, {"stream": True, "chunks": self._chunks})
+
+    async def close(self):
+        self._save()
+        await self._stream.close()
+
+
+class _ReplayStream:
+    """Replay the recorded chunks of a stream, at the recorded pace divided by the speed"""
+
+    def __init__(self, chunks: List[Dict[str, Any]], speed: float):
+        self._chunks = chunks
+        self._speed = speed
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:
+        for recorded in self._chunks:
+            if self._closed:
+                return
+            if self._speed > 0 and recorded["delay"] > 0:
+                await asyncio.sleep(recorded["delay"] / self._speed)
+            yield ChatCompletionChunk.model_validate(recorded["data"])
+
+    async def close(self):
+        self._closed = True
+
+
+class Cassette:
+    """
+    Record the requests of an LLM with their full responses, and replay them offline.
+    Streams are recorded chunk by chunk with their inter-chunk timing.
+    The cassette is a JSON lines file, gzip compressed when the path ends with .gz.
+    A request recorded several times is replayed in the recorded order, the last recording is repeated after that.
+    A recording cassette keeps the file open, close it to finish the file, it is closed at exit otherwise.
+
+    >>> llm = LLM(config, cassette=Cassette("flow.jsonl.gz", mode="record"))
+    >>> ...
+    >>> llm.cassette.close()
+    >>> llm = LLM(config, cassette=Cassette("flow.jsonl.gz", mode="replay", speed=10))
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: Literal["record", "replay"] = "replay",
+        strict: bool = True,
+        speed: float = 1.0
+    ):
+        """
+        Args:
+            mode: record sends every request live and appends it to the cassette, replay serves the recordings
+            strict: In replay mode, raise CassetteMissError for an unknown request instead of sending it live
+            speed: Replay speed of streams, 1 is the recorded pace, 0 replays without any delay
+        """
+        if speed < 0:
+            raise ValueError("speed must not be negative")
+        self.path = path
+        self.mode = mode
+        self.strict = strict
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        # opened by the first recording, one gzip member for the whole recording session
+        self._writer: Optional[IO[str]] = None
+        self._finalizer: Optional[weakref.finalize] = None
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        if os.path.exists(path):
+            self._load()
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        with self._open("r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recordings.setdefault(entry["key"], []).append(entry)
+
+    @staticmethod
+    def request_key(params: Dict[str, Any]) -> str:
+        return make_cache_key(**params)
+
+    def add(self, key: str, recording: Dict[str, Any]):
+        entry = {"key": key, **recording}
+        with self._lock:
+            self._recordings.setdefault(key, []).append(entry)
+            if self._writer is None:
+                self._writer = self._open("a")
+                self._finalizer = weakref.finalize(self, self._writer.close)
+            self._writer.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.recorded += 1
+
+    def flush(self):
+        """Write the buffered recordings to the file, a gzip file stays open and unfinished"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.flush()
+
+    def close(self):
+        """Finish the file, a later recording opens it again"""
+        with self._lock:
+            if self._finalizer is not None:
+                self._finalizer()
+                self._finalizer = None
+            self._writer = None
+
+    def _next_recording(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            recordings = self._recordings.get(key)
+            if not recordings:
+                return None
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            return recordings[min(cursor, len(recordings) - 1)]
+
+    def rewind(self):
+        """Replay every request from its first recording again"""
+        with self._lock:
+            self._cursors.clear()
+
+    async def create(self, client: AsyncOpenAI, params: Dict[str, Any]) -> Any:
+        """Drop-in replacement of client.chat.completions.create"""
+        key = self.request_key(params)
+        if self.mode == "replay":
+            recording = self._next_recording(key)
+            if recording is not None:
+                self.hits += 1
+                if recording["stream"]:
+                    return _ReplayStream(recording["chunks"], self.speed)
+                return ChatCompletion.model_validate(recording["response"])
+            self.misses += 1
+            if self.strict:
+                raise CassetteMissError(f"No recording for the request {key} in {self.path}")
+            return await client.chat.completions.create(**params)
+
+        requested_at = time.monotonic()
+        response = await client.chat.completions.create(**params)
+        if params.get("stream"):
+            return _RecordingStream(self, key, response, requested_at)
+        self.add(key, {"stream": False, "response": response.model_dump(mode="json")})
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "requests": sum(len(recordings) for recordings in self._recordings.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "recorded": self.recorded,
+        }
@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+from mrai.agent.llm.llm_config import LLMConfig
+
+
+_CONNECT_EVENTS = ("connect_tcp.complete", "connect_unix_socket.complete")
+
+
+class _ConnectionCounts:
+    """The requests of an endpoint and the connections they opened, over the clients of every event loop"""
+
+    __slots__ = ("requests", "connections_opened")
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """
+    HTTP transport that counts how many requests were served by a freshly opened connection.
+    A request opened one when httpcore reports a completed connect through its public trace extension.
+    """
+
+    def __init__(self, counts: Optional[_ConnectionCounts] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.counts = counts or _ConnectionCounts()
+
+    @property
+    def requests(self) -> int:
+        return self.counts.requests
+
+    @property
+    def connections_opened(self) -> int:
+        return self.counts.connections_opened
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        caller_trace = request.extensions.get("trace")
+        opened = False
+
+        async def trace(event_name: str, info: dict):
+            nonlocal opened
+            if event_name.endswith(_CONNECT_EVENTS):
+                opened = True
+            if caller_trace is not None:
+                await caller_trace(event_name, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        response = await super().handle_async_request(request)
+        self.counts.requests += 1
+        if opened:
+            self.counts.connections_opened += 1
+        return response
+
+
+class ClientPool:
+    """
+    Process-wide registry of OpenAI clients.
+    Every (base_url, api_key, pool settings) combination shares one pooled httpx.AsyncClient per event loop,
+    so agents that talk to the same endpoint reuse TCP/TLS connections.
+    The connections of a client belong to the loop that opened them, so every loop, e.g. every asyncio.run,
+    gets its own clients, the clients of a finished loop are dropped with it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # event loop -> (key, max_retries) -> client, the clients asked for outside of a loop are under None
+        self._clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, AsyncOpenAI]] = weakref.WeakKeyDictionary()
+        self._unbound_clients: Dict[Tuple, AsyncOpenAI] = {}
+        self._counts: Dict[Tuple, _ConnectionCounts] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(config: LLMConfig) -> Tuple:
+        return (
+            config.base_url,
+            config.api_key,
+            config.pool_max_connections,
+            config.pool_max_keepalive_connections,
+            config.pool_keepalive_expiry,
+            config.http2,
+            config.connect_timeout,
+            config.read_timeout,
+        )
+
+    def _loop_clients(self) -> Dict[Tuple, AsyncOpenAI]:
+        """The clients of the running event loop, the caller holds the lock"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self._unbound_clients
+        clients = self._clients.get(loop)
+        if clients is None:
+            clients = self._clients[loop] = {}
+        return clients
+
+    def get_client(self, config: LLMConfig, max_retries: Optional[int] = None) -> AsyncOpenAI:
+        """
+        Get the shared client of the endpoint for the running event loop, create it on first use
+
+        Args:
+            max_retries: The retries of the SDK, None keeps its default, the clients of every value share the connections
+        """
+        key = self._key(config)
+        with self._lock:
+            clients = self._loop_clients()
+            client = clients.get((key, max_retries))
+            if client is not None:
+                self.hits += 1
+                return client
+            self.misses += 1
+            base_client = clients.get((key, None))
+            if base_client is None:
+                base_client = clients[(key, None)] = self._create_client(config, key)
+            client = base_client if max_retries is None else base_client.with_options(max_retries=max_retries)
+            clients[(key, max_retries)] = client
+            return client
+
+    def _create_client(self, config: LLMConfig, key: Tuple) -> AsyncOpenAI:
+        """The caller holds the lock"""
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = _ConnectionCounts()
+        transport = _CountingTransport(
+            counts,
+            http2=config.http2,
+            limits=httpx.Limits(
+                max_connections=config.pool_max_connections,
+                max_keepalive_connections=config.pool_max_keepalive_connections,
+                keepalive_expiry=config.pool_keepalive_expiry,
+            ),
+        )
+        http_client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(
+                config.read_timeout,
+                connect=config.connect_timeout,
+            ),
+            follow_redirects=True,
+        )
+        return AsyncOpenAI(
+            api_key=config.api_key,
+            base_url=config.base_url,
+            http_client=http_client,
+        )
+
+    def stats(self) -> dict:
+        """Pool hit/miss and connection reuse counters"""
+        with self._lock:
+            endpoints = {}
+            for key, counts in self._counts.items():
+                base_url = key[0]
+                entry = endpoints.setdefault(base_url, {"requests": 0, "connections_opened": 0, "connections_reused": 0})
+                entry["requests"] += counts.requests
+                entry["connections_opened"] += counts.connections_opened
+                entry["connections_reused"] += max(counts.requests - counts.connections_opened, 0)
+            return {
+                "clients": sum(len(clients) for clients in self._clients.values()) + len(self._unbound_clients),
+                "hits": self.hits,
+                "misses": self.misses,
+                "endpoints": endpoints,
+            }
+
+    async def aclose(self):
+        """
+        Close the pooled clients of the running event loop and forget the others,
+        their connections belong to loops this one cannot close them on. The next get_client call creates new ones.
+        """
+        with self._lock:
+            loop = asyncio.get_running_loop()
+            clients = [client for (_, max_retries), client in self._clients.get(loop, {}).items() if max_retries is None]
+            clients += [client for (_, max_retries), client in self._unbound_clients.items() if max_retries is None]
+            self._clients.clear()
+            self._unbound_clients.clear()
+        for client in clients:
+            await client.close()
+
+
+# the default process-wide pool used by every LLM
+client_pool = ClientPool()
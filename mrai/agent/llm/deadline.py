@@ -0,0 +1,107 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceededError(TimeoutError):
+    """The deadline of a call, or of the flow it belongs to, has passed"""
+
+
+def resolve_deadline(deadline: Optional[float] = None, timeout: Optional[float] = None) -> Optional[float]:
+    """
+    The earliest of the deadline and now + timeout, as a time.monotonic() timestamp, None when neither is given
+
+    Args:
+        deadline: An absolute time.monotonic() timestamp, e.g. the deadline of the flow
+        timeout: A duration in seconds from now, e.g. the timeout of one call
+    """
+    if timeout is not None:
+        call_deadline = time.monotonic() + timeout
+        deadline = call_deadline if deadline is None else min(deadline, call_deadline)
+    return deadline
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """The seconds left before the deadline, raise DeadlineExceededError when it has passed"""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceededError("The deadline has passed")
+    return left
+
+
+async def wait_with_deadline(awaitable: Awaitable[T], deadline: Optional[float]) -> T:
+    """Await with the time left before the deadline, the awaitable is cancelled when the deadline passes"""
+    if deadline is None:
+        return await awaitable
+    try:
+        timeout = remaining(deadline)
+    except DeadlineExceededError:
+        # never started, close it to avoid the "never awaited" warning
+        close = getattr(awaitable, "close", None)
+        if close is not None:
+            close()
+        raise
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError as e:
+        raise DeadlineExceededError("The deadline has passed") from e
+
+
+async def iterate_with_deadline(stream: AsyncIterator[T], deadline: Optional[float]) -> AsyncIterator[T]:
+    """
+    Yield the chunks of the stream until the deadline.
+    When the deadline passes the pending read is cancelled, the stream is closed and DeadlineExceededError is raised.
+    """
+    iterator = stream.__aiter__()
+    if deadline is None:
+        try:
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        return
+
+    # one timer for the whole iteration rather than a wait_for task per chunk,
+    # it only cancels a pending read, never the caller while it handles a yielded chunk
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    state = {"reading": False, "expired": False}
+
+    def expire():
+        state["expired"] = True
+        if state["reading"]:
+            task.cancel()
+
+    timer = None
+    try:
+        timer = loop.call_at(loop.time() + remaining(deadline), expire)
+        while True:
+            if state["expired"]:
+                raise DeadlineExceededError("The deadline has passed")
+            state["reading"] = True
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            except asyncio.CancelledError as e:
+                if not state["expired"]:
+                    raise
+                uncancel = getattr(task, "uncancel", None)
+                if uncancel is not None:
+                    uncancel()
+                raise DeadlineExceededError("The deadline has passed") from e
+            finally:
+                state["reading"] = False
+            yield chunk
+    finally:
+        if timer is not None:
+            timer.cancel()
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
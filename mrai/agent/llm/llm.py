@@ -1,15 +1,61 @@
 from openai import AsyncOpenAI
+from loguru import logger
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionToolParam
 from mrai.agent.schema import Message, LLMResponse, ToolCall, Tool
-from typing import AsyncIterator, List, Union, Sequence, cast, Iterable
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, TypeVar, Union, Sequence, cast, Iterable
 from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.client_pool import client_pool
+from mrai.agent.llm.cache import ResponseCache, make_cache_key
+from mrai.agent.llm.single_flight import single_flight
+from mrai.agent.llm.rate_limit import Priority, estimate_tokens, rate_limiters
+from mrai.agent.llm.retry import LatencyTracker, RetryStats, call_hedged, call_with_retry, stream_with_retry
+from mrai.agent.llm.router import Endpoint, EndpointConfig, NoEndpointAvailableError, Router
+from mrai.agent.llm.stream import StreamChunk, ToolCallAssembler, ToolCallComplete, ToolCallStarted, coalesce_chunks
+from mrai.agent.tool.tool_registry import ToolRegistry
+from mrai.agent.llm.batch import BatchRun, StreamBatchRun
+from mrai.agent.llm.cassette import Cassette
+from mrai.agent.llm.semantic_cache import SemanticCache
+from mrai.agent.llm.usage import PromptCacheStats
+from mrai.agent.llm.telemetry import CallRecord, Telemetry, default_telemetry
+from mrai.agent.memory.token_counter import default_token_counter
+from mrai.agent.llm.deadline import DeadlineExceededError, iterate_with_deadline, resolve_deadline, wait_with_deadline
 from mrai.agent.llm import prompt
+import asyncio
+import functools
 import json
+import time
+
+T = TypeVar("T")
+
+
+class ToolCallError(ValueError):
+    """
+    The tool call of a response can not be bound to a tool.
+    reason is "unknown_tool" when the tool does not exist, "invalid_arguments" when the arguments are not a JSON object.
+    """
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
 
 
 class LLM:
 
-    def __init__(self, config: LLMConfig):
+    def __init__(
+        self,
+        config: LLMConfig,
+        cache: Optional[ResponseCache] = None,
+        cassette: Optional[Cassette] = None,
+        telemetry: Optional[Telemetry] = None,
+        semantic_cache: Optional[SemanticCache] = None
+    ):
+        """
+        Args:
+            cache: The opt-in response cache of chat
+            cassette: Record or replay the upstream requests
+            semantic_cache: The opt-in cache of chat for near-duplicate last user turns, consulted after the response cache
+            telemetry: Where the usage and timing of every call is recorded, defaults to the process-wide default_telemetry
+        """
         # validate config
         if config.api_key is None or config.api_key == "":
             raise ValueError("api_key is required")
@@ -18,12 +64,58 @@ class LLM:
         if config.model is None or config.model == "":
             raise ValueError("model is required")
         self.config = config
+        # opt-in response cache of chat
+        self.cache = cache
+        # record or replay the upstream requests
+        self.cassette = cassette
+        self.semantic_cache = semantic_cache
+        self.retry_stats = RetryStats()
+        self.prompt_cache_stats = PromptCacheStats()
+        self.telemetry = telemetry or default_telemetry
+        self.latency_tracker = LatencyTracker(config.hedge_policy.window if config.hedge_policy else 200)
 
-        self.client = AsyncOpenAI(
-            api_key=config.api_key,
+        endpoint_configs = config.endpoints or [EndpointConfig(base_url=config.base_url)]
+        self.router = Router([
+            self._create_endpoint(endpoint_config, len(endpoint_configs) > 1)
+            for endpoint_config in endpoint_configs
+        ])
+        # the first endpoint is the default one
+        self.rate_limiter = self.router.endpoints[0].rate_limiter
+
+    def _create_endpoint(self, endpoint_config: EndpointConfig, failover: bool) -> Endpoint:
+        config = self.config.model_copy(update={
+            "base_url": endpoint_config.base_url,
+            "api_key": endpoint_config.api_key or self.config.api_key,
+            "model": endpoint_config.model or self.config.model,
+        })
+        # the retry policy and the failover replace the retries of the SDK
+        max_retries = 0 if config.retry_policy is not None or failover else None
+        client = None
+        client_factory = None
+        if config.shared_client:
+            # the pooled connections belong to an event loop, the endpoint gets the client of the running one
+            client_factory = functools.partial(client_pool.get_client, config, max_retries)
+        else:
+            client = AsyncOpenAI(
+                api_key=config.api_key,
+                base_url=config.base_url,
+            )
+            if max_retries is not None:
+                client = client.with_options(max_retries=max_retries)
+        return Endpoint(
             base_url=config.base_url,
+            model=config.model,
+            client=client,
+            rate_limiter=rate_limiters.get(config.base_url, config.model, config.rpm_limit, config.tpm_limit),
+            policy=config.circuit_breaker,
+            client_factory=client_factory
         )
 
+    @property
+    def client(self) -> AsyncOpenAI:
+        """The client of the default endpoint, for the running event loop"""
+        return self.router.endpoints[0].client
+
     @staticmethod
     def format_messages(messages: Sequence[Union[str, dict, Message]]) -> List[ChatCompletionMessageParam]:
         formatted_messages: List[ChatCompletionMessageParam] = []
@@ -42,100 +134,562 @@ class LLM:
         return formatted_messages
 
     @staticmethod
-    def _process_tool_call(tool_call, tools: List[Tool]) -> ToolCall:
+    def _process_tool_call(tool_call: dict, tools: Union[ToolRegistry, List[Tool]]) -> ToolCall:
         """Process a single tool call and return a ToolCall object"""
-        tool = next((tool for tool in tools if tool.name == tool_call.function.name), None)
+        function = tool_call["function"]
+        tool = ToolRegistry.of(tools).get(function["name"])
         if not tool:
-            raise ValueError(f"Tool {tool_call.function.name} not found")
+            raise ToolCallError(f"Tool {function['name']} not found", "unknown_tool")
 
         try:
-            return ToolCall(
-                id=tool_call.id,
-                type=tool_call.type,
-                function=ToolCall.ToolCallFunction(
-                    name=tool_call.function.name,
-                    arguments=json.loads(tool_call.function.arguments),
-                ),
-                tool=tool
-            )
+            arguments = json.loads(function["arguments"]) if function["arguments"] else {}
         except json.JSONDecodeError as e:
-            print(f"Invalid JSON in tool call arguments: {tool_call.function.arguments}")
-            raise ValueError(f"Invalid JSON in tool call arguments: {e}")
+            print(f"Invalid JSON in tool call arguments: {function['arguments']}")
+            raise ToolCallError(f"Invalid JSON in tool call arguments: {e}", "invalid_arguments")
+        if not isinstance(arguments, dict):
+            raise ToolCallError(f"Tool call arguments must be a JSON object, got {function['arguments']}", "invalid_arguments")
+        return ToolCall.trusted(
+            id=tool_call["id"],
+            type=tool_call["type"],
+            name=function["name"],
+            arguments=arguments,
+            tool=tool
+        )
 
-    async def chat(self, messages: Sequence[Union[str, dict, Message]], tools: list[Tool] = []) -> Message:
-        dict_messages: List[ChatCompletionMessageParam] = self.format_messages(messages)
-        response = await self.client.chat.completions.create(
+    @classmethod
+    def _build_message(cls, payload: dict, tools: ToolRegistry) -> Message:
+        """Build the assistant message from the response payload, binding the tool calls to the given tools"""
+        tool_calls: list[ToolCall] = []
+        if payload["tool_calls"] and tools:
+            tool_calls.extend(
+                cls._process_tool_call(tool_call, tools)
+                for tool_call in payload["tool_calls"]
+            )
+        return Message.trusted(
+            role=payload["role"],
+            content=payload["content"],
+            tool_calls=tool_calls
+        )
+
+    def _cache_key(self, dict_messages: List[ChatCompletionMessageParam], tools: ToolRegistry) -> str:
+        stop = self._stop_sequences()
+        return make_cache_key(
             model=self.config.model,
             messages=dict_messages,
+            tools=tools.fingerprint,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+            # only when set, so the keys of the entries cached without stop sequences do not change
+            **({"stop": stop} if stop else {})
+        )
+
+    def _semantic_query(self, dict_messages: List[ChatCompletionMessageParam], tools: ToolRegistry) -> Optional[tuple[str, str]]:
+        """
+        The scope and the text of the semantic cache, None when the last message is not a text user turn.
+        The scope is an exact key of everything but the last user turn, so only the user's wording may differ.
+        """
+        if not dict_messages:
+            return None
+        last = dict_messages[-1]
+        if last.get("role") != "user" or not isinstance(last.get("content"), str):
+            return None
+        stop = self._stop_sequences()
+        scope = make_cache_key(
+            model=self.config.model,
+            messages=dict_messages[:-1],
+            tools=tools.fingerprint,
             temperature=self.config.temperature,
             max_tokens=self.config.max_tokens,
-            tools=cast(Iterable[ChatCompletionToolParam], [tool.to_dict() for tool in tools]) if tools else [],
-            tool_choice="auto"
+            **({"stop": stop} if stop else {})
+        )
+        return scope, last["content"]
+
+    def _stop_sequences(self, stop: Optional[Sequence[str]] = None) -> Optional[list[str]]:
+        """The stop sequences of config.stop and of the call, None when there are none"""
+        sequences: list[str] = []
+        for sequence in [*(self.config.stop or []), *(stop or [])]:
+            if sequence and sequence not in sequences:
+                sequences.append(sequence)
+        return sequences or None
+
+    async def _acquire_rate_limit(
+        self,
+        endpoint: Endpoint,
+        dict_messages: List[ChatCompletionMessageParam],
+        tool_schemas: list[dict],
+        priority: Optional[int]
+    ) -> int:
+        """Wait for the rate limiter of the endpoint, return the tokens charged"""
+        if endpoint.rate_limiter is None:
+            return 0
+        return await endpoint.rate_limiter.acquire(
+            estimate_tokens(dict_messages, tool_schemas, self.config.max_tokens),
+            priority=self.config.priority if priority is None else priority
         )
+
+    @staticmethod
+    def _refund_rate_limit(endpoint: Endpoint, charged_tokens: Optional[int]):
+        """Give back the tokens charged for a request that failed without a usage"""
+        if endpoint.rate_limiter is not None and charged_tokens:
+            endpoint.rate_limiter.refund(charged_tokens)
+
+    def _select_endpoint(self, tried: List[Endpoint], last_error: Optional[BaseException]) -> Endpoint:
+        try:
+            return self.router.select(exclude=tried)
+        except NoEndpointAvailableError:
+            # every endpoint was tried, surface the real error
+            if last_error is not None:
+                raise last_error
+            raise
+
+    async def _call_with_policies(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run an upstream call with the hedge and retry policies of the config"""
+        hedge_policy = self.config.hedge_policy
+        attempt = fn
+        if hedge_policy is not None:
+            attempt = lambda: call_hedged(fn, hedge_policy, self.latency_tracker, self.retry_stats)
+        if self.config.retry_policy is not None:
+            return await call_with_retry(attempt, self.config.retry_policy, self.retry_stats)
+        return await attempt()
+
+    def _open_stream(
+        self,
+        dict_messages: List[ChatCompletionMessageParam],
+        flag: bool,
+        priority: Optional[int] = None,
+        tool_schemas: Optional[list[dict]] = None,
+        typed: bool = False,
+        prompt_cache_stats: Optional[PromptCacheStats] = None,
+        call_record: Optional[CallRecord] = None,
+        stop: Optional[list[str]] = None
+    ) -> AsyncIterator[Union[str, StreamChunk, ToolCallStarted, ToolCallComplete]]:
+        """Open the upstream stream, retrying the failures that happen before the first chunk"""
+        if self.config.retry_policy is not None:
+            return stream_with_retry(
+                lambda: self._request_stream(dict_messages, flag, priority, tool_schemas, typed, prompt_cache_stats, call_record, stop),
+                self.config.retry_policy,
+                self.retry_stats
+            )
+        return self._request_stream(dict_messages, flag, priority, tool_schemas, typed, prompt_cache_stats, call_record, stop)
+
+    async def _create_completion(self, endpoint: Endpoint, **params) -> Any:
+        """Send the request to the endpoint, or through the cassette when there is one"""
+        if self.cassette is not None:
+            return await self.cassette.create(endpoint.client, params)
+        return await endpoint.client.chat.completions.create(**params)
+
+    def _record_usage(
+        self,
+        usage: Any,
+        model: str,
+        prompt_cache_stats: Optional[PromptCacheStats] = None,
+        call_record: Optional[CallRecord] = None
+    ):
+        self.prompt_cache_stats.record(usage)
+        if prompt_cache_stats is not None:
+            prompt_cache_stats.record(usage)
+        if call_record is not None:
+            call_record.set_usage(usage, model)
+
+    async def _request_chat(
+        self,
+        dict_messages: List[ChatCompletionMessageParam],
+        tool_schemas: list[dict],
+        priority: Optional[int] = None,
+        prompt_cache_stats: Optional[PromptCacheStats] = None,
+        call_record: Optional[CallRecord] = None
+    ) -> dict:
+        """Send the chat request and return the payload of the assistant message"""
+        stop = self._stop_sequences()
+        tried: List[Endpoint] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            endpoint = self._select_endpoint(tried, last_error)
+            charged_tokens = None
+            try:
+                charged_tokens = await self._acquire_rate_limit(endpoint, dict_messages, tool_schemas, priority)
+                requested_at = time.monotonic()
+                response = await self._create_completion(
+                    endpoint,
+                    model=endpoint.model,
+                    messages=dict_messages,
+                    temperature=self.config.temperature,
+                    max_tokens=self.config.max_tokens,
+                    tools=cast(Iterable[ChatCompletionToolParam], tool_schemas) if tool_schemas else [],
+                    tool_choice="auto",
+                    **({"stop": stop} if stop else {})
+                )
+            except Exception as e:
+                self._refund_rate_limit(endpoint, charged_tokens)
+                self.router.record(endpoint, error=e)
+                if not self.router.should_failover(e):
+                    raise
+                # fail over to the next endpoint
+                tried.append(endpoint)
+                last_error = e
+                self.router.failovers += 1
+                continue
+            finally:
+                self.router.release(endpoint)
+            self.router.record(endpoint, latency=time.monotonic() - requested_at)
+            break
+
+        if response.usage is not None:
+            self._record_usage(response.usage, endpoint.model, prompt_cache_stats, call_record)
+        if endpoint.rate_limiter is not None and response.usage is not None:
+            endpoint.rate_limiter.settle(charged_tokens, response.usage.total_tokens)
         if not response.choices:
             raise ValueError("No response from OpenAI")
-        
-        tool_calls: list[ToolCall] = []
-        content: str = ""
         if not response.choices[0]:
             raise ValueError("No response from OpenAI")
         # default use the first choice
         choice = response.choices[0]
-        if choice.message.content:
-            content = choice.message.content
-        if choice.message.tool_calls and tools:
-            tool_calls.extend(
-                self._process_tool_call(tool_call, tools)
+        return {
+            "role": choice.message.role,
+            "content": choice.message.content or "",
+            "tool_calls": [
+                {
+                    "id": tool_call.id,
+                    "type": tool_call.type,
+                    "function": {
+                        "name": tool_call.function.name,
+                        "arguments": tool_call.function.arguments,
+                    },
+                }
                 for tool_call in choice.message.tool_calls
-            )
-        
-        assistant_message = Message(
-            role=choice.message.role,
-            content=content,
-            tool_calls=tool_calls
+            ] if choice.message.tool_calls else [],
+        }
+
+    async def chat(
+        self,
+        messages: Sequence[Union[str, dict, Message]],
+        tools: Union[ToolRegistry, list[Tool]] = [],
+        use_cache: bool = True,
+        priority: Optional[int] = None,
+        prompt_cache_stats: Optional[PromptCacheStats] = None,
+        agent_name: Optional[str] = None,
+        flow_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None
+    ) -> Message:
+        """
+        Args:
+            use_cache: Set to False to bypass the response and semantic caches for this call, the fresh response still refreshes them
+            priority: The rate limiter lane of this call, see Priority, defaults to config.priority
+            prompt_cache_stats: Also record the provider's prompt cache hits of this call here, e.g. the stats of a flow
+            agent_name: The agent of the call, tags its telemetry record
+            flow_id: The flow of the call, tags its telemetry record
+            timeout: The timeout of the call in seconds, retries included, defaults to config.call_timeout
+            deadline: The time.monotonic() timestamp the call must end by, e.g. the deadline of the flow,
+                the earliest of the deadline and the timeout applies, DeadlineExceededError is raised when it passes
+        """
+        deadline = resolve_deadline(deadline, timeout if timeout is not None else self.config.call_timeout)
+        dict_messages: List[ChatCompletionMessageParam] = self.format_messages(messages)
+        tools = ToolRegistry.of(tools)
+        tool_schemas = tools.schemas()
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self._cache_key(dict_messages, tools)
+            if use_cache:
+                payload = self.cache.get(cache_key)
+                if payload is not None:
+                    return self._build_message(payload, tools)
+
+        semantic_query = None
+        semantic_hit = None
+        if self.semantic_cache is not None:
+            semantic_query = self._semantic_query(dict_messages, tools)
+            if use_cache and semantic_query is not None:
+                semantic_hit = self.semantic_cache.lookup(*semantic_query)
+                if semantic_hit is not None and not self.semantic_cache.should_audit():
+                    return self._build_message(semantic_hit.payload, tools)
+
+        call_record = CallRecord(self.config.model, agent_name, flow_id)
+        request = lambda: self._call_with_policies(
+            lambda: self._request_chat(dict_messages, tool_schemas, priority, prompt_cache_stats, call_record)
         )
+        try:
+            if self.config.single_flight:
+                flight_key = make_cache_key(
+                    scope="chat",
+                    base_url=self.config.base_url,
+                    api_key=self.config.api_key,
+                    request=cache_key or self._cache_key(dict_messages, tools),
+                )
+                payload = await wait_with_deadline(single_flight.do(flight_key, request, call_record), deadline)
+            else:
+                payload = await wait_with_deadline(request(), deadline)
+        except Exception as e:
+            call_record.error = repr(e)
+            raise
+        finally:
+            self.telemetry.record(call_record)
+        # build the message before caching, so a response with invalid tool calls is never cached
+        assistant_message = self._build_message(payload, tools)
+        if cache_key is not None:
+            self.cache.set(cache_key, payload)
+        if semantic_hit is not None:
+            # an audited hit, the fresh response answers and the cached one is checked against it
+            if not self.semantic_cache.audit(semantic_hit, payload):
+                logger.warning(f"Semantic cache false hit: {semantic_hit}")
+                self.semantic_cache.store(*semantic_query, payload)
+        elif semantic_query is not None:
+            self.semantic_cache.store(*semantic_query, payload)
         return assistant_message
-    
+
+    def chat_many(
+        self,
+        conversations: Sequence[Sequence[Union[str, dict, Message]]],
+        tools: Union[ToolRegistry, list[Tool]] = [],
+        max_concurrency: int = 8,
+        **chat_kwargs
+    ) -> BatchRun:
+        """
+        Chat on many independent conversations, at most max_concurrency at a time.
+        Iterate the returned run to get a BatchItem per conversation as soon as it completes,
+        calls go to the batch rate limiter lane unless another priority is given.
+        """
+        chat_kwargs.setdefault("priority", Priority.BATCH)
+        return BatchRun(self, conversations, ToolRegistry.of(tools), max_concurrency, chat_kwargs)
+
+    def stream_many(
+        self,
+        conversations: Sequence[Sequence[Union[str, dict, Message]]],
+        tools: Union[ToolRegistry, list[Tool]] = [],
+        max_concurrency: int = 8,
+        **stream_kwargs
+    ) -> StreamBatchRun:
+        """Stream many independent conversations, at most max_concurrency at a time, see StreamBatchRun"""
+        stream_kwargs.setdefault("priority", Priority.BATCH)
+        return StreamBatchRun(self, conversations, ToolRegistry.of(tools), max_concurrency, stream_kwargs)
+
     async def stream_chat(
         self, messages: Sequence[Union[str, dict, Message]],
-        tools: list[Tool] = [],
-        flag: bool = False
-    ) -> AsyncIterator[str]:
+        tools: Union[ToolRegistry, list[Tool]] = [],
+        flag: bool = False,
+        priority: Optional[int] = None,
+        native_tools: Optional[bool] = None,
+        typed: bool = False,
+        coalesce_chars: int = 0,
+        coalesce_interval: float = 0.0,
+        prompt_cache_stats: Optional[PromptCacheStats] = None,
+        agent_name: Optional[str] = None,
+        flow_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        stop: Optional[list[str]] = None
+    ) -> AsyncIterator[Union[str, StreamChunk, ToolCallStarted, ToolCallComplete]]:
+        """
+        Args:
+            flag: Prefix each chunk with its type, "content::..." or "reasoning_content::...", superseded by typed
+            native_tools: Pass the tools with the API's native tool calling and yield ToolCallStarted / ToolCallComplete
+                events, instead of describing them in the prompt, defaults to config.native_tool_calls
+            typed: Yield StreamChunk objects carrying the kind and the text of each delta instead of strings
+            coalesce_chars: With typed, merge consecutive deltas of the same kind up to this many characters
+            coalesce_interval: With typed, merge consecutive deltas of the same kind for at most this many seconds
+            prompt_cache_stats: Also record the provider's prompt cache hits of this call here, e.g. the stats of a flow
+            agent_name: The agent of the call, tags its telemetry record
+            flow_id: The flow of the call, tags its telemetry record
+            timeout: The timeout of the whole stream in seconds, defaults to config.call_timeout
+            deadline: The time.monotonic() timestamp the stream must end by, e.g. the deadline of the flow,
+                the earliest of the deadline and the timeout applies, DeadlineExceededError is raised when it passes
+            stop: Stop sequences of this call, added to config.stop, the stop sequence itself is not streamed
+
+        Closing the generator before its end, e.g. breaking out of `async for` and calling `aclose()`,
+        closes the upstream response right away, the provider stops generating and the connection is released.
+        """
+        if typed and (coalesce_chars > 0 or coalesce_interval > 0):
+            async for chunk in coalesce_chunks(
+                self.stream_chat(
+                    messages, tools, flag, priority, native_tools, typed=True,
+                    prompt_cache_stats=prompt_cache_stats, agent_name=agent_name, flow_id=flow_id,
+                    timeout=timeout, deadline=deadline, stop=stop
+                ),
+                max_chars=coalesce_chars,
+                max_interval=coalesce_interval
+            ):
+                yield chunk
+            return
+
         dict_messages: List[ChatCompletionMessageParam] = self.format_messages(messages)
-        # add tool calls rule to the messages
-        if tools:
-            dict_messages.insert(0, {
+        if native_tools is None:
+            native_tools = self.config.native_tool_calls
+        tools = ToolRegistry.of(tools)
+        tool_schemas: list[dict] = []
+        if tools and native_tools:
+            tool_schemas = tools.schemas()
+        elif tools:
+            # add tool calls rule to the messages
+            position = 0
+            prefix_cache_layout = self.config.prompt_layout == "prefix_cache"
+            starts_with_prompt = bool(dict_messages) and dict_messages[0]["role"] == "system"
+            if prefix_cache_layout and starts_with_prompt:
+                # keep the agent prompt first, the tool rule is as static as the prompt
+                position = 1
+            dict_messages.insert(position, {
             "role": "system",
-            "content": prompt.TOOL_CALL_RULE.format(
-                tools = json.dumps(
-                    [tool.to_dict() for tool in tools] if tools else [],
-                    ensure_ascii=False,
-                    indent=2
-                ))
+            "content": prompt.TOOL_CALL_RULE.format(tools=tools.schemas_json(indent=2))
             })
 
+        deadline = resolve_deadline(deadline, timeout if timeout is not None else self.config.call_timeout)
+        stop = self._stop_sequences(stop)
+        call_record = CallRecord(self.config.model, agent_name, flow_id, stream=True)
+        if not self.config.single_flight:
+            upstream = self._open_stream(dict_messages, flag, priority, tool_schemas, typed, prompt_cache_stats, call_record, stop)
+        else:
+            flight_key = make_cache_key(
+                scope="stream_chat",
+                base_url=self.config.base_url,
+                api_key=self.config.api_key,
+                model=self.config.model,
+                messages=dict_messages,
+                tools=tools.fingerprint if tool_schemas else None,
+                temperature=self.config.temperature,
+                max_tokens=self.config.max_tokens,
+                reasoning_effort=self.config.reasoning_effort,
+                flag=flag,
+                typed=typed,
+                stop=stop,
+            )
+            upstream = single_flight.stream(
+                flight_key,
+                lambda: self._open_stream(dict_messages, flag, priority, tool_schemas, typed, prompt_cache_stats, call_record, stop),
+                call_record
+            )
+        try:
+            async for chunk in iterate_with_deadline(upstream, deadline):
+                call_record.mark_first_token()
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            call_record.abandoned = True
+            raise
+        except Exception as e:
+            call_record.error = repr(e)
+            if isinstance(e, DeadlineExceededError):
+                call_record.abandoned = True
+            raise
+        finally:
+            self.telemetry.record(call_record)
+
+    @staticmethod
+    def _deliver(event: Any, tool_call_fragments: dict[int, list[str]]) -> Any:
+        if isinstance(event, ToolCallComplete):
+            # the caller has the whole tool call
+            tool_call_fragments.pop(event.index, None)
+        return event
+
+    async def _request_stream(
+        self,
+        dict_messages: List[ChatCompletionMessageParam],
+        flag: bool,
+        priority: Optional[int] = None,
+        tool_schemas: Optional[list[dict]] = None,
+        typed: bool = False,
+        prompt_cache_stats: Optional[PromptCacheStats] = None,
+        call_record: Optional[CallRecord] = None,
+        stop: Optional[list[str]] = None
+    ) -> AsyncIterator[Union[str, StreamChunk, ToolCallStarted, ToolCallComplete]]:
+        """Send the streaming request and yield the formatted chunks, failing over while no chunk was received"""
         # Prepare conditional arguments
         extra_params = {}
         if self.config.reasoning_effort is not None:
             extra_params["reasoning_effort"] = self.config.reasoning_effort
+        stream_usage = self.config.stream_usage
+        if stream_usage is None:
+            # the rate limiter settles a stream with its usage
+            stream_usage = self.config.tpm_limit is not None
+        if stream_usage:
+            extra_params["stream_options"] = {"include_usage": True}
+        if tool_schemas:
+            extra_params["tools"] = tool_schemas
+            extra_params["tool_choice"] = "auto"
+        if stop:
+            extra_params["stop"] = stop
 
-        async for chunk in await self.client.chat.completions.create(
-            model=self.config.model,
-            messages=dict_messages,
-            temperature=self.config.temperature,
-            max_tokens=self.config.max_tokens,
-            stream=True,
-            **extra_params # Unpack only the conditional parameters
-        ):
-            if chunk.choices[0].delta.content:
-                if flag:
-                    yield "content::" + chunk.choices[0].delta.content
-                else:
-                    yield chunk.choices[0].delta.content
-            if chunk.choices[0].delta.model_extra:
-                for key, value in chunk.choices[0].delta.model_extra.items():
-                    if value:
-                        if flag:
-                            yield f"{key}::{value}"
+        tried: List[Endpoint] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            endpoint = self._select_endpoint(tried, last_error)
+            started = False
+            tool_call_assembler = ToolCallAssembler()
+            # tool call index -> the fragments received, they reach the caller with the ToolCallComplete event
+            tool_call_fragments: dict[int, list[str]] = {}
+            upstream = None
+            charged_tokens = None
+            try:
+                charged_tokens = await self._acquire_rate_limit(endpoint, dict_messages, tool_schemas or [], priority)
+                requested_at = time.monotonic()
+                upstream = await self._create_completion(
+                    endpoint,
+                    model=endpoint.model,
+                    messages=dict_messages,
+                    temperature=self.config.temperature,
+                    max_tokens=self.config.max_tokens,
+                    stream=True,
+                    **extra_params # Unpack only the conditional parameters
+                )
+                async for chunk in upstream:
+                    if not started:
+                        started = True
+                        self.router.record(endpoint, latency=time.monotonic() - requested_at)
+                    if chunk.usage is not None:
+                        self._record_usage(chunk.usage, endpoint.model, prompt_cache_stats, call_record)
+                    if chunk.usage is not None and endpoint.rate_limiter is not None:
+                        endpoint.rate_limiter.settle(charged_tokens, chunk.usage.total_tokens)
+                    # the usage chunk comes without choices
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if chunk.choices[0].delta.content:
+                        if typed:
+                            yield StreamChunk("content", chunk.choices[0].delta.content)
+                        elif flag:
+                            yield "content::" + chunk.choices[0].delta.content
                         else:
-                            yield value
+                            yield chunk.choices[0].delta.content
+                    if chunk.choices[0].delta.model_extra:
+                        for key, value in chunk.choices[0].delta.model_extra.items():
+                            if value:
+                                if typed:
+                                    yield StreamChunk(key, value)
+                                elif flag:
+                                    yield f"{key}::{value}"
+                                else:
+                                    yield value
+                    for delta_tool_call in delta.tool_calls or []:
+                        if delta_tool_call.function is not None:
+                            tool_call_fragments.setdefault(delta_tool_call.index, []).extend(
+                                (delta_tool_call.function.name or "", delta_tool_call.function.arguments or "")
+                            )
+                    for event in tool_call_assembler.feed(chunk.choices[0].delta.tool_calls):
+                        yield self._deliver(event, tool_call_fragments)
+                    # the tool calls still open at the finish_reason complete after the loop, once the usage chunk
+                    # that follows it was read, a caller closing the stream at the tool call does not lose the usage
+                for event in tool_call_assembler.finish():
+                    yield self._deliver(event, tool_call_fragments)
+                if not started:
+                    self.router.record(endpoint)
+                return
+            except (GeneratorExit, asyncio.CancelledError):
+                if call_record is not None:
+                    call_record.wasted_tokens += default_token_counter.count_text(
+                        "".join("".join(fragments) for fragments in tool_call_fragments.values())
+                    )
+                raise
+            except Exception as e:
+                if not started:
+                    # nothing was generated, a stream failing midway keeps its estimate in the absence of a usage
+                    self._refund_rate_limit(endpoint, charged_tokens)
+                self.router.record(endpoint, error=e)
+                if started or not self.router.should_failover(e):
+                    raise
+                # the stream failed before its first chunk, fail over to the next endpoint
+                tried.append(endpoint)
+                last_error = e
+                self.router.failovers += 1
+            finally:
+                if upstream is not None:
+                    # a finished, failed or abandoned stream, close the response so the connection goes back to the pool
+                    await upstream.close()
+                self.router.release(endpoint)
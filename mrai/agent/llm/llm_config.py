@@ -1,6 +1,8 @@
 from pydantic import Field
 from typing import Literal
 from openai import BaseModel
+from mrai.agent.llm.retry import HedgePolicy, RetryPolicy
+from mrai.agent.llm.router import CircuitBreakerPolicy, EndpointConfig
 
 
 class LLMConfig(BaseModel):
@@ -14,5 +16,48 @@ class LLMConfig(BaseModel):
     frequency_penalty: float = Field(default=0.0, description="The frequency penalty for the OpenAI API")
     api_type: Literal["openai", "azure"] = Field(default="openai", description="The type of API to use")
     reasoning_effort: Literal["low", "high"] | None = Field(default=None, description="The effort for the OpenAI API")
-    
-    
+
+    # connection pool
+    shared_client: bool = Field(default=True, description="Share one pooled HTTP client with every LLM of the same endpoint")
+    pool_max_connections: int = Field(default=100, description="The maximum number of connections of the pool")
+    pool_max_keepalive_connections: int = Field(default=20, description="The maximum number of idle keep-alive connections of the pool")
+    pool_keepalive_expiry: float = Field(default=30.0, description="Seconds an idle keep-alive connection is kept open")
+    http2: bool = Field(default=False, description="Enable HTTP/2, requires the h2 package")
+    connect_timeout: float = Field(default=10.0, description="The connect timeout in seconds")
+    read_timeout: float = Field(default=600.0, description="The read timeout in seconds")
+
+    # request coalescing
+    single_flight: bool = Field(default=False, description="Share one upstream call between concurrent identical requests")
+
+    # rate limiting, shared by every LLM of the same base_url and model
+    rpm_limit: int | None = Field(default=None, description="The requests-per-minute budget of the endpoint and model")
+    tpm_limit: int | None = Field(default=None, description="The tokens-per-minute budget of the endpoint and model")
+    priority: int = Field(default=5, description="The default rate limiter lane, 0 is interactive and 10 is batch")
+    stream_usage: bool | None = Field(
+        default=None,
+        description="Ask for the usage in the last chunk of streams, None only when tpm_limit is set, "
+        "without it the telemetry and the prompt cache stats of streams have no token counts"
+    )
+
+    # retries and hedged requests, None keeps the retries of the SDK and disables hedging
+    retry_policy: RetryPolicy | None = Field(default=None, description="The retry policy of failed requests")
+    hedge_policy: HedgePolicy | None = Field(default=None, description="Send a second request when the first one is slow, chat only")
+
+    # multi-endpoint routing, base_url is used alone when no endpoint is given
+    endpoints: list[EndpointConfig] = Field(default=[], description="The endpoints or deployments serving the model")
+    circuit_breaker: CircuitBreakerPolicy = Field(default_factory=CircuitBreakerPolicy, description="The circuit breaker of each endpoint")
+
+    # stop sequences
+    stop: list[str] | None = Field(default=None, description="Stop sequences of every request, the model stops before generating one of them")
+
+    # deadlines
+    call_timeout: float | None = Field(default=None, description="The default timeout of a chat or stream_chat call in seconds, retries included")
+
+    # tool calls of stream_chat
+    native_tool_calls: bool = Field(default=False, description="Stream tool calls with the native API instead of the prompt-injected <tool_call> rule")
+
+    # prompt layout
+    prompt_layout: Literal["default", "prefix_cache"] = Field(
+        default="default",
+        description="prefix_cache keeps the static parts of the prompt first, so the provider's prompt cache can reuse them"
+    )
@@ -0,0 +1,310 @@
+"""
+A local OpenAI-compatible server for load testing the agent loop without a live provider.
+
+>>> server = MockOpenAIServer(MockServerConfig(time_to_first_token=0.3, tokens_per_second=60))
+>>> server.run(port=8000)
+>>> llm = LLM(LLMConfig(api_key="mock", model="mock", base_url="http://127.0.0.1:8000/v1"))
+
+or from the command line:
+
+    python -m mrai.agent.llm.mock_server --port 8000 --ttft 0.3 --tps 60
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
+
+import uvicorn
+from openai import BaseModel
+from pydantic import Field
+from sse_starlette.sse import EventSourceResponse
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+_TOKEN_PATTERN = re.compile(r"\s*\S+|\s+")
+
+
+class MockToolCall(BaseModel):
+    name: str = Field(..., description="The name of the tool")
+    arguments: dict = Field(default={}, description="The arguments of the tool call")
+
+
+class MockResponse(BaseModel):
+    content: str = Field(default="", description="The content, may use the template fields of MockServerConfig.template")
+    reasoning_content: str = Field(default="", description="The reasoning content, streamed before the content")
+    tool_calls: list[MockToolCall] = Field(default=[], description="The tool calls of the response")
+
+
+class MockServerConfig(BaseModel):
+    responses: list[MockResponse] = Field(default=[], description="Scripted responses, served in turn")
+    template: str = Field(
+        default="Mock response to: {last_user_message}",
+        description="The content when no response is scripted, fields: last_user_message, model, request_index"
+    )
+    tool_call_style: Literal["native", "tag"] = Field(
+        default="native",
+        description="native sends tool_calls when the request has tools, tag writes <tool_call> tags in the content"
+    )
+    time_to_first_token: float = Field(default=0.0, description="Seconds before the first token, or the whole response")
+    tokens_per_second: float = Field(default=0.0, description="Streaming rate, 0 streams as fast as possible")
+    error_rate_429: float = Field(default=0.0, description="The probability of a 429 response")
+    error_rate_500: float = Field(default=0.0, description="The probability of a 500 response")
+    error_script: list[int] = Field(default=[], description="Status codes of the first requests, 200 lets a request through")
+    retry_after: float = Field(default=1.0, description="The Retry-After of the 429 responses in seconds")
+    seed: Optional[int] = Field(default=None, description="The seed of the error injection")
+    prompt_cache: bool = Field(
+        default=False,
+        description="Report the prompt tokens shared with a recent request as cached, like a provider-side prompt cache"
+    )
+
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text)
+
+
+def _render(text: str, fields: Dict[str, Any]) -> str:
+    # not str.format, scripted responses often contain JSON braces
+    for key, value in fields.items():
+        text = text.replace("{" + key + "}", str(value))
+    return text
+
+
+class MockOpenAIServer:
+    """Serves /chat/completions and /v1/chat/completions, streaming and not, plus /stats"""
+
+    def __init__(self, config: Optional[MockServerConfig] = None):
+        self.config = config or MockServerConfig()
+        self._random = random.Random(self.config.seed)
+        self._request_counter = itertools.count()
+        self.requests = 0
+        self.errors: Dict[int, int] = {}
+        self._recent_prompts: List[List[str]] = []
+        routes = [
+            Route("/chat/completions", self.chat_completions, methods=["POST"]),
+            Route("/v1/chat/completions", self.chat_completions, methods=["POST"]),
+            Route("/stats", self.stats, methods=["GET"]),
+        ]
+        self.app = Starlette(routes=routes)
+
+    def _injected_error(self, request_index: int) -> Optional[int]:
+        if request_index < len(self.config.error_script):
+            status = self.config.error_script[request_index]
+            return status if status != 200 else None
+        draw = self._random.random()
+        if draw < self.config.error_rate_429:
+            return 429
+        if draw < self.config.error_rate_429 + self.config.error_rate_500:
+            return 500
+        return None
+
+    def _error_response(self, status: int) -> JSONResponse:
+        self.errors[status] = self.errors.get(status, 0) + 1
+        headers = {"retry-after": str(self.config.retry_after)} if status == 429 else {}
+        return JSONResponse(
+            {"error": {"message": f"Injected {status} error", "type": "mock_error", "code": status}},
+            status_code=status,
+            headers=headers
+        )
+
+    def _response_for(self, body: Dict[str, Any], request_index: int) -> MockResponse:
+        last_user_message = next(
+            (message.get("content") or "" for message in reversed(body.get("messages", [])) if message.get("role") == "user"),
+            ""
+        )
+        fields = {"last_user_message": last_user_message, "model": body.get("model", ""), "request_index": request_index}
+        if self.config.responses:
+            scripted = self.config.responses[request_index % len(self.config.responses)]
+            return scripted.model_copy(update={"content": _render(scripted.content, fields)})
+        return MockResponse(content=_render(self.config.template, fields))
+
+    @staticmethod
+    def _apply_stop(content: str, stop: Any) -> tuple[str, bool]:
+        stops = [stop] if isinstance(stop, str) else (stop or [])
+        positions = [content.find(s) for s in stops if s and s in content]
+        if not positions:
+            return content, False
+        return content[:min(positions)], True
+
+    def _cached_tokens(self, prompt: List[str]) -> int:
+        cached = 0
+        for previous in self._recent_prompts:
+            common = 0
+            for a, b in zip(previous, prompt):
+                if a != b:
+                    break
+                common += 1
+            cached = max(cached, common)
+        self._recent_prompts = (self._recent_prompts + [prompt])[-32:]
+        return cached
+
+    async def chat_completions(self, request: Request):
+        body = await request.json()
+        request_index = next(self._request_counter)
+        self.requests += 1
+        status = self._injected_error(request_index)
+        if status is not None:
+            return self._error_response(status)
+
+        response = self._response_for(body, request_index)
+        native = self.config.tool_call_style == "native" and bool(body.get("tools"))
+        content = response.content
+        tool_calls = []
+        for tool_call in response.tool_calls:
+            if native:
+                tool_calls.append({
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": tool_call.name, "arguments": json.dumps(tool_call.arguments, ensure_ascii=False)},
+                })
+            else:
+                content += "\n<tool_call>\n" + json.dumps(
+                    {"name": tool_call.name, "arguments": tool_call.arguments}, ensure_ascii=False, indent=2
+                ) + "\n</tool_call>"
+        content, stopped = self._apply_stop(content, body.get("stop"))
+        finish_reason = "tool_calls" if tool_calls and not stopped else "stop"
+        prompt = _tokenize(json.dumps(body.get("messages", []), ensure_ascii=False))
+        prompt_tokens = len(prompt)
+        cached_tokens = self._cached_tokens(prompt) if self.config.prompt_cache else 0
+
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return EventSourceResponse(
+                self._stream(
+                    body.get("model", ""), response.reasoning_content, content, tool_calls,
+                    finish_reason, prompt_tokens, cached_tokens, include_usage
+                ),
+                ping=None
+            )
+
+        await asyncio.sleep(self.config.time_to_first_token)
+        completion_tokens = len(_tokenize(response.reasoning_content + content))
+        message: Dict[str, Any] = {"role": "assistant", "content": content}
+        if response.reasoning_content:
+            message["reasoning_content"] = response.reasoning_content
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return JSONResponse({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        })
+
+    async def _stream(
+        self,
+        model: str,
+        reasoning_content: str,
+        content: str,
+        tool_calls: List[dict],
+        finish_reason: str,
+        prompt_tokens: int,
+        cached_tokens: int,
+        include_usage: bool
+    ) -> AsyncIterator[dict]:
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        interval = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+        completion_tokens = 0
+
+        def chunk(delta: dict, finish: Optional[str] = None, usage: Optional[dict] = None) -> dict:
+            data: Dict[str, Any] = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if usage is None else [],
+            }
+            if usage is not None:
+                data["usage"] = usage
+            return {"data": json.dumps(data, ensure_ascii=False)}
+
+        await asyncio.sleep(self.config.time_to_first_token)
+        yield chunk({"role": "assistant", "content": ""})
+        for key, text in (("reasoning_content", reasoning_content), ("content", content)):
+            for token in _tokenize(text):
+                completion_tokens += 1
+                yield chunk({key: token})
+                if interval:
+                    await asyncio.sleep(interval)
+        for index, tool_call in enumerate(tool_calls):
+            yield chunk({"tool_calls": [{
+                "index": index,
+                "id": tool_call["id"],
+                "type": "function",
+                "function": {"name": tool_call["function"]["name"], "arguments": ""},
+            }]})
+            for token in _tokenize(tool_call["function"]["arguments"]):
+                completion_tokens += 1
+                yield chunk({"tool_calls": [{"index": index, "function": {"arguments": token}}]})
+                if interval:
+                    await asyncio.sleep(interval)
+        yield chunk({}, finish_reason)
+        if include_usage:
+            yield chunk({}, usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            })
+        yield {"data": "[DONE]"}
+
+    async def stats(self, request: Request) -> JSONResponse:
+        return JSONResponse({"requests": self.requests, "errors": self.errors})
+
+    def run(self, host: str = "127.0.0.1", port: int = 8000):
+        """Serve until interrupted"""
+        uvicorn.run(self.app, host=host, port=port, log_level="warning")
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000) -> uvicorn.Server:
+        """Serve in the background of the running event loop, stop it with `server.should_exit = True`"""
+        server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        asyncio.ensure_future(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft", type=float, default=0.0, help="time to first token in seconds")
+    parser.add_argument("--tps", type=float, default=0.0, help="streamed tokens per second, 0 is unlimited")
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-500", type=float, default=0.0)
+    parser.add_argument("--tool-call-style", choices=["native", "tag"], default="native")
+    parser.add_argument("--prompt-cache", action="store_true", help="report the prompt prefix shared with recent requests as cached")
+    parser.add_argument("--responses", help="a JSON file with a list of scripted responses")
+    args = parser.parse_args()
+
+    responses = []
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            responses = [MockResponse.model_validate(response) for response in json.load(f)]
+    MockOpenAIServer(MockServerConfig(
+        responses=responses,
+        tool_call_style=args.tool_call_style,
+        time_to_first_token=args.ttft,
+        tokens_per_second=args.tps,
+        error_rate_429=args.error_rate_429,
+        error_rate_500=args.error_rate_500,
+        prompt_cache=args.prompt_cache,
+    )).run(host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
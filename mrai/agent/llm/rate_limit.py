@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import itertools
+import json
+import threading
+import time
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+
+class Priority(IntEnum):
+    """Priority lanes of the rate limiter, a lower value is served first"""
+
+    INTERACTIVE = 0
+    DEFAULT = 5
+    BATCH = 10
+
+
+def estimate_tokens(messages: list, tool_schemas: Optional[list] = None, max_tokens: int = 0) -> int:
+    """
+    Estimate the tokens a request is charged before it is sent.
+    Providers count the prompt plus the requested max_tokens against the TPM budget,
+    the prompt is estimated at about 4 characters per token.
+    """
+    text = json.dumps(messages, ensure_ascii=False, default=str)
+    if tool_schemas:
+        text += json.dumps(tool_schemas, ensure_ascii=False)
+    return len(text) // 4 + 1 + max_tokens
+
+
+class TokenBucket:
+    """A bucket refilled continuously up to `per_minute` units every minute"""
+
+    def __init__(self, per_minute: int):
+        if per_minute <= 0:
+            raise ValueError("per_minute must be greater than 0")
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available"""
+        self._refill(now)
+        deficit = amount - self.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def consume(self, amount: float):
+        self.tokens -= amount
+
+    def adjust(self, delta: float):
+        """Take (positive) or give back (negative) units after the fact, the bucket may go below zero"""
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens", "priority", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, tokens: int, priority: int):
+        self.future = future
+        self.tokens = tokens
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Async limiter enforcing a requests-per-minute and a tokens-per-minute budget.
+    Waiters are served strictly by priority lane, then in arrival order.
+
+    >>> ticket = await limiter.acquire(estimated_tokens, priority=Priority.INTERACTIVE)
+    >>> ... # send the request
+    >>> limiter.settle(ticket, usage.total_tokens)
+    """
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.token_budget = TokenBucket(tpm) if tpm else None
+        self._waiters: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # lane -> [granted, total wait seconds, max wait seconds]
+        self._lane_waits: Dict[int, List[float]] = {}
+        self.corrections = 0
+        self.corrected_tokens = 0
+        self.refunds = 0
+        self.refunded_tokens = 0
+
+    async def acquire(self, tokens: int, priority: int = Priority.DEFAULT) -> int:
+        """Wait until the request fits in the budgets, return the tokens charged, to be passed to settle"""
+        if self.token_budget is not None:
+            # a request larger than the whole budget could never be served, charge the full budget instead
+            tokens = min(tokens, int(self.token_budget.capacity))
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), tokens, priority)
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # the budget was granted right before the cancellation, the request is never sent,
+                # give back its request slot and its tokens
+                if self.requests is not None:
+                    self.requests.adjust(-1)
+                self.refund(tokens)
+            self._dispatch()
+            raise
+        return tokens
+
+    def settle(self, charged_tokens: int, actual_tokens: Optional[int]):
+        """Correct the token budget with the real usage of the request"""
+        if self.token_budget is None or actual_tokens is None:
+            return
+        delta = actual_tokens - charged_tokens
+        if delta:
+            self.token_budget.adjust(delta)
+            self.corrections += 1
+            self.corrected_tokens += delta
+            self._dispatch()
+
+    def refund(self, charged_tokens: int):
+        """Give back the tokens charged for a request that failed without a usage, the request itself stays counted"""
+        if self.token_budget is None or not charged_tokens:
+            return
+        self.token_budget.adjust(-charged_tokens)
+        self.refunds += 1
+        self.refunded_tokens += charged_tokens
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            _, _, waiter = self._waiters[0]
+            if waiter.future.done():
+                heapq.heappop(self._waiters)
+                continue
+            wait = 0.0
+            if self.requests is not None:
+                wait = max(wait, self.requests.wait_time(1, now))
+            if self.token_budget is not None:
+                wait = max(wait, self.token_budget.wait_time(waiter.tokens, now))
+            if wait > 0:
+                self._timer = waiter.future.get_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            if self.requests is not None:
+                self.requests.consume(1)
+            if self.token_budget is not None:
+                self.token_budget.consume(waiter.tokens)
+            waited = now - waiter.enqueued_at
+            lane = self._lane_waits.setdefault(int(waiter.priority), [0, 0.0, 0.0])
+            lane[0] += 1
+            lane[1] += waited
+            lane[2] = max(lane[2], waited)
+            waiter.future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(1 for _, _, waiter in self._waiters if not waiter.future.done()),
+            "lanes": {
+                priority: {
+                    "granted": int(granted),
+                    "avg_wait": total_wait / granted if granted else 0.0,
+                    "max_wait": max_wait,
+                }
+                for priority, (granted, total_wait, max_wait) in sorted(self._lane_waits.items())
+            },
+            "corrections": self.corrections,
+            "corrected_tokens": self.corrected_tokens,
+            "refunds": self.refunds,
+            "refunded_tokens": self.refunded_tokens,
+        }
+
+
+class RateLimiterRegistry:
+    """Process-wide limiters, one per (base_url, model)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limiters: Dict[Tuple[str, str], RateLimiter] = {}
+
+    def get(self, base_url: str, model: str, rpm: Optional[int], tpm: Optional[int]) -> Optional[RateLimiter]:
+        """
+        Get the limiter of the endpoint and model, None when no budget is configured.
+        The budgets of the first caller apply, a caller asking for other budgets gets the same limiter and a warning.
+        """
+        if not rpm and not tpm:
+            return None
+        with self._lock:
+            limiter = self._limiters.get((base_url, model))
+            if limiter is None:
+                limiter = RateLimiter(rpm=rpm, tpm=tpm)
+                self._limiters[(base_url, model)] = limiter
+            elif (limiter.rpm or None, limiter.tpm or None) != (rpm or None, tpm or None):
+                logger.warning(
+                    f"The rate limiter of {model} at {base_url} already has rpm={limiter.rpm} tpm={limiter.tpm}, "
+                    f"rpm={rpm} tpm={tpm} is ignored"
+                )
+            return limiter
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {f"{base_url}#{model}": limiter.stats() for (base_url, model), limiter in self._limiters.items()}
+
+
+# the default process-wide limiters used by every LLM
+rate_limiters = RateLimiterRegistry()
@@ -0,0 +1,215 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Literal, Optional, TypeVar
+
+import httpx
+import openai
+from openai import BaseModel
+from pydantic import Field
+from loguru import logger
+
+T = TypeVar("T")
+
+ErrorClass = Literal["rate_limit", "timeout", "connection", "server", "client", "other"]
+
+
+class RetryPolicy(BaseModel):
+    """Retry failed requests with exponential backoff and jitter"""
+
+    max_attempts: int = Field(default=3, description="The maximum number of attempts, including the first one")
+    base_delay: float = Field(default=0.5, description="The delay before the first retry in seconds")
+    max_delay: float = Field(default=20.0, description="The maximum delay between two attempts in seconds")
+    multiplier: float = Field(default=2.0, description="The backoff multiplier of each retry")
+    jitter: Literal["full", "equal", "none"] = Field(default="full", description="The jitter applied to the backoff delay")
+    retry_on: list[ErrorClass] = Field(
+        default=["rate_limit", "timeout", "connection", "server"],
+        description="The error classes that are retried"
+    )
+    respect_retry_after: bool = Field(default=True, description="Wait at least the Retry-After of the provider")
+
+    def backoff(self, retry: int) -> float:
+        """The delay before the given retry, starting at 1"""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (retry - 1))
+        if self.jitter == "full":
+            return random.uniform(0, delay)
+        if self.jitter == "equal":
+            return delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+
+class HedgePolicy(BaseModel):
+    """Issue a second identical request when the first one is slower than a latency percentile"""
+
+    percentile: float = Field(default=0.95, description="The latency percentile after which the hedge request is sent")
+    min_samples: int = Field(default=20, description="The number of latency samples needed before hedging")
+    window: int = Field(default=200, description="The number of recent latencies the percentile is computed on")
+    min_delay: float = Field(default=0.0, description="Never hedge before this delay in seconds")
+
+
+def classify_error(error: BaseException) -> ErrorClass:
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return "connection"
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429:
+            return "rate_limit"
+        if error.status_code >= 500:
+            return "server"
+        return "client"
+    return "other"
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """The Retry-After of the provider in seconds, if any"""
+    if not isinstance(error, openai.APIStatusError):
+        return None
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        # Retry-After may also be an HTTP date, fall back to the backoff
+        return None
+    return None
+
+
+class LatencyTracker:
+    """Recent latencies of successful requests"""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float:
+        samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+
+class RetryStats:
+    """Counters of retries and hedged requests"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.retries = 0
+        self.give_ups = 0
+        self.errors: Dict[str, int] = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "give_ups": self.give_ups,
+            "errors": dict(self.errors),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+async def _wait_before_retry(error: BaseException, retry: int, policy: RetryPolicy, stats: RetryStats) -> bool:
+    """Count the error and sleep before the next attempt, return False when the error should be raised"""
+    error_class = classify_error(error)
+    stats.errors[error_class] = stats.errors.get(error_class, 0) + 1
+    if error_class not in policy.retry_on or retry >= policy.max_attempts:
+        stats.give_ups += 1
+        return False
+    delay = policy.backoff(retry)
+    if policy.respect_retry_after:
+        delay = max(delay, retry_after(error) or 0.0)
+    logger.warning(f"LLM request failed with {error_class} error, retry {retry} in {delay:.2f}s: {error}")
+    stats.retries += 1
+    await asyncio.sleep(delay)
+    return True
+
+
+async def call_with_retry(fn: Callable[[], Awaitable[T]], policy: RetryPolicy, stats: RetryStats) -> T:
+    attempt = 0
+    while True:
+        attempt += 1
+        stats.attempts += 1
+        try:
+            return await fn()
+        except Exception as e:
+            if not await _wait_before_retry(e, attempt, policy, stats):
+                raise
+
+
+async def stream_with_retry(fn: Callable[[], AsyncIterator[T]], policy: RetryPolicy, stats: RetryStats) -> AsyncIterator[T]:
+    """Retry a stream that fails before its first chunk, a stream that already produced chunks is never replayed"""
+    attempt = 0
+    while True:
+        attempt += 1
+        stats.attempts += 1
+        started = False
+        stream = fn()
+        try:
+            async for chunk in stream:
+                started = True
+                yield chunk
+            return
+        except Exception as e:
+            if started or not await _wait_before_retry(e, attempt, policy, stats):
+                raise
+        finally:
+            await stream.aclose()
+
+
+async def call_hedged(
+    fn: Callable[[], Awaitable[T]],
+    policy: HedgePolicy,
+    tracker: LatencyTracker,
+    stats: RetryStats
+) -> T:
+    """
+    Run fn, and run it a second time if the first call is slower than the latency percentile.
+    The first successful response wins and the other call is cancelled.
+    """
+    started_at = time.monotonic()
+    if len(tracker) < policy.min_samples:
+        result = await fn()
+        tracker.record(time.monotonic() - started_at)
+        return result
+
+    threshold = max(tracker.percentile(policy.percentile), policy.min_delay)
+    tasks = [asyncio.ensure_future(fn())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=threshold)
+        if not done:
+            stats.hedges += 1
+            tasks.append(asyncio.ensure_future(fn()))
+
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                if task is not tasks[0]:
+                    stats.hedge_wins += 1
+                tracker.record(time.monotonic() - started_at)
+                return task.result()
+        raise error or asyncio.CancelledError()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
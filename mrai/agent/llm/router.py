@@ -0,0 +1,192 @@
+import asyncio
+import time
+from typing import Callable, List, Literal, Optional
+
+from openai import AsyncOpenAI, BaseModel
+from pydantic import Field
+
+from mrai.agent.llm.rate_limit import RateLimiter
+from mrai.agent.llm.retry import classify_error
+
+
+class EndpointConfig(BaseModel):
+    """One deployment of the model, the fields left empty are taken from the LLMConfig"""
+
+    base_url: str = Field(..., description="The base URL of the endpoint")
+    api_key: str | None = Field(default=None, description="The API key of the endpoint")
+    model: str | None = Field(default=None, description="The model or deployment name on this endpoint")
+
+
+class CircuitBreakerPolicy(BaseModel):
+    failure_threshold: int = Field(default=5, description="Consecutive failures that open the circuit")
+    reset_timeout: float = Field(default=30.0, description="Seconds the circuit stays open before a probe is let through")
+    ewma_alpha: float = Field(default=0.3, description="The weight of the newest sample in the latency EWMA")
+
+
+class NoEndpointAvailableError(RuntimeError):
+    """Every endpoint of the LLM already failed for this request"""
+
+
+class CircuitBreaker:
+    """
+    closed: requests flow normally.
+    open: the endpoint is ejected until reset_timeout has passed.
+    half_open: a single probe request is let through, its result closes or re-opens the circuit.
+    """
+
+    def __init__(self, policy: CircuitBreakerPolicy):
+        self.policy = policy
+        self.state: Literal["closed", "open", "half_open"] = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+
+    def available(self, now: float) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and now - self.opened_at >= self.policy.reset_timeout:
+            self.state = "half_open"
+            self.probing = False
+        return self.state == "half_open" and not self.probing
+
+    def on_selected(self):
+        if self.state == "half_open":
+            self.probing = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.probing = False
+
+    def record_failure(self, now: float):
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.consecutive_failures >= self.policy.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = now
+
+
+class Endpoint:
+    """A routable endpoint with its own client, rate limiter, latency EWMA and circuit breaker"""
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        client: Optional[AsyncOpenAI],
+        rate_limiter: Optional[RateLimiter],
+        policy: CircuitBreakerPolicy,
+        client_factory: Optional[Callable[[], AsyncOpenAI]] = None
+    ):
+        """
+        Args:
+            client: The client of the endpoint, None to get it from client_factory
+            client_factory: Get the client of the running event loop, e.g. from the client pool,
+                it is called again when the endpoint is used from another loop
+        """
+        self.base_url = base_url
+        self.model = model
+        self._client = client
+        self._client_factory = client_factory
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.rate_limiter = rate_limiter
+        self.breaker = CircuitBreaker(policy)
+        self.alpha = policy.ewma_alpha
+        self.ewma_latency: Optional[float] = None
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client_factory is None:
+            return self._client
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self._client is None or loop is not self._client_loop:
+            self._client = self._client_factory()
+            self._client_loop = loop
+        return self._client
+
+    def score(self) -> float:
+        # an endpoint without samples scores 0, so every endpoint gets measured
+        return (self.ewma_latency or 0.0) * (self.in_flight + 1)
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "state": self.breaker.state,
+            "ewma_latency": self.ewma_latency,
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "failures": self.failures,
+            "trips": self.breaker.trips,
+        }
+
+
+class Router:
+    """Pick the endpoint with the lowest EWMA latency weighted by its in-flight requests"""
+
+    def __init__(self, endpoints: List[Endpoint]):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = endpoints
+        self.failovers = 0
+
+    def select(self, exclude: Optional[List[Endpoint]] = None) -> Endpoint:
+        now = time.monotonic()
+        remaining = [endpoint for endpoint in self.endpoints if not exclude or endpoint not in exclude]
+        if not remaining:
+            raise NoEndpointAvailableError("No endpoint available, all of them already failed")
+        candidates = [endpoint for endpoint in remaining if endpoint.breaker.available(now)]
+        if candidates:
+            endpoint = min(candidates, key=lambda e: (e.score(), e.in_flight))
+        else:
+            # every endpoint is ejected, rather than failing without trying, probe the one ejected the longest ago
+            endpoint = min(remaining, key=lambda e: e.breaker.opened_at)
+        endpoint.breaker.on_selected()
+        endpoint.in_flight += 1
+        return endpoint
+
+    def record(self, endpoint: Endpoint, latency: Optional[float] = None, error: Optional[BaseException] = None):
+        """
+        Record the result of a request sent to the endpoint.
+        Args:
+            latency: Seconds until the response, or until the first chunk of a stream
+            error: The error of the request, client errors are not the endpoint's fault and do not count
+        """
+        if error is not None:
+            if not self.should_failover(error):
+                # not a health signal, the request itself is wrong
+                return
+            endpoint.failures += 1
+            endpoint.breaker.record_failure(time.monotonic())
+            return
+        endpoint.successes += 1
+        endpoint.breaker.record_success()
+        if latency is not None:
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = latency
+            else:
+                endpoint.ewma_latency = endpoint.alpha * latency + (1 - endpoint.alpha) * endpoint.ewma_latency
+
+    def release(self, endpoint: Endpoint):
+        """The request sent to the endpoint is over, successful or not"""
+        endpoint.in_flight -= 1
+        # a probe that ended without a verdict, e.g. cancelled, lets the next probe through
+        endpoint.breaker.probing = False
+
+    @staticmethod
+    def should_failover(error: BaseException) -> bool:
+        return classify_error(error) not in ("client", "other")
+
+    def stats(self) -> dict:
+        return {
+            "failovers": self.failovers,
+            "endpoints": {f"{endpoint.base_url}#{endpoint.model}": endpoint.stats() for endpoint in self.endpoints},
+        }
@@ -0,0 +1,409 @@
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class Embedder(ABC):
+    """Turn texts into L2-normalized vectors, the cosine similarity of two texts is the dot product of their vectors"""
+
+    @property
+    @abstractmethod
+    def dim(self) -> int:
+        pass
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Return a float32 array of shape (len(texts), dim)"""
+        pass
+
+
+class HashingEmbedder(Embedder):
+    """
+    An offline embedder, the hashing trick over lowercased words and character n-grams.
+    It catches rewordings, casing, punctuation and typos, not synonyms, plug a model embedder for those.
+    """
+
+    def __init__(self, dim: int = 1024, char_ngram: int = 3):
+        if dim <= 0:
+            raise ValueError("dim must be greater than 0")
+        self._dim = dim
+        self.char_ngram = char_ngram
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD_PATTERN.findall(text.lower())
+        features = [f"w:{word}" for word in words]
+        n = self.char_ngram
+        for word in words:
+            padded = f" {word} "
+            features.extend(f"c:{padded[i:i + n]}" for i in range(max(1, len(padded) - n + 1)))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self._dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                # crc32 is stable across processes, unlike hash()
+                hashed = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if hashed & 0x80000000 else -1.0
+                vectors[row, hashed % self._dim] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class SemanticHit:
+    """A semantic cache hit, the cached answer of a similar query of the same scope"""
+
+    __slots__ = ("scope", "query", "matched_query", "similarity", "payload", "entry_id")
+
+    def __init__(self, scope: str, query: str, matched_query: str, similarity: float, payload: dict, entry_id: int):
+        self.scope = scope
+        self.query = query
+        self.matched_query = matched_query
+        self.similarity = similarity
+        self.payload = payload
+        self.entry_id = entry_id
+
+    def __repr__(self) -> str:
+        return f"SemanticHit(similarity={self.similarity:.3f}, query={self.query!r}, matched_query={self.matched_query!r})"
+
+
+class SemanticCache:
+    """
+    A cache of LLM.chat responses keyed by meaning.
+    The scope is an exact key of everything but the last user turn, e.g. the system prompt, the tools and the model,
+    the last user turn is embedded and matched within its scope above the similarity threshold.
+    Expired entries are removed when their scope is looked up, or by purge_expired, over max_entries the least
+    recently used entries are evicted, and the index can be saved to and loaded from a .npz file.
+
+    A sampled share of the hits can be audited: the LLM still calls the model and reports whether the cached answer
+    agrees with the fresh one, see audit_rate, verifier and the hit listeners.
+
+    >>> cache = SemanticCache(threshold=0.9, path="semantic_cache.npz", audit_rate=0.05)
+    >>> llm = LLM(config, semantic_cache=cache)
+    >>> cache.add_hit_listener(lambda hit: logger.debug(hit))
+    >>> cache.stats()
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        threshold: float = 0.9,
+        max_entries: int = 4096,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+        audit_rate: float = 0.0,
+        verifier: Optional[Callable[[dict, dict], bool]] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            embedder: The embedder of the queries, defaults to a HashingEmbedder
+            threshold: The minimal cosine similarity of a hit
+            ttl: The lifetime of an entry in seconds
+            path: The .npz file of the index, loaded when it exists, written by save() and close()
+            audit_rate: The share of the hits checked against a fresh response
+            verifier: Whether a cached payload agrees with a fresh payload, defaults to the same tool calls and similar content
+        """
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        if max_entries <= 0:
+            raise ValueError("max_entries must be greater than 0")
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.audit_rate = audit_rate
+        self.verifier = verifier or self._default_verifier
+        self._random = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._init_index(0)
+        self._hit_listeners: List[Callable[[SemanticHit], None]] = []
+        self._false_hit_listeners: List[Callable[[SemanticHit, dict], None]] = []
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+        self.audits = 0
+        self.false_hits = 0
+        if path and os.path.exists(path):
+            self.load(path)
+
+    # index maintenance, the caller holds the lock
+
+    def _init_index(self, next_id: int):
+        # row-aligned vectors and creation times, the capacity doubles so an append is amortized constant time
+        self._vectors = np.zeros((64, self.embedder.dim), dtype=np.float32)
+        self._created_at = np.zeros(64, dtype=np.float64)
+        self._entries: List[dict] = []
+        # entry id -> its row
+        self._row_of: Dict[int, int] = {}
+        # scope -> the rows of its entries, a dict as an ordered set
+        self._scope_rows: Dict[str, Dict[int, None]] = {}
+        # entry ids, least recently used first
+        self._lru: OrderedDict[int, None] = OrderedDict()
+        self._next_id = next_id
+
+    def _append_row(self, entry: dict, vector: np.ndarray):
+        row = len(self._entries)
+        if row == len(self._vectors):
+            self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+            self._created_at = np.concatenate([self._created_at, np.zeros_like(self._created_at)])
+        self._vectors[row] = vector
+        self._created_at[row] = entry["created_at"]
+        self._entries.append(entry)
+        self._row_of[entry["id"]] = row
+        self._scope_rows.setdefault(entry["scope"], {})[row] = None
+        self._lru[entry["id"]] = None
+
+    def _remove_row(self, row: int):
+        """Remove the entry of the row, the last row takes its place"""
+        entry = self._entries[row]
+        last = len(self._entries) - 1
+        scope_rows = self._scope_rows[entry["scope"]]
+        del scope_rows[row]
+        if not scope_rows:
+            del self._scope_rows[entry["scope"]]
+        del self._row_of[entry["id"]]
+        self._lru.pop(entry["id"], None)
+        if row != last:
+            moved = self._entries[last]
+            self._vectors[row] = self._vectors[last]
+            self._created_at[row] = self._created_at[last]
+            self._entries[row] = moved
+            self._row_of[moved["id"]] = row
+            moved_rows = self._scope_rows[moved["scope"]]
+            del moved_rows[last]
+            moved_rows[row] = None
+        self._entries.pop()
+
+    def _remove_rows(self, rows: Sequence[int]):
+        # the highest rows first, a swapped-in last row is never one still to remove
+        for row in sorted(rows, reverse=True):
+            self._remove_row(row)
+
+    def _expire(self, rows: np.ndarray, now: float) -> bool:
+        """Remove the expired entries among the rows, whether there were any"""
+        if self.ttl is None or len(rows) == 0:
+            return False
+        expired = self._created_at[rows] + self.ttl <= now
+        if not expired.any():
+            return False
+        self.expired += int(expired.sum())
+        self._remove_rows(rows[expired].tolist())
+        return True
+
+    def _evict(self, now: float):
+        if len(self._entries) <= self.max_entries:
+            return
+        self._expire(np.arange(len(self._entries)), now)
+        while len(self._entries) > self.max_entries:
+            entry_id, _ = self._lru.popitem(last=False)
+            self._remove_row(self._row_of[entry_id])
+            self.evictions += 1
+
+    def _scope_array(self, scope: str, now: float) -> np.ndarray:
+        """The valid rows of the scope, its expired entries are removed on the way"""
+        rows = self._scope_rows.get(scope, {})
+        array = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        if self._expire(array, now):
+            # the removed rows were swapped with the last ones, read the rows of the scope again
+            rows = self._scope_rows.get(scope, {})
+            array = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        return array
+
+    # cache
+
+    def lookup(self, scope: str, query: str) -> Optional[SemanticHit]:
+        """The most similar entry of the scope above the threshold"""
+        vector = self.embedder.embed([query])[0]
+        now = time.time()
+        hit = None
+        with self._lock:
+            rows = self._scope_array(scope, now)
+            if len(rows):
+                similarities = self._vectors[rows] @ vector
+                best = int(np.argmax(similarities))
+                entry = self._entries[rows[best]]
+                similarity = float(similarities[best])
+                if similarity >= self.threshold:
+                    entry["last_used_at"] = now
+                    entry["hits"] += 1
+                    self._lru.move_to_end(entry["id"])
+                    hit = SemanticHit(scope, query, entry["query"], similarity, entry["payload"], entry["id"])
+            if hit is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            listeners = list(self._hit_listeners)
+        for listener in listeners:
+            listener(hit)
+        return hit
+
+    def store(self, scope: str, query: str, payload: dict):
+        vector = self.embedder.embed([query])[0]
+        now = time.time()
+        with self._lock:
+            rows = self._scope_array(scope, now)
+            if len(rows):
+                similarities = self._vectors[rows] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= 1.0 - 1e-6:
+                    # the same query, refresh the answer in place
+                    row = int(rows[best])
+                    entry = self._entries[row]
+                    entry.update(payload=payload, created_at=now, last_used_at=now)
+                    self._created_at[row] = now
+                    self._lru.move_to_end(entry["id"])
+                    self.stores += 1
+                    return
+            self._append_row({
+                "id": self._next_id,
+                "scope": scope,
+                "query": query,
+                "payload": payload,
+                "created_at": now,
+                "last_used_at": now,
+                "hits": 0,
+            }, vector)
+            self._next_id += 1
+            self.stores += 1
+            self._evict(now)
+
+    def remove(self, entry_id: int):
+        with self._lock:
+            row = self._row_of.get(entry_id)
+            if row is not None:
+                self._remove_row(row)
+
+    def purge_expired(self) -> int:
+        """Remove every expired entry, lookups and stores only remove the expired entries of their scope"""
+        with self._lock:
+            expired = self.expired
+            self._expire(np.arange(len(self._entries)), time.time())
+            return self.expired - expired
+
+    def clear(self):
+        with self._lock:
+            self._init_index(self._next_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # auditing
+
+    def should_audit(self) -> bool:
+        """Whether the next hit is audited against a fresh response"""
+        return self.audit_rate > 0 and float(self._random.random()) < self.audit_rate
+
+    def _default_verifier(self, cached: dict, fresh: dict) -> bool:
+        def tool_calls(payload: dict) -> list:
+            return [
+                (call["function"]["name"], json.loads(call["function"]["arguments"] or "{}"))
+                for call in payload.get("tool_calls") or []
+            ]
+        try:
+            if tool_calls(cached) != tool_calls(fresh):
+                return False
+        except json.JSONDecodeError:
+            return False
+        cached_content, fresh_content = cached.get("content") or "", fresh.get("content") or ""
+        if not cached_content and not fresh_content:
+            return True
+        vectors = self.embedder.embed([cached_content, fresh_content])
+        return float(vectors[0] @ vectors[1]) >= self.threshold
+
+    def audit(self, hit: SemanticHit, fresh_payload: dict) -> bool:
+        """Check a hit against the fresh response of the same request, a false hit is removed from the cache"""
+        agreed = self.verifier(hit.payload, fresh_payload)
+        with self._lock:
+            self.audits += 1
+            if not agreed:
+                self.false_hits += 1
+            listeners = list(self._false_hit_listeners)
+        if not agreed:
+            self.remove(hit.entry_id)
+            for listener in listeners:
+                listener(hit, fresh_payload)
+        return agreed
+
+    def add_hit_listener(self, listener: Callable[[SemanticHit], None]):
+        with self._lock:
+            self._hit_listeners.append(listener)
+
+    def add_false_hit_listener(self, listener: Callable[[SemanticHit, dict], None]):
+        """Called with the hit and the fresh payload when an audit finds a false hit"""
+        with self._lock:
+            self._false_hit_listeners.append(listener)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "scopes": len(self._scope_rows),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "audits": self.audits,
+                "false_hits": self.false_hits,
+                "false_hit_rate": self.false_hits / self.audits if self.audits else 0.0,
+            }
+
+    # persistence
+
+    def save(self, path: Optional[str] = None):
+        """Write the index to a .npz file"""
+        path = path or self.path
+        if not path:
+            raise ValueError("No path to save the semantic cache to")
+        with self._lock:
+            vectors = self._vectors[:len(self._entries)].copy()
+            meta = json.dumps({"dim": self.embedder.dim, "next_id": self._next_id, "entries": self._entries}, ensure_ascii=False)
+        # write then rename, a crash never leaves a truncated index behind
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, vectors=vectors, meta=np.array(meta))
+        os.replace(tmp_path, path)
+
+    def load(self, path: Optional[str] = None):
+        """Replace the index with the one of a .npz file"""
+        path = path or self.path
+        if not path:
+            raise ValueError("No path to load the semantic cache from")
+        with np.load(path) as data:
+            vectors = data["vectors"].astype(np.float32)
+            meta = json.loads(str(data["meta"]))
+        if meta["dim"] != self.embedder.dim:
+            raise ValueError(f"The semantic cache {path} has dim {meta['dim']}, the embedder has dim {self.embedder.dim}")
+        with self._lock:
+            self._init_index(meta["next_id"])
+            # least recently used first, so the LRU order survives the round trip
+            for row in sorted(range(len(vectors)), key=lambda row: meta["entries"][row]["last_used_at"]):
+                self._append_row(meta["entries"][row], vectors[row])
+            now = time.time()
+            self._expire(np.arange(len(self._entries)), now)
+            self._evict(now)
+
+    def close(self):
+        """Save the index when the cache has a path"""
+        if self.path:
+            self.save()
@@ -0,0 +1,175 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from mrai.agent.llm.telemetry import CallRecord
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """One in-flight upstream call shared by every caller of the same key"""
+
+    def __init__(self, task: asyncio.Task, record: Optional[CallRecord] = None):
+        self.task = task
+        self.record = record
+        self.waiters = 0
+
+
+class _SharedStream:
+    """
+    One in-flight upstream stream shared by every subscriber of the same key.
+    Chunks are buffered for the whole life of the stream, so each subscriber replays it from the first chunk.
+    """
+
+    def __init__(self, source: AsyncIterator[Any], record: Optional[CallRecord] = None):
+        self.record = record
+        self.chunks: List[Any] = []
+        self.done = False
+        # every subscriber left, the upstream is being cancelled
+        self.closing = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        index = 0
+        self.subscribers += 1
+        try:
+            while True:
+                if index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # nobody is listening anymore, stop the upstream stream
+            if self.subscribers == 0 and not self.done:
+                self.closing = True
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical upstream calls.
+    The first caller of a key starts the call, the callers that arrive while it is in flight wait for the same result.
+    The call is cancelled only when every caller waiting on it is cancelled.
+    A follower's CallRecord is marked deduplicated and gets the usage of the leader's record.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.stream_leaders = 0
+        self.stream_followers = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], record: Optional[CallRecord] = None) -> T:
+        """
+        Args:
+            fn: Start the upstream call, only called by the leader
+            record: The CallRecord of the caller, fn of the leader fills in its usage
+        """
+        flight = self._calls.get(key)
+        follower = flight is not None
+        if flight is None:
+            self.leaders += 1
+            flight = _Flight(asyncio.ensure_future(fn()), record)
+            self._calls[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget_call(key, flight))
+        else:
+            self.followers += 1
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+            if follower:
+                self._share_usage(flight.record, record)
+            return result
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget_call(self, key: str, flight: _Flight):
+        if self._calls.get(key) is flight:
+            del self._calls[key]
+        # the exception is re-raised to every waiter, mark it retrieved for the event loop
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[T]], record: Optional[CallRecord] = None) -> AsyncIterator[T]:
+        """
+        Args:
+            fn: Open the upstream stream, only called by the leader
+            record: The CallRecord of the caller, the stream of the leader fills in its usage
+        """
+        shared = self._streams.get(key)
+        follower = shared is not None and not shared.done and not shared.closing
+        if not follower:
+            self.stream_leaders += 1
+            shared = _SharedStream(fn(), record)
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda _: self._forget_stream(key, shared))
+        else:
+            self.stream_followers += 1
+
+        subscription = shared.subscribe()
+        try:
+            async for chunk in subscription:
+                yield chunk
+        finally:
+            await subscription.aclose()
+            if follower:
+                self._share_usage(shared.record, record)
+
+    @staticmethod
+    def _share_usage(leader: Optional[CallRecord], follower: Optional[CallRecord]):
+        if leader is not None and follower is not None:
+            follower.share_usage(leader)
+
+    def _forget_stream(self, key: str, shared: _SharedStream):
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "streams_in_flight": len(self._streams),
+            "stream_leaders": self.stream_leaders,
+            "stream_followers": self.stream_followers,
+        }
+
+
+# the default process-wide single-flight group used by every LLM
+single_flight = SingleFlight()
@@ -0,0 +1,213 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from loguru import logger
+
+
+class StreamChunk:
+    """
+    A delta of a stream_chat response.
+    kind is "content" for the answer, or the name of the extra delta field, e.g. "reasoning_content".
+    """
+
+    __slots__ = ("kind", "text")
+
+    def __init__(self, kind: str, text: str):
+        self.kind = kind
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"StreamChunk(kind={self.kind!r}, text={self.text!r})"
+
+
+class ToolCallStarted:
+    """A native tool call started streaming, its arguments are still coming"""
+
+    __slots__ = ("index", "id", "name")
+    kind = "tool_call_started"
+
+    def __init__(self, index: int, id: str, name: str):
+        self.index = index
+        self.id = id
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"ToolCallStarted(index={self.index}, id={self.id!r}, name={self.name!r})"
+
+
+class ToolCallComplete:
+    """A native tool call is fully streamed, `arguments` is the raw JSON string sent by the model"""
+
+    __slots__ = ("index", "id", "name", "arguments")
+    kind = "tool_call_complete"
+
+    def __init__(self, index: int, id: str, name: str, arguments: str):
+        self.index = index
+        self.id = id
+        self.name = name
+        self.arguments = arguments
+
+    def parse_arguments(self) -> Dict[str, Any]:
+        """Raise ValueError when the arguments are not a JSON object"""
+        if not self.arguments.strip():
+            return {}
+        arguments = json.loads(self.arguments)
+        if not isinstance(arguments, dict):
+            raise ValueError(f"Tool call arguments must be a JSON object, got {self.arguments}")
+        return arguments
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "arguments": self.arguments,
+            },
+        }
+
+    def __repr__(self) -> str:
+        return f"ToolCallComplete(index={self.index}, id={self.id!r}, name={self.name!r}, arguments={self.arguments!r})"
+
+
+class ToolCallAssembler:
+    """Assemble the tool call fragments of `delta.tool_calls` into events"""
+
+    def __init__(self):
+        # index -> [id, name, argument fragments]
+        self._calls: Dict[int, List[Any]] = {}
+        self._started: set[int] = set()
+        self._completed: set[int] = set()
+
+    def feed(self, delta_tool_calls: Optional[list]) -> List[Any]:
+        """Feed the tool call deltas of a chunk, return the events they produce"""
+        events: List[Any] = []
+        if not delta_tool_calls:
+            return events
+        for delta in delta_tool_calls:
+            index = delta.index
+            if index not in self._calls:
+                # a new tool call means the previous ones are complete
+                events.extend(self._complete(lambda i: i < index))
+                self._calls[index] = [None, None, []]
+            call = self._calls[index]
+            if index in self._completed:
+                # the tool calls of the model are expected one index after the other, the call was already delivered
+                logger.warning(f"Dropped a fragment of the completed tool call {index}: {delta}")
+                continue
+            if delta.id:
+                call[0] = delta.id
+            if delta.function is not None:
+                if delta.function.name and not call[1]:
+                    call[1] = delta.function.name
+                if delta.function.arguments:
+                    call[2].append(delta.function.arguments)
+            if index not in self._started and call[1]:
+                self._started.add(index)
+                events.append(ToolCallStarted(index, call[0] or "", call[1]))
+        return events
+
+    def finish(self) -> List[Any]:
+        """The stream is over, complete every open tool call"""
+        return self._complete(lambda i: True)
+
+    def _complete(self, selected) -> List[Any]:
+        events: List[Any] = []
+        for index in sorted(self._calls):
+            if index in self._completed or not selected(index):
+                continue
+            self._completed.add(index)
+            call_id, name, fragments = self._calls[index]
+            if index not in self._started:
+                events.append(ToolCallStarted(index, call_id or "", name or ""))
+                self._started.add(index)
+            events.append(ToolCallComplete(index, call_id or "", name or "", "".join(fragments)))
+        return events
+
+
+async def coalesce_chunks(
+    stream: AsyncIterator[Any],
+    max_chars: int = 0,
+    max_interval: float = 0.0
+) -> AsyncIterator[Any]:
+    """
+    Merge consecutive StreamChunks of the same kind.
+    A merged chunk is flushed when the kind changes, when it reaches max_chars,
+    or max_interval seconds after its first delta even if the upstream stalls.
+    Other items, e.g. tool call events, flush the buffer and pass through in order.
+    """
+    kind: Optional[str] = None
+    parts: List[str] = []
+    size = 0
+
+    def flush() -> Optional[StreamChunk]:
+        nonlocal kind, parts, size
+        if not parts:
+            return None
+        merged = StreamChunk(kind or "content", "".join(parts))
+        kind, parts, size = None, [], 0
+        return merged
+
+    iterator = stream.__aiter__()
+    loop = asyncio.get_running_loop()
+    pending: Optional[asyncio.Future] = None
+    flush_at: Optional[float] = None
+    try:
+        while True:
+            if max_interval > 0:
+                # wait for the next delta, but not past the flush time of the buffer
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                timeout = None if flush_at is None else max(0.0, flush_at - loop.time())
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    merged = flush()
+                    flush_at = None
+                    if merged is not None:
+                        yield merged
+                    continue
+                future, pending = pending, None
+                try:
+                    item = future.result()
+                except StopAsyncIteration:
+                    break
+            else:
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+
+            if not isinstance(item, StreamChunk):
+                merged = flush()
+                flush_at = None
+                if merged is not None:
+                    yield merged
+                yield item
+                continue
+            if parts and item.kind != kind:
+                merged = flush()
+                if merged is not None:
+                    yield merged
+            if not parts:
+                kind = item.kind
+                flush_at = loop.time() + max_interval if max_interval > 0 else None
+            parts.append(item.text)
+            size += len(item.text)
+            if max_chars and size >= max_chars:
+                merged = flush()
+                flush_at = None
+                if merged is not None:
+                    yield merged
+
+        merged = flush()
+        if merged is not None:
+            yield merged
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            # the generator can only be closed once the cancelled step has unwound
+            await asyncio.wait({pending})
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
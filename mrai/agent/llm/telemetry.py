@@ -0,0 +1,271 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from mrai.agent.llm.usage import cached_prompt_tokens
+
+
+class CallRecord:
+    """The usage and timing of one chat or stream_chat call"""
+
+    __slots__ = (
+        "model", "agent", "flow_id", "stream", "started_at", "first_token_at", "finished_at",
+        "prompt_tokens", "completion_tokens", "cached_tokens", "has_usage", "error",
+        "abandoned", "wasted_tokens", "deduplicated"
+    )
+
+    def __init__(self, model: str, agent: Optional[str] = None, flow_id: Optional[str] = None, stream: bool = False):
+        self.model = model
+        self.agent = agent
+        self.flow_id = flow_id
+        self.stream = stream
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        # False when the stream ended before the usage
+        self.has_usage = False
+        # a single-flight follower, it sent no request and carries the usage of the call it joined
+        self.deduplicated = False
+        self.error: Optional[str] = None
+        # the caller stopped reading the stream before its end
+        self.abandoned = False
+        # the tokens of an abandoned stream that were received but never reached the caller,
+        # e.g. the fragments of an unfinished tool call
+        self.wasted_tokens = 0
+
+    def set_usage(self, usage: Any, model: Optional[str] = None):
+        if usage is None:
+            return
+        self.prompt_tokens = usage.prompt_tokens or 0
+        self.completion_tokens = usage.completion_tokens or 0
+        self.cached_tokens = cached_prompt_tokens(usage)
+        self.has_usage = True
+        if model:
+            # the model of the endpoint that served the call
+            self.model = model
+
+    def share_usage(self, leader: "CallRecord"):
+        """Mark the record as a follower of the leader's call and copy its usage"""
+        self.deduplicated = True
+        if leader.has_usage:
+            self.prompt_tokens = leader.prompt_tokens
+            self.completion_tokens = leader.completion_tokens
+            self.cached_tokens = leader.cached_tokens
+            self.has_usage = True
+            self.model = leader.model
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    @property
+    def latency(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """The decoding speed of a stream, from its first token to its end"""
+        if not self.stream or not self.has_usage or self.first_token_at is None or self.finished_at is None:
+            return None
+        duration = self.finished_at - self.first_token_at
+        if duration <= 0:
+            return None
+        return self.completion_tokens / duration
+
+    def to_dict(self) -> dict:
+        return {
+            "model": self.model,
+            "agent": self.agent,
+            "flow_id": self.flow_id,
+            "stream": self.stream,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "latency": self.latency,
+            "time_to_first_token": self.time_to_first_token,
+            "tokens_per_second": self.tokens_per_second,
+            "abandoned": self.abandoned,
+            "wasted_tokens": self.wasted_tokens,
+            "deduplicated": self.deduplicated,
+            "error": self.error,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"CallRecord(model={self.model!r}, agent={self.agent!r}, flow_id={self.flow_id!r}, "
+            f"prompt_tokens={self.prompt_tokens}, completion_tokens={self.completion_tokens}, latency={self.latency:.3f})"
+        )
+
+
+class UsageAggregate:
+    """Totals of the calls of an agent, a flow or a model"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.abandoned = 0
+        self.wasted_tokens = 0
+        self.deduplicated = 0
+        self._latency_sum = 0.0
+        self._ttft_sum = 0.0
+        self._ttft_count = 0
+        self._decode_tokens = 0
+        self._decode_seconds = 0.0
+
+    def add(self, record: CallRecord):
+        self.calls += 1
+        if record.error is not None:
+            self.errors += 1
+        if record.deduplicated:
+            # the leader's call already counts the tokens, they were billed once
+            self.deduplicated += 1
+        else:
+            self.prompt_tokens += record.prompt_tokens
+            self.completion_tokens += record.completion_tokens
+            self.cached_tokens += record.cached_tokens
+        if record.abandoned:
+            self.abandoned += 1
+            self.wasted_tokens += record.wasted_tokens
+        self._latency_sum += record.latency
+        ttft = record.time_to_first_token
+        if ttft is not None:
+            self._ttft_sum += ttft
+            self._ttft_count += 1
+        if record.tokens_per_second is not None and not record.deduplicated:
+            self._decode_tokens += record.completion_tokens
+            self._decode_seconds += record.finished_at - record.first_token_at
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "abandoned": self.abandoned,
+            "wasted_tokens": self.wasted_tokens,
+            "deduplicated": self.deduplicated,
+            "avg_latency": self._latency_sum / self.calls if self.calls else 0.0,
+            "avg_time_to_first_token": self._ttft_sum / self._ttft_count if self._ttft_count else None,
+            "tokens_per_second": self._decode_tokens / self._decode_seconds if self._decode_seconds > 0 else None,
+        }
+
+
+class Telemetry:
+    """
+    Collect the CallRecords of LLM calls and aggregate them per agent, per flow and per model.
+    The aggregates cover every call, the last max_records records are kept for ad-hoc queries.
+    A flow id is new for every flow, so only the aggregates of the max_flows most recently active flows are kept.
+
+    >>> default_telemetry.by_model()
+    >>> default_telemetry.by_flow()[flow.flow_id]
+    >>> default_telemetry.query(agent="planner", since=time.monotonic() - 60)
+    """
+
+    def __init__(self, max_records: int = 10000, max_flows: int = 1000):
+        """
+        Args:
+            max_records: The records kept for records and query
+            max_flows: The flows kept by by_flow, the least recently active one is dropped first
+        """
+        self._lock = threading.Lock()
+        self._records: deque[CallRecord] = deque(maxlen=max_records)
+        self.max_flows = max_flows
+        self._by_agent: Dict[str, UsageAggregate] = {}
+        self._by_flow: OrderedDict[str, UsageAggregate] = OrderedDict()
+        self._by_model: Dict[str, UsageAggregate] = {}
+        self._listeners: List[Callable[[CallRecord], None]] = []
+
+    def record(self, record: CallRecord):
+        """Finish the record and add it"""
+        if record.finished_at is None:
+            record.finished_at = time.monotonic()
+        with self._lock:
+            self._records.append(record)
+            if record.agent is not None:
+                self._by_agent.setdefault(record.agent, UsageAggregate()).add(record)
+            if record.flow_id is not None:
+                self._by_flow.setdefault(record.flow_id, UsageAggregate()).add(record)
+                self._by_flow.move_to_end(record.flow_id)
+                while len(self._by_flow) > self.max_flows:
+                    self._by_flow.popitem(last=False)
+            self._by_model.setdefault(record.model, UsageAggregate()).add(record)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(record)
+
+    def add_listener(self, listener: Callable[[CallRecord], None]):
+        """Call the listener with every new record, e.g. to export them"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[CallRecord], None]):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    @staticmethod
+    def _snapshots(aggregates: Dict[str, UsageAggregate]) -> Dict[str, dict]:
+        return {key: aggregate.snapshot() for key, aggregate in aggregates.items()}
+
+    def by_agent(self) -> Dict[str, dict]:
+        with self._lock:
+            return self._snapshots(self._by_agent)
+
+    def by_flow(self) -> Dict[str, dict]:
+        with self._lock:
+            return self._snapshots(self._by_flow)
+
+    def by_model(self) -> Dict[str, dict]:
+        with self._lock:
+            return self._snapshots(self._by_model)
+
+    def records(
+        self,
+        agent: Optional[str] = None,
+        flow_id: Optional[str] = None,
+        model: Optional[str] = None,
+        since: Optional[float] = None
+    ) -> List[CallRecord]:
+        """The kept records matching every given filter, since is a time.monotonic() timestamp"""
+        with self._lock:
+            records: Iterable[CallRecord] = list(self._records)
+        return [
+            record for record in records
+            if (agent is None or record.agent == agent)
+            and (flow_id is None or record.flow_id == flow_id)
+            and (model is None or record.model == model)
+            and (since is None or record.started_at >= since)
+        ]
+
+    def query(self, **filters) -> dict:
+        """Aggregate the kept records matching the filters of `records`"""
+        aggregate = UsageAggregate()
+        for record in self.records(**filters):
+            aggregate.add(record)
+        return aggregate.snapshot()
+
+    def reset(self):
+        with self._lock:
+            self._records.clear()
+            self._by_agent.clear()
+            self._by_flow.clear()
+            self._by_model.clear()
+
+
+# the process-wide telemetry shared by every LLM unless another one is given
+default_telemetry = Telemetry()
@@ -0,0 +1,48 @@
+import threading
+from typing import Any
+
+
+def cached_prompt_tokens(usage: Any) -> int:
+    """
+    The prompt tokens served from the provider's prompt cache.
+    OpenAI reports them in prompt_tokens_details.cached_tokens, DeepSeek in prompt_cache_hit_tokens.
+    """
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        extra = getattr(usage, "model_extra", None) or {}
+        cached = extra.get("prompt_cache_hit_tokens")
+    return int(cached or 0)
+
+
+class PromptCacheStats:
+    """Prompt cache hits reported by the provider, hit_rate is the share of prompt tokens read from the cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, usage: Any):
+        if usage is None:
+            return
+        cached = cached_prompt_tokens(usage)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.cached_tokens += cached
+
+    @property
+    def hit_rate(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "hit_rate": self.hit_rate,
+        }
@@ -0,0 +1,135 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from mrai.agent.memory.token_counter import TokenCounter, default_token_counter
+from mrai.agent.schema import Memory, Message
+
+
+class ContextOverflowError(ValueError):
+    """The messages do not fit in the context budget"""
+
+
+def split_turn_groups(messages: List[Message]) -> tuple[List[Message], List[List[Message]]]:
+    """
+    Split the messages into the leading system messages and the turn groups that follow.
+    A tool message always stays in the group of the message that called it,
+    so dropping a group never separates an assistant tool call from its results.
+    """
+    head = 0
+    while head < len(messages) and messages[head].role == "system":
+        head += 1
+    groups: List[List[Message]] = []
+    for message in messages[head:]:
+        if message.role == "tool" and groups:
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+    return messages[:head], groups
+
+
+class OverflowPolicy(ABC):
+    """What to do with messages that are over the context budget"""
+
+    @abstractmethod
+    def fit(self, messages: List[Message], budget: int, counter: TokenCounter) -> List[Message]:
+        """Return the messages to send, within the budget"""
+        pass
+
+
+class RaiseOnOverflow(OverflowPolicy):
+
+    def fit(self, messages: List[Message], budget: int, counter: TokenCounter) -> List[Message]:
+        tokens = counter.count_messages(messages)
+        if tokens > budget:
+            raise ContextOverflowError(f"The messages take {tokens} tokens, over the budget of {budget} tokens")
+        return messages
+
+
+class DropOldest(OverflowPolicy):
+    """Keep the leading system messages, drop the oldest turns until the rest fits"""
+
+    def fit(self, messages: List[Message], budget: int, counter: TokenCounter) -> List[Message]:
+        system_messages, groups = split_turn_groups(messages)
+        tokens = counter.count_messages(messages)
+        # always keep the latest turn, an empty conversation is not a useful request
+        while tokens > budget and len(groups) > 1:
+            tokens -= counter.count_messages(groups.pop(0))
+        if tokens > budget:
+            raise ContextOverflowError(
+                f"The system prompt and the latest turn take {tokens} tokens, over the budget of {budget} tokens"
+            )
+        return system_messages + [message for group in groups for message in group]
+
+
+class DropToolOutputsFirst(OverflowPolicy):
+    """
+    Replace the oldest tool outputs by a short stub first, then drop the oldest turns.
+    The tool messages are kept so that every tool call still has its result.
+    """
+
+    def __init__(self, stub: str = "[tool output dropped to fit the context]"):
+        self.stub = stub
+
+    def fit(self, messages: List[Message], budget: int, counter: TokenCounter) -> List[Message]:
+        messages = list(messages)
+        tokens = counter.count_messages(messages)
+        # the latest message is what the model has to react to, never stub it
+        for index, message in enumerate(messages[:-1]):
+            if tokens <= budget:
+                return messages
+            if message.role != "tool" or message.content == self.stub:
+                continue
+            stubbed = Message.trusted(role="tool", content=self.stub)
+            tokens += counter.count_message(stubbed) - counter.count_message(message)
+            messages[index] = stubbed
+        if tokens <= budget:
+            return messages
+        return DropOldest().fit(messages, budget, counter)
+
+
+class ContextBudget:
+    """
+    Keep the request of an agent within the context window.
+
+    >>> agent = SimpleAgent(llm, prompt, context_budget=ContextBudget(max_tokens=16000, policy=DropToolOutputsFirst()))
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        policy: Optional[OverflowPolicy] = None,
+        counter: Optional[TokenCounter] = None,
+        reserve_tokens: int = 0
+    ):
+        """
+        Args:
+            max_tokens: The context window of the model
+            policy: The overflow policy, drop the oldest turns by default
+            counter: The token counter, the offline heuristic by default
+            reserve_tokens: Tokens kept free for the tool schemas and the completion
+        """
+        if max_tokens <= reserve_tokens:
+            raise ValueError("max_tokens must be greater than reserve_tokens")
+        self.max_tokens = max_tokens
+        self.policy = policy or DropOldest()
+        self.counter = counter or default_token_counter
+        self.reserve_tokens = reserve_tokens
+        self.trimmed_requests = 0
+
+    @property
+    def budget(self) -> int:
+        return self.max_tokens - self.reserve_tokens
+
+    def fit(self, memory: Memory) -> List[Message]:
+        """The messages of the memory to send, the memory itself is left untouched"""
+        if memory.token_count() <= self.budget:
+            return memory.messages.copy()
+        self.trimmed_requests += 1
+        return self.policy.fit(memory.messages, self.budget, self.counter)
+
+    def fit_messages(self, messages: List[Message]) -> List[Message]:
+        """The messages to send out of a selection of messages, e.g. the ones of a RetrievalIndex"""
+        if self.counter.count_messages(messages) <= self.budget:
+            return messages
+        self.trimmed_requests += 1
+        return self.policy.fit(messages, self.budget, self.counter)
@@ -0,0 +1,96 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+from mrai.agent.memory.budget import split_turn_groups
+from mrai.agent.memory.token_counter import TokenCounter
+from mrai.agent.schema import Message
+
+
+class CompactionPolicy(ABC):
+    """
+    Shrink the messages kept by a Memory, applied every time a message is added.
+    Unlike an OverflowPolicy, which trims one request, the compacted messages are gone from the memory.
+    """
+
+    @abstractmethod
+    def compact(self, messages: List[Message], counter: TokenCounter) -> List[Message]:
+        """Return the messages to keep, the list itself when there is nothing to compact"""
+        pass
+
+
+class SlidingWindow(CompactionPolicy):
+    """Keep the leading system messages and the last max_turns turns, see split_turn_groups"""
+
+    def __init__(self, max_turns: int):
+        if max_turns <= 0:
+            raise ValueError("max_turns must be greater than 0")
+        self.max_turns = max_turns
+
+    def compact(self, messages: List[Message], counter: TokenCounter) -> List[Message]:
+        system_messages, groups = split_turn_groups(messages)
+        if len(groups) <= self.max_turns:
+            return messages
+        return system_messages + [message for group in groups[-self.max_turns:] for message in group]
+
+
+class TokenWindow(CompactionPolicy):
+    """
+    Keep the leading system messages and the latest turns within max_tokens.
+    The latest turn is always kept, even when it alone is over the budget.
+    """
+
+    def __init__(self, max_tokens: int):
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be greater than 0")
+        self.max_tokens = max_tokens
+
+    def compact(self, messages: List[Message], counter: TokenCounter) -> List[Message]:
+        tokens = counter.count_messages(messages)
+        if tokens <= self.max_tokens:
+            return messages
+        system_messages, groups = split_turn_groups(messages)
+        dropped = 0
+        while tokens > self.max_tokens and len(groups) - dropped > 1:
+            tokens -= counter.count_messages(groups[dropped])
+            dropped += 1
+        return system_messages + [message for group in groups[dropped:] for message in group]
+
+
+class StubToolResults(CompactionPolicy):
+    """
+    Replace the content of all but the last keep_last tool results by a short stub.
+    The tool messages are kept so that every tool call still has its result.
+    """
+
+    def __init__(self, keep_last: int = 2, stub: str = "[tool output compacted]"):
+        if keep_last < 0:
+            raise ValueError("keep_last must not be negative")
+        self.keep_last = keep_last
+        self.stub = stub
+
+    def compact(self, messages: List[Message], counter: TokenCounter) -> List[Message]:
+        tool_indexes = [index for index, message in enumerate(messages) if message.role == "tool"]
+        old_indexes = tool_indexes[:len(tool_indexes) - self.keep_last] if self.keep_last else tool_indexes
+        old_indexes = [index for index in old_indexes if messages[index].content != self.stub]
+        if not old_indexes:
+            return messages
+        messages = list(messages)
+        for index in old_indexes:
+            messages[index] = Message.trusted(role="tool", content=self.stub)
+        return messages
+
+
+class ChainCompaction(CompactionPolicy):
+    """
+    Apply the policies in order, e.g. stub the old tool results, then bound the tokens
+
+    >>> ChainCompaction(StubToolResults(keep_last=2), TokenWindow(max_tokens=8000))
+    """
+
+    def __init__(self, *policies: CompactionPolicy):
+        self.policies = policies
+
+    def compact(self, messages: List[Message], counter: TokenCounter) -> List[Message]:
+        for policy in self.policies:
+            messages = policy.compact(messages, counter)
+        return messages
@@ -0,0 +1,40 @@
+import json
+from typing import Iterable, Union
+
+from mrai.agent.schema import Message, Tool, ToolCall
+from mrai.agent.tool.tool_registry import ToolRegistry
+from mrai.agent.tool.unbound_tool import UnboundTool
+
+
+def restore_message(payload: dict, tools: Union[ToolRegistry, Iterable[Tool], None] = None) -> Message:
+    """
+    Rebuild a message from its stored wire form, see Message.to_dict.
+    Every tool call is kept: it is bound to the registered tool of its name, or to an UnboundTool when there is none,
+    so restoring never depends on which tools happen to be registered.
+    """
+    tools = ToolRegistry.of(tools)
+    tool_calls = [
+        ToolCall.trusted(
+            id=tool_call["id"],
+            type=tool_call["type"],
+            name=tool_call["function"]["name"],
+            arguments=json.loads(tool_call["function"]["arguments"] or "{}"),
+            tool=tools.get(tool_call["function"]["name"]) or UnboundTool(tool_call["function"]["name"])
+        )
+        for tool_call in payload.get("tool_calls") or []
+    ]
+    return Message.trusted(role=payload["role"], content=payload["content"], tool_calls=tool_calls)
+
+
+def bind_tools(messages: Iterable[Message], tools: Union[ToolRegistry, Iterable[Tool]]) -> int:
+    """Bind the unbound tool calls of restored messages to the registered tools, return the number of bound calls"""
+    tools = ToolRegistry.of(tools)
+    bound = 0
+    for message in messages:
+        for tool_call in message.tool_calls:
+            if isinstance(tool_call.tool, UnboundTool):
+                tool = tools.get(tool_call.function.name)
+                if tool is not None:
+                    tool_call.tool = tool
+                    bound += 1
+    return bound
@@ -0,0 +1,290 @@
+import json
+from typing import Iterable, List, Literal, Optional, Union
+
+import numpy as np
+
+from mrai.agent.llm.semantic_cache import Embedder, HashingEmbedder
+from mrai.agent.memory.restore import restore_message
+from mrai.agent.schema import Memory, Message, Tool
+from mrai.agent.tool.tool_registry import ToolRegistry
+
+
+class VectorIndex:
+    """
+    A growable index of L2-normalized vectors, searched by inner product.
+    Search is brute force, or IVF once the index is large enough: the vectors are clustered by k-means,
+    a query only scores the vectors of its nprobe nearest clusters.
+    The clusters are trained by train(), or by the first search once the index holds ivf_min_size vectors,
+    never by add: a new vector joins its nearest cluster and moves its centroid, i.e. online spherical k-means.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        nlist: int = 64,
+        nprobe: int = 8,
+        ivf_min_size: int = 4096,
+        kmeans_iterations: int = 10,
+        seed: int = 0
+    ):
+        """
+        Args:
+            nlist: The number of IVF clusters
+            nprobe: The clusters scored by a query, more is slower and closer to brute force
+            ivf_min_size: Search brute force below this many vectors, the first search at this size trains the clusters
+        """
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ivf_min_size = ivf_min_size
+        self.kmeans_iterations = kmeans_iterations
+        self._random = np.random.default_rng(seed)
+        self._vectors = np.zeros((64, dim), dtype=np.float32)
+        self.size = 0
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(64, dtype=np.int32)
+        self._lists: List[List[int]] = []
+        # the vectors each centroid has absorbed, the online update moves it by 1 / count
+        self._counts: Optional[np.ndarray] = None
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self.size]
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def add(self, vector: np.ndarray) -> int:
+        if self.size == len(self._vectors):
+            # double the capacity, appends stay amortized constant time
+            self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+            self._assignments = np.concatenate([self._assignments, np.zeros_like(self._assignments)])
+        vector_id = self.size
+        self._vectors[vector_id] = vector
+        self.size += 1
+        if self._centroids is not None:
+            self._assign(vector_id)
+        return vector_id
+
+    def update(self, vector_id: int, vector: np.ndarray):
+        self._vectors[vector_id] = vector
+        if self._centroids is not None:
+            cluster = self._assignments[vector_id]
+            self._lists[cluster].remove(vector_id)
+            self._counts[cluster] -= 1
+            self._assign(vector_id)
+
+    def _assign(self, vector_id: int):
+        """Add the vector to its nearest cluster and move the centroid towards it"""
+        vector = self._vectors[vector_id]
+        cluster = int(np.argmax(self._centroids @ vector))
+        self._assignments[vector_id] = cluster
+        self._lists[cluster].append(vector_id)
+        self._counts[cluster] += 1
+        centroid = self._centroids[cluster] + (vector - self._centroids[cluster]) / self._counts[cluster]
+        norm = np.linalg.norm(centroid)
+        if norm > 0:
+            self._centroids[cluster] = centroid / norm
+
+    def train(self):
+        """Cluster the vectors by spherical k-means"""
+        vectors = self.vectors
+        nlist = min(self.nlist, self.size)
+        centroids = vectors[self._random.choice(self.size, nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # an empty cluster keeps its centroid
+            centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1.0), centroids)
+        self._set_clusters(centroids.astype(np.float32), np.argmax(vectors @ centroids.T, axis=1))
+
+    def _set_clusters(self, centroids: np.ndarray, assignments: np.ndarray):
+        self._centroids = centroids
+        self._assignments[:self.size] = assignments
+        self._counts = np.bincount(assignments, minlength=len(centroids)).astype(np.int64)
+        self._lists = [[] for _ in range(len(centroids))]
+        for vector_id, cluster in enumerate(assignments.tolist()):
+            self._lists[cluster].append(vector_id)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        limit: Optional[int] = None,
+        mode: Literal["auto", "brute", "ivf"] = "auto"
+    ) -> List[tuple[int, float]]:
+        """
+        The ids and scores of the k nearest vectors, best first
+
+        Args:
+            limit: Only search the vectors with an id below limit
+            mode: auto is IVF from ivf_min_size vectors, brute otherwise, ivf trains the clusters first if needed
+        """
+        limit = self.size if limit is None else min(limit, self.size)
+        if k <= 0 or limit <= 0:
+            return []
+        if mode == "ivf" or (mode == "auto" and (self._centroids is not None or self.size >= self.ivf_min_size)):
+            if self._centroids is None:
+                self.train()
+            probes = np.argsort(self._centroids @ query)[::-1][:self.nprobe]
+            candidates = np.array([
+                vector_id for cluster in probes.tolist() for vector_id in self._lists[cluster] if vector_id < limit
+            ], dtype=np.int64)
+            if len(candidates) == 0:
+                return []
+            scores = self._vectors[candidates] @ query
+        else:
+            candidates = np.arange(limit)
+            scores = self._vectors[:limit] @ query
+        if len(candidates) > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+    def state(self) -> dict:
+        """The arrays to persist the index"""
+        state = {"vectors": self.vectors}
+        if self._centroids is not None:
+            state["centroids"] = self._centroids
+            state["assignments"] = self._assignments[:self.size]
+        return state
+
+    def restore(self, state: dict):
+        vectors = state["vectors"].astype(np.float32)
+        self.size = len(vectors)
+        capacity = max(64, self.size)
+        self._vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        self._vectors[:self.size] = vectors
+        self._assignments = np.zeros(capacity, dtype=np.int32)
+        self._centroids = None
+        self._counts = None
+        self._lists = []
+        if "centroids" in state:
+            self._set_clusters(state["centroids"].astype(np.float32), state["assignments"])
+
+
+class RetrievalIndex:
+    """
+    Retrieval-augmented context for an agent.
+    Every message added to the memory is indexed as part of its turn group, see split_turn_groups,
+    a tool result re-embeds the group of its tool call so calls and results are always retrieved together.
+    A request sends the leading system messages, the top_k older groups most similar to the latest group,
+    in their original order, and the last `window` groups.
+    The index keeps its own copy of the groups, so it still retrieves the turns a compaction policy removed.
+
+    >>> retrieval = RetrievalIndex(top_k=4, window=6)
+    >>> agent = SimpleAgent(llm, prompt, retrieval=retrieval)
+    >>> retrieval.save("retrieval.npz")
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        top_k: int = 4,
+        window: int = 6,
+        min_similarity: float = 0.0,
+        search_mode: Literal["auto", "brute", "ivf"] = "auto",
+        **index_kwargs
+    ):
+        """
+        Args:
+            embedder: The embedder of the groups, defaults to a HashingEmbedder
+            top_k: The older groups retrieved per request
+            window: The latest groups always sent
+            min_similarity: Older groups less similar than this are not retrieved
+            index_kwargs: Passed to VectorIndex, e.g. nlist and nprobe
+        """
+        self.embedder = embedder or HashingEmbedder()
+        self.top_k = top_k
+        self.window = window
+        self.min_similarity = min_similarity
+        self.search_mode = search_mode
+        self.index = VectorIndex(self.embedder.dim, **index_kwargs)
+        self.groups: List[List[Message]] = []
+        self._in_head = True
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    @staticmethod
+    def _group_text(group: List[Message]) -> str:
+        lines = []
+        for message in group:
+            if message.content:
+                lines.append(message.content)
+            for tool_call in message.tool_calls:
+                lines.append(f"{tool_call.function.name} {json.dumps(tool_call.function.arguments, ensure_ascii=False)}")
+        return "\n".join(lines)
+
+    def _embed(self, group: List[Message]) -> np.ndarray:
+        return self.embedder.embed([self._group_text(group)])[0]
+
+    def add(self, message: Message):
+        """Index a message added to the memory, the leading system messages are always sent and not indexed"""
+        if self._in_head and message.role == "system":
+            return
+        self._in_head = False
+        if message.role == "tool" and self.groups:
+            self.groups[-1].append(message)
+            self.index.update(len(self.groups) - 1, self._embed(self.groups[-1]))
+        else:
+            self.groups.append([message])
+            self.index.add(self._embed(self.groups[-1]))
+
+    def add_messages(self, messages: Iterable[Message]):
+        for message in messages:
+            self.add(message)
+
+    def select(self, memory: Memory) -> List[Message]:
+        """The messages to send for the next request of the memory"""
+        head = []
+        for message in memory.messages:
+            if message.role != "system":
+                break
+            head.append(message)
+        recent_start = max(0, len(self.groups) - self.window)
+        recent = self.groups[recent_start:]
+        retrieved: List[int] = []
+        if recent_start > 0 and self.groups:
+            query = self._embed(self.groups[-1])
+            retrieved = sorted(
+                group_id
+                for group_id, score in self.index.search(query, self.top_k, limit=recent_start, mode=self.search_mode)
+                if score >= self.min_similarity
+            )
+        return head + [
+            message
+            for group in [self.groups[group_id] for group_id in retrieved] + recent
+            for message in group
+        ]
+
+    def save(self, path: str):
+        """Write the index and its groups to path, an .npz file, the vectors are not recomputed on load"""
+        groups = json.dumps([[message.to_dict() for message in group] for group in self.groups], ensure_ascii=False)
+        # through a file object, np.savez would append .npz to a path without it
+        with open(path, "wb") as file:
+            np.savez(file, groups=np.array(groups), in_head=np.array(self._in_head), **self.index.state())
+
+    def load(self, path: str, tools: Union[ToolRegistry, Iterable[Tool], None] = None):
+        """
+        Replace the index by the one of a .npz file
+
+        Args:
+            tools: The tools the tool calls are bound to, usually the ones of the agent, the others are left unbound
+        """
+        tools = ToolRegistry.of(tools)
+        with np.load(path) as data:
+            state = {key: data[key] for key in data.files}
+        if state["vectors"].shape[1] != self.embedder.dim:
+            raise ValueError(f"The index {path} has dim {state['vectors'].shape[1]}, the embedder has dim {self.embedder.dim}")
+        self.groups = [
+            [restore_message(payload, tools) for payload in group]
+            for group in json.loads(str(state.pop("groups")))
+        ]
+        self._in_head = bool(state.pop("in_head"))
+        self.index.restore(state)
@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+from mrai.agent.memory.restore import restore_message
+from mrai.agent.schema import Memory, Message, Tool
+from mrai.agent.tool.tool_registry import ToolRegistry
+
+
+class SessionStore:
+    """
+    A durable, append-only log of the messages of many sessions, in one SQLite file.
+    Appends are buffered and committed in batches, when batch_size messages are buffered, and by a background thread
+    flush_interval seconds after the last commit, so a crash loses at most the messages of the last flush_interval.
+    Messages are keyed by (session_id, seq), reading a session or a slice of it never scans the other sessions.
+    The seq of a message is assigned by SQLite when it is committed, so workers handing a session back and forth
+    never reuse a seq.
+    Messages are stored in their wire form, see Message.to_dict, and rebuilt by restore_message on load,
+    a tool call whose tool is not registered yet is kept with an UnboundTool, see bind_tools.
+    A session has one writer at a time, a worker taking a session over opens it after the previous one flushed or closed.
+
+    >>> store = SessionStore("sessions.sqlite")
+    >>> agent = SimpleAgent(llm, prompt, memory=store.open_memory(session_id, tools, tail=200))
+    >>> store.close()
+    """
+
+    def __init__(self, path: str, batch_size: int = 64, flush_interval: Optional[float] = 1.0):
+        """
+        Args:
+            path: The SQLite file of the store
+            batch_size: Commit when this many messages are buffered
+            flush_interval: Commit the buffered messages this many seconds after the last commit, None to only commit by size
+        """
+        if batch_size <= 0:
+            raise ValueError("batch_size must be greater than 0")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets readers of other workers go on while a batch is committed
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS session_messages ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+        self._db.commit()
+        # (session_id, payload, created_at, session_id), the seq is assigned on commit
+        self._pending: List[tuple[str, str, float, str]] = []
+        # session id -> its buffered messages
+        self._pending_counts: Dict[str, int] = {}
+        self._last_flush = time.monotonic()
+        self.appended = 0
+        self.commits = 0
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically, name="session-store-flush", daemon=True)
+            self._flusher.start()
+
+    def _session_length(self, session_id: str) -> int:
+        """The caller holds the lock"""
+        row = self._db.execute(
+            "SELECT MAX(seq) FROM session_messages WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        committed = row[0] + 1 if row[0] is not None else 0
+        return committed + self._pending_counts.get(session_id, 0)
+
+    def append(self, session_id: str, message: Message):
+        payload = json.dumps(message.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self._pending.append((session_id, payload, time.time(), session_id))
+            self._pending_counts[session_id] = self._pending_counts.get(session_id, 0) + 1
+            self.appended += 1
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        """The caller holds the lock"""
+        if self._pending and self._db is not None:
+            # the seq follows the last committed message of the session, whichever worker committed it
+            self._db.executemany(
+                "INSERT INTO session_messages (session_id, seq, payload, created_at) "
+                "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ? FROM session_messages WHERE session_id = ?",
+                self._pending
+            )
+            self._db.commit()
+            self._pending = []
+            self._pending_counts = {}
+            self.commits += 1
+        self._last_flush = time.monotonic()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush()
+
+    def flush(self):
+        """Commit the buffered messages"""
+        with self._lock:
+            self._flush()
+
+    def length(self, session_id: str) -> int:
+        with self._lock:
+            return self._session_length(session_id)
+
+    def load_payloads(self, session_id: str, start: int = 0, end: Optional[int] = None) -> List[dict]:
+        """The wire forms of the messages [start, end) of the session, negative indexes count from its end"""
+        with self._lock:
+            # the buffered messages are committed first, so one query sees the whole slice
+            self._flush()
+            length = self._session_length(session_id)
+            start, end, _ = slice(start, end).indices(length)
+            if start >= end:
+                return []
+            rows = self._db.execute(
+                "SELECT payload FROM session_messages WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (session_id, start, end)
+            ).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def load(
+        self,
+        session_id: str,
+        tools: Union[ToolRegistry, Iterable[Tool], None] = None,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> List[Message]:
+        """
+        The messages [start, end) of the session, e.g. the older messages a memory opened with a tail left on disk
+
+        Args:
+            tools: The tools the tool calls are bound to, usually the ones of the agent, the others are left unbound
+        """
+        tools = ToolRegistry.of(tools)
+        return [restore_message(payload, tools) for payload in self.load_payloads(session_id, start, end)]
+
+    def open_memory(
+        self,
+        session_id: str,
+        tools: Union[ToolRegistry, Iterable[Tool], None] = None,
+        tail: Optional[int] = None
+    ) -> Memory:
+        """
+        A memory of the session, every message added to it is appended to the store.
+        The log keeps every added message, a compaction policy of the memory only shrinks what is kept in memory.
+
+        Args:
+            tools: The tools the tool calls are bound to, usually the ones of the agent, the others are left unbound
+            tail: Only load the leading system messages and about the last tail messages, the older ones stay on disk.
+                The tail starts at a turn group, see split_turn_groups, so it may hold a few more messages
+                and never opens with a tool result cut from its tool call
+        """
+        tools = ToolRegistry.of(tools)
+        length = self.length(session_id)
+        if tail is None or tail >= length:
+            messages = self.load(session_id, tools)
+        else:
+            start = self._group_start(session_id, length - tail)
+            messages = self._load_head(session_id, tools, start) + self.load(session_id, tools, start)
+        memory = Memory(messages=messages)
+        memory.set_session_store(self, session_id)
+        return memory
+
+    def _group_start(self, session_id: str, start: int, chunk: int = 16) -> int:
+        """The start of the turn group of the message at start, i.e. the first message before it that is not a tool result"""
+        while start > 0:
+            payloads = self.load_payloads(session_id, max(0, start - chunk), start + 1)
+            for payload in reversed(payloads):
+                if payload["role"] != "tool":
+                    return start
+                start -= 1
+        return max(start, 0)
+
+    def _load_head(self, session_id: str, tools: ToolRegistry, end: int, chunk: int = 16) -> List[Message]:
+        """The leading system messages of the session before end, read chunk by chunk"""
+        head: List[Message] = []
+        for start in range(0, end, chunk):
+            for payload in self.load_payloads(session_id, start, min(start + chunk, end)):
+                if payload["role"] != "system":
+                    return head
+                head.append(restore_message(payload, tools))
+        return head
+
+    def sessions(self) -> List[str]:
+        with self._lock:
+            self._flush()
+            return [session_id for session_id, in self._db.execute("SELECT DISTINCT session_id FROM session_messages")]
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._flush()
+            self._db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "appended": self.appended,
+                "pending": len(self._pending),
+                "commits": self.commits,
+            }
+
+    def close(self):
+        """Commit the buffered messages, stop the flush thread and close the file"""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        with self._lock:
+            if self._db is not None:
+                self._flush()
+                self._db.close()
+                self._db = None
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+import time
+from typing import List, Optional
+
+from loguru import logger
+
+from mrai.agent.llm.llm import LLM
+from mrai.agent.memory.budget import split_turn_groups
+from mrai.agent.memory.compaction import CompactionPolicy
+from mrai.agent.memory.token_counter import TokenCounter
+from mrai.agent.schema import Message
+
+DEFAULT_SUMMARY_PROMPT = (
+    "You compress the history of a conversation between a user, an assistant and its tools. "
+    "Write a concise summary that keeps the facts, decisions, open questions, tool results and user preferences "
+    "the assistant needs to continue. Reply with the summary only."
+)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+class SummarizationStats:
+    """The runs of a summarizer, compression_ratio is the tokens summarized per token of summary"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.applied = 0
+        self.discarded = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self._latency_sum = 0.0
+        self.last_latency: Optional[float] = None
+
+    def record_run(self, latency: float, tokens_in: int = 0, tokens_out: int = 0, failed: bool = False):
+        with self._lock:
+            self.runs += 1
+            self._latency_sum += latency
+            self.last_latency = latency
+            if failed:
+                self.failures += 1
+            else:
+                self.tokens_in += tokens_in
+                self.tokens_out += tokens_out
+
+    def record_swap(self, applied: bool):
+        with self._lock:
+            if applied:
+                self.applied += 1
+            else:
+                self.discarded += 1
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.tokens_in / self.tokens_out if self.tokens_out else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "failures": self.failures,
+                "applied": self.applied,
+                "discarded": self.discarded,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "compression_ratio": self.compression_ratio,
+                "avg_latency": self._latency_sum / self.runs if self.runs else 0.0,
+                "last_latency": self.last_latency,
+            }
+
+
+class _PendingSummary:
+
+    __slots__ = ("replaced", "summary")
+
+    def __init__(self, replaced: List[Message], summary: Message):
+        # the turns the summary stands for, besides the previous summary
+        self.replaced = replaced
+        self.summary = summary
+
+
+class SummarizingCompaction(CompactionPolicy):
+    """
+    Replace the old turns of a memory by a summary written by a cheaper LLM, off the critical path.
+    When the memory goes over trigger_tokens, the turns before the last keep_turns are summarized in a background task,
+    the summary is swapped in by the first compaction after it is ready, i.e. the next added message,
+    and only when the summarized messages are still in place, so a step never waits for the summarizer.
+    One instance compacts one memory, it needs a running event loop, without one the memory is left as is.
+
+    >>> agent = SimpleAgent(llm, prompt, compaction=SummarizingCompaction(LLM(cheap_config), trigger_tokens=12000))
+    >>> agent.memory._compaction.stats.snapshot()
+    """
+
+    def __init__(
+        self,
+        llm: LLM,
+        trigger_tokens: int,
+        keep_turns: int = 4,
+        prompt: str = DEFAULT_SUMMARY_PROMPT
+    ):
+        """
+        Args:
+            llm: The LLM writing the summaries, usually cheaper than the one of the agent
+            trigger_tokens: Summarize when the memory takes more tokens than this
+            keep_turns: The latest turn groups kept verbatim, see split_turn_groups
+            prompt: The system prompt of the summarizer
+        """
+        if keep_turns < 1:
+            raise ValueError("keep_turns must be at least 1")
+        self.llm = llm
+        self.trigger_tokens = trigger_tokens
+        self.keep_turns = keep_turns
+        self.prompt = prompt
+        self.stats = SummarizationStats()
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[_PendingSummary] = None
+        self._summary: Optional[Message] = None
+
+    def compact(self, messages: List[Message], counter: TokenCounter) -> List[Message]:
+        if self._ready is not None:
+            pending, self._ready = self._ready, None
+            swapped = self._swap(messages, pending)
+            self.stats.record_swap(swapped is not None)
+            if swapped is not None:
+                messages = swapped
+        if self._task is None and counter.count_messages(messages) > self.trigger_tokens:
+            self._start(messages, counter)
+        return messages
+
+    def _swap(self, messages: List[Message], pending: _PendingSummary) -> Optional[List[Message]]:
+        """The messages with the summary in place of the ones it replaces, None when they have changed meanwhile"""
+        head, _ = split_turn_groups(messages)
+        rest = messages[len(head):]
+        head = [message for message in head if message is not self._summary]
+        end = len(pending.replaced)
+        if len(rest) < end or any(a is not b for a, b in zip(rest[:end], pending.replaced)):
+            logger.debug("The summarized messages have changed, the summary is discarded")
+            return None
+        self._summary = pending.summary
+        return head + [pending.summary] + rest[end:]
+
+    def _start(self, messages: List[Message], counter: TokenCounter):
+        head, groups = split_turn_groups(messages)
+        if len(groups) <= self.keep_turns:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.debug("No running event loop, the memory is not summarized")
+            return
+        previous = [message for message in head if message is self._summary]
+        old = [message for group in groups[:-self.keep_turns] for message in group]
+        self._task = loop.create_task(self._summarize(previous, old, counter))
+
+    @staticmethod
+    def _transcript(messages: List[Message]) -> str:
+        lines = []
+        for message in messages:
+            if message.content:
+                lines.append(f"{message.role}: {message.content}")
+            for tool_call in message.tool_calls:
+                arguments = json.dumps(tool_call.function.arguments, ensure_ascii=False)
+                lines.append(f"{message.role} called {tool_call.function.name}({arguments})")
+        return "\n".join(lines)
+
+    async def _summarize(self, previous: List[Message], replaced: List[Message], counter: TokenCounter):
+        started_at = time.monotonic()
+        summarized = previous + replaced
+        try:
+            response = await self.llm.chat(
+                [
+                    Message.trusted(role="system", content=self.prompt),
+                    Message.trusted(role="user", content=self._transcript(summarized)),
+                ],
+                agent_name="summarizer"
+            )
+            summary = Message.trusted(role="system", content=SUMMARY_PREFIX + response.content)
+            self.stats.record_run(
+                time.monotonic() - started_at,
+                tokens_in=counter.count_messages(summarized),
+                tokens_out=counter.count_message(summary)
+            )
+            self._ready = _PendingSummary(replaced, summary)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.record_run(time.monotonic() - started_at, failed=True)
+            logger.warning(f"Summarizing the memory failed: {e!r}")
+        finally:
+            self._task = None
+
+    async def flush(self):
+        """Wait for the running summarization, if any, the summary is swapped in by the next compaction"""
+        task = self._task
+        if task is not None:
+            await asyncio.shield(task)
+
+    def cancel(self):
+        """Cancel the running summarization, if any"""
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,68 @@
+import json
+import math
+import re
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from mrai.agent.schema import Message
+
+# CJK ideographs, kana and hangul are roughly one token per character
+_WIDE_CHARS = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+
+class TokenCounter(ABC):
+    """
+    Count the tokens of messages.
+    The count of a message is cached on the message itself, messages are not expected to change once they are in memory.
+    """
+
+    # tokens added by the chat format around every message
+    message_overhead: int = 4
+
+    @abstractmethod
+    def count_text(self, text: str) -> int:
+        """Count the tokens of a text"""
+        pass
+
+    @property
+    def cache_key(self) -> str:
+        """Counters sharing a key share the cached counts of the messages"""
+        return type(self).__qualname__
+
+    def count_message(self, message: "Message") -> int:
+        cached = message.cached_token_count(self.cache_key)
+        if cached is not None:
+            return cached
+        tokens = self.message_overhead + self.count_text(message.content)
+        if message.tool_calls:
+            tokens += self.count_text(json.dumps(
+                [tool_call.to_dict() for tool_call in message.tool_calls],
+                ensure_ascii=False
+            ))
+        message.cache_token_count(self.cache_key, tokens)
+        return tokens
+
+    def count_messages(self, messages: "list[Message]") -> int:
+        return sum(self.count_message(message) for message in messages)
+
+
+class HeuristicTokenCounter(TokenCounter):
+    """Offline estimate: one token per CJK character, one token per 4 other characters"""
+
+    def __init__(self, chars_per_token: float = 4.0):
+        self.chars_per_token = chars_per_token
+
+    @property
+    def cache_key(self) -> str:
+        return f"heuristic:{self.chars_per_token}"
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        wide = len(_WIDE_CHARS.findall(text))
+        return wide + math.ceil((len(text) - wide) / self.chars_per_token)
+
+
+# the counter used when none is given
+default_token_counter = HeuristicTokenCounter()
@@ -1,12 +1,65 @@
 import json
 from abc import ABC, abstractmethod
-from pydantic import Field
-from typing import List, Literal, Union, TYPE_CHECKING, Any, Dict
+from pydantic import Field, PrivateAttr
+from typing import List, Literal, Optional, Type, TypeVar, Union, TYPE_CHECKING, Any, Dict
 from openai import BaseModel
+from mrai.agent.memory.token_counter import TokenCounter, default_token_counter
 
 # 如果在类型检查时，导入 Agent 类型
 if TYPE_CHECKING:
     from mrai.agent.agent import Agent
+    from mrai.agent.memory.compaction import CompactionPolicy
+    from mrai.agent.memory.session_store import SessionStore
+    from mrai.agent.memory.retrieval import RetrievalIndex
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+# class -> (whether it keeps extra fields, its private attributes and their default factories or defaults)
+_TRUSTED_LAYOUTS: Dict[type, tuple[bool, tuple[tuple[str, Any, Any], ...]]] = {}
+
+# bumped by every field assignment of a Message, a Memory keeps its running token total until a message is edited
+_message_edits = 0
+
+
+def _construct_trusted(cls: Type[ModelT], **fields: Any) -> ModelT:
+    """
+    Build a model from every one of its fields without validation.
+    The model_construct of the openai BaseModel rebuilds nested values by type, it is slower than validating,
+    this only sets the instance state pydantic would set, the private attributes get their defaults.
+    That state is a pydantic 2 internal, hence the <3 pin, test_schema checks it against the validating constructors.
+    """
+    layout = _TRUSTED_LAYOUTS.get(cls)
+    if layout is None:
+        layout = _TRUSTED_LAYOUTS[cls] = (
+            cls.model_config.get("extra") == "allow",
+            tuple(
+                (name, attribute.default_factory, attribute.default)
+                for name, attribute in cls.__private_attributes__.items()
+            )
+        )
+    keeps_extra, private_attributes = layout
+    instance = cls.__new__(cls)
+    object.__setattr__(instance, "__dict__", fields)
+    object.__setattr__(instance, "__pydantic_fields_set__", set(fields))
+    object.__setattr__(instance, "__pydantic_extra__", {} if keeps_extra else None)
+    object.__setattr__(instance, "__pydantic_private__", {
+        name: factory() if factory is not None else default
+        for name, factory, default in private_attributes
+    } if private_attributes else None)
+    return instance
+
+
+class _FrozenDict(dict):
+    """A dict refusing changes, a memoized wire form is shared by every caller, copy it with dict(...) to change it"""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The wire form of a message is read-only, copy it with dict(...) to change it")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
 
 
 class Message(BaseModel):
@@ -15,13 +68,47 @@ class Message(BaseModel):
     content: str = Field(..., description="The content of the message")
     tool_calls: list["ToolCall"] = Field(default=[], description="The tool calls of the message")
 
+    # token counts of the message, by token counter
+    _token_counts: Dict[str, int] = PrivateAttr(default_factory=dict)
+    # the memoized wire form of the message, see to_dict
+    _wire: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+        if name in type(self).model_fields:
+            # a new field value, drop what was derived from the old one
+            self._wire = None
+            self._token_counts = {}
+            global _message_edits
+            _message_edits += 1
+
+    @classmethod
+    def trusted(cls, role: str, content: str, tool_calls: Optional[List["ToolCall"]] = None) -> "Message":
+        """
+        Build a message without validation, for values the framework produced itself, e.g. LLM responses and tool results.
+        Input from users goes through the validating constructor.
+        """
+        return _construct_trusted(cls, role=role, content=content, tool_calls=tool_calls if tool_calls is not None else [])
+
+    def cached_token_count(self, counter_key: str) -> Optional[int]:
+        return self._token_counts.get(counter_key)
+
+    def cache_token_count(self, counter_key: str, tokens: int):
+        self._token_counts[counter_key] = tokens
 
     def to_dict(self, **kwargs):
-        return {
-            "role": self.role,
-            "content": self.content,
-            "tool_calls": [tool_call.to_dict() for tool_call in self.tool_calls] if self.tool_calls else None
-        }
+        """
+        The wire form of the message, memoized until a field is assigned.
+        It is shared by every caller and read-only, the tool calls are a tuple.
+        Changing the tool_calls list of the message in place is not seen, assign a new list instead.
+        """
+        if self._wire is None:
+            self._wire = _FrozenDict(
+                role=self.role,
+                content=self.content,
+                tool_calls=tuple(tool_call.to_dict() for tool_call in self.tool_calls) if self.tool_calls else None
+            )
+        return self._wire
 
 class FlowInput(BaseModel):
     """The input of the flow"""
@@ -111,16 +198,38 @@ class ToolCall(BaseModel):
     type: str = Field(..., description="The type of the tool call")
     function: ToolCallFunction = Field(..., description="The tool of the tool call")
     tool: Tool = Field(..., description="The tool of the tool call")
-    
+
+    # the memoized wire form of the tool call, see to_dict
+    _wire: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+
+    @classmethod
+    def trusted(cls, id: str, type: str, name: str, arguments: dict, tool: Tool) -> "ToolCall":
+        """Build a tool call without validation, for tool calls the framework parsed and bound itself"""
+        return _construct_trusted(
+            cls,
+            id=id,
+            type=type,
+            function=_construct_trusted(cls.ToolCallFunction, name=name, arguments=arguments),
+            tool=tool
+        )
+
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+        if name in type(self).model_fields:
+            self._wire = None
+
     def to_dict(self) -> dict:
-        return {
-            "id": self.id,
-            "type": self.type,
-            "function": {
-                "name": self.function.name,
-                "arguments": json.dumps(self.function.arguments, ensure_ascii=False)
-            },
-        }
+        """The wire form of the tool call, memoized until a field is assigned, shared and read-only"""
+        if self._wire is None:
+            self._wire = _FrozenDict(
+                id=self.id,
+                type=self.type,
+                function=_FrozenDict(
+                    name=self.function.name,
+                    arguments=json.dumps(self.function.arguments, ensure_ascii=False)
+                ),
+            )
+        return self._wire
 
 
 class LLMResponse(BaseModel):
@@ -130,6 +239,11 @@ class LLMResponse(BaseModel):
     tool_calls: list[ToolCall] = Field(default=[], description="The tool calls of the response")
     message: dict = Field(..., description="The choice of the response")
 
+    @classmethod
+    def trusted(cls, content: str, message: dict, tool_calls: Optional[List[ToolCall]] = None) -> "LLMResponse":
+        """Build a response without validation, for responses the framework parsed itself"""
+        return _construct_trusted(cls, content=content, message=message, tool_calls=tool_calls if tool_calls is not None else [])
+
     
 class FlowStepContext(BaseModel):
     """The context of the flow step"""
@@ -143,8 +257,125 @@ class Memory(BaseModel):
 
     messages: List[Message] = Field(default=[], description="The messages of the memory")
 
+    # counts the tokens of the messages, the counts are cached on the messages
+    _token_counter: TokenCounter = PrivateAttr(default=default_token_counter)
+    # wire forms of the messages, kept in sync by formatted_messages
+    _formatted: List[Dict[str, Any]] = PrivateAttr(default_factory=list)
+    # applied by add_message, see mrai.agent.memory.compaction
+    _compaction: Optional["CompactionPolicy"] = PrivateAttr(default=None)
+    # the durable log of the added messages, see SessionStore.open_memory
+    _session_store: Optional["SessionStore"] = PrivateAttr(default=None)
+    _session_id: Optional[str] = PrivateAttr(default=None)
+    # indexes every added message, see mrai.agent.memory.retrieval
+    _retrieval: Optional["RetrievalIndex"] = PrivateAttr(default=None)
+    # the running token total of the messages, and what it was counted on, see token_count
+    _token_total: int = PrivateAttr(default=0)
+    _total_messages: Optional[List[Message]] = PrivateAttr(default=None)
+    _total_length: int = PrivateAttr(default=0)
+    _total_edits: int = PrivateAttr(default=-1)
+    _total_counter: Optional[TokenCounter] = PrivateAttr(default=None)
+
     def add_message(self, message: Message):
+        # count the new message now, so the count is cached before the next request
+        tokens = self._token_counter.count_message(message)
+        total = self.token_count()
         self.messages.append(message)
+        self._set_token_total(total + tokens)
+        if self._session_store is not None:
+            self._session_store.append(self._session_id, message)
+        if self._retrieval is not None:
+            self._retrieval.add(message)
+        if self._compaction is not None:
+            self.compact()
+
+    def set_session_store(self, store: Optional["SessionStore"], session_id: Optional[str] = None):
+        """Append every message added from now on to the session of the store, None to stop"""
+        if store is not None and not session_id:
+            raise ValueError("session_id is required")
+        self._session_store = store
+        self._session_id = session_id
+
+    @property
+    def session_id(self) -> Optional[str]:
+        return self._session_id
+
+    def set_retrieval(self, retrieval: Optional["RetrievalIndex"]):
+        """Index every message added from now on, an empty index first indexes the current messages"""
+        self._retrieval = retrieval
+        if retrieval is not None and len(retrieval) == 0:
+            retrieval.add_messages(self.messages)
+
+    @property
+    def retrieval(self) -> Optional["RetrievalIndex"]:
+        return self._retrieval
+
+    def set_compaction(self, policy: Optional["CompactionPolicy"]):
+        """Compact the memory with the policy now and every time a message is added, None to keep every message"""
+        self._compaction = policy
+        if policy is not None:
+            self.compact()
+
+    def compact(self) -> bool:
+        """Apply the compaction policy, return whether the messages changed"""
+        if self._compaction is None:
+            return False
+        compacted = self._compaction.compact(self.messages, self._token_counter)
+        if compacted is self.messages:
+            return False
+        self.messages = compacted
+        # the policy counted the kept messages and the summary, their counts are cached
+        self._set_token_total(self._token_counter.count_messages(compacted))
+        return True
+
+    def formatted_messages(self) -> List[Dict[str, Any]]:
+        """
+        The wire forms of the messages, ready for LLM.chat.
+        Every entry is checked against the memoized wire form of its message, so only the messages that were added,
+        replaced or edited since the last call are formatted.
+        """
+        formatted = self._formatted
+        for index, message in enumerate(self.messages):
+            wire = message.to_dict()
+            if index == len(formatted):
+                formatted.append(wire)
+            elif formatted[index] is not wire:
+                formatted[index] = wire
+        del formatted[len(self.messages):]
+        return formatted.copy()
+
+    def set_token_counter(self, counter: TokenCounter):
+        self._token_counter = counter
+        self.clear_formatted_messages()
+
+    def clear_formatted_messages(self):
+        """Drop the wire forms kept by formatted_messages, the next call formats every message again"""
+        self._formatted = []
+
+    def token_count(self) -> int:
+        """
+        The tokens of all the messages, a running total kept by add_message and compact.
+        It is counted again when the messages were assigned, edited or counted with another counter since,
+        only the messages added or edited since they were last counted are counted.
+        Replacing an item of the messages list in place is not seen, assign a new list instead.
+        """
+        if not self._token_total_current():
+            self._set_token_total(self._token_counter.count_messages(self.messages))
+        return self._token_total
+
+    def _token_total_current(self) -> bool:
+        return (
+            self._total_messages is self.messages
+            and self._total_length == len(self.messages)
+            and self._total_edits == _message_edits
+            and self._total_counter is self._token_counter
+        )
+
+    def _set_token_total(self, total: int):
+        self._token_total = total
+        self._total_messages = self.messages
+        self._total_length = len(self.messages)
+        self._total_edits = _message_edits
+        self._total_counter = self._token_counter
         
 
 class Callback(ABC):
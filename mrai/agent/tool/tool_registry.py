@@ -0,0 +1,119 @@
+import hashlib
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from mrai.agent.schema import Tool
+
+
+class ToolRegistry:
+    """
+    The tools of an agent, indexed by name.
+    The serialized schemas are computed once and reused until the tool set changes,
+    the fingerprint identifies the tool set and only changes with it.
+
+    >>> tools = ToolRegistry([Terminate(), AssignAgent()])
+    >>> tools.get("terminate")
+    >>> tools.schemas()  # the OpenAI tool schemas
+    >>> tools.fingerprint  # a stable key of the tool set
+    """
+
+    def __init__(self, tools: Optional[Iterable[Tool]] = None):
+        self._tools: Dict[str, Tool] = {}
+        # the tools in order, for positional access and iteration
+        self._ordered: Optional[List[Tool]] = None
+        self._schemas: Optional[List[Dict[str, Any]]] = None
+        self._schemas_json: Dict[Optional[int], str] = {}
+        self._fingerprint: Optional[str] = None
+        if tools:
+            self.extend(tools)
+
+    @classmethod
+    def of(cls, tools: Union["ToolRegistry", Iterable[Tool], None]) -> "ToolRegistry":
+        """Return the registry itself, or a new registry of the tools"""
+        if isinstance(tools, ToolRegistry):
+            return tools
+        return cls(tools)
+
+    def append(self, tool: Tool):
+        """Add a tool, a tool with the same name is replaced in place"""
+        self._tools[tool.name] = tool
+        self.invalidate()
+
+    def extend(self, tools: Iterable[Tool]):
+        for tool in tools:
+            self._tools[tool.name] = tool
+        self.invalidate()
+
+    def remove(self, tool: Union[Tool, str]):
+        """Remove a tool by instance or by name, missing tools are ignored"""
+        name = tool if isinstance(tool, str) else tool.name
+        if self._tools.pop(name, None) is not None:
+            self.invalidate()
+
+    def clear(self):
+        self._tools.clear()
+        self.invalidate()
+
+    def get(self, name: str) -> Optional[Tool]:
+        return self._tools.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._tools)
+
+    def invalidate(self):
+        """Drop the cached schemas, to be called when a registered tool was changed in place"""
+        self._ordered = None
+        self._schemas = None
+        self._schemas_json = {}
+        self._fingerprint = None
+
+    def schemas(self) -> List[Dict[str, Any]]:
+        """The OpenAI tool schemas, shared between calls, do not modify them"""
+        if self._schemas is None:
+            self._schemas = [tool.to_dict() for tool in self._tools.values()]
+        return self._schemas
+
+    def schemas_json(self, indent: Optional[int] = None) -> str:
+        """The schemas as JSON, compact by default"""
+        cached = self._schemas_json.get(indent)
+        if cached is None:
+            if indent is None:
+                cached = json.dumps(self.schemas(), ensure_ascii=False, separators=(",", ":"))
+            else:
+                cached = json.dumps(self.schemas(), ensure_ascii=False, indent=indent)
+            self._schemas_json[indent] = cached
+        return cached
+
+    @property
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha256(self.schemas_json().encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def __contains__(self, item: Union[Tool, str]) -> bool:
+        name = item if isinstance(item, str) else item.name
+        return name in self._tools
+
+    def _tool_list(self) -> List[Tool]:
+        if self._ordered is None:
+            self._ordered = list(self._tools.values())
+        return self._ordered
+
+    def __iter__(self) -> Iterator[Tool]:
+        # the list is replaced, never changed, when the tool set changes, a tool can be removed while iterating
+        return iter(self._tool_list())
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def __bool__(self) -> bool:
+        return bool(self._tools)
+
+    def __getitem__(self, key: Union[str, int]) -> Tool:
+        """A tool by name, or by position for the code written against a list of tools"""
+        if isinstance(key, str):
+            return self._tools[key]
+        return self._tool_list()[key]
+
+    def __repr__(self) -> str:
+        return f"ToolRegistry({self.names()})"
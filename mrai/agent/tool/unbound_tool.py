@@ -0,0 +1,18 @@
+from mrai.agent.schema import Tool
+
+
+class UnboundTool(Tool):
+    """
+    Stands for the tool of a restored tool call when that tool is not registered, e.g. terminate before a flow adds it.
+    The tool call keeps its name and arguments, bind_tools swaps in the real tool once it is registered.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(
+            name=name,
+            description=f"The tool {name} of a restored tool call, not bound to a registered tool",
+            parameters={}
+        )
+
+    def execute(self, **kwargs):
+        raise RuntimeError(f"Tool {self.name} is not bound to a registered tool, bind the restored messages first")
@@ -0,0 +1,49 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from mrai.agent.llm.mock_server import MockOpenAIServer, MockServerConfig
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def server_loop():
+    """One background event loop for every mock server, it outlives the asyncio.run of the tests"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    # let the servers told to exit shut down before the loop stops
+    asyncio.run_coroutine_threadsafe(_shut_down(), loop).result(timeout=10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+async def _shut_down():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    if tasks:
+        await asyncio.wait(tasks, timeout=5)
+
+
+@pytest.fixture
+def mock_server(server_loop):
+    """Start a MockOpenAIServer, return the server and its base_url"""
+    servers = []
+
+    def serve(config: MockServerConfig = None) -> tuple[MockOpenAIServer, str]:
+        port = free_port()
+        server = MockOpenAIServer(config)
+        servers.append(asyncio.run_coroutine_threadsafe(server.serve(port=port), server_loop).result(timeout=10))
+        return server, f"http://127.0.0.1:{port}/v1"
+
+    yield serve
+    for server in servers:
+        server.should_exit = True
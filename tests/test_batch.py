@@ -0,0 +1,86 @@
+import asyncio
+
+from mrai.agent.llm.batch import BatchRun, StreamBatchRun
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockServerConfig
+from mrai.agent.llm.stream import StreamChunk
+from mrai.agent.tool.tool_registry import ToolRegistry
+
+
+class FakeLLM:
+    """Records the peak of concurrent calls, the conversation ["fail"] fails"""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.peak_tasks = 0
+
+    async def _enter(self, conversation):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        self.peak_tasks = max(self.peak_tasks, len(asyncio.all_tasks()))
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if conversation == ["fail"]:
+            raise ValueError("failed")
+
+    async def chat(self, conversation, tools=None, **kwargs):
+        await self._enter(conversation)
+        return conversation[0]
+
+    async def stream_chat(self, conversation, tools=None, **kwargs):
+        await self._enter(conversation)
+        yield StreamChunk("reasoning_content", "hmm")
+        yield StreamChunk("content", conversation[0])
+
+
+def test_chat_many_runs_a_bounded_set_of_workers():
+    llm = FakeLLM()
+    conversations = [[f"c{i}"] for i in range(50)] + [["fail"]]
+
+    async def run():
+        batch = BatchRun(llm, conversations, ToolRegistry(), max_concurrency=4, chat_kwargs={})
+        return [item async for item in batch], batch
+
+    items, batch = asyncio.run(run())
+    assert sorted(item.index for item in items) == list(range(51))
+    assert {item.result for item in items if item.ok} == {f"c{i}" for i in range(50)}
+    assert batch.report.snapshot()["failed"] == 1
+    assert llm.peak == 4
+    # the workers and the main task, not a task per conversation
+    assert llm.peak_tasks <= 5
+
+
+def test_stream_many_counts_the_text_of_typed_chunks():
+    llm = FakeLLM()
+    conversations = [["hello"], ["hi"], ["fail"]]
+
+    async def run():
+        batch = StreamBatchRun(llm, conversations, ToolRegistry(), max_concurrency=2, stream_kwargs={})
+        return [event async for event in batch], batch
+
+    events, batch = asyncio.run(run())
+    assert [progress.chars for progress in batch.progress] == [len("hmmhello"), len("hmmhi"), 0]
+    assert sorted(event.index for event in events if event.done) == [0, 1, 2]
+    assert isinstance(batch.progress[2].error, ValueError)
+    assert llm.peak == 2
+
+
+def test_stream_many_against_the_mock_server(mock_server):
+    server, base_url = mock_server(MockServerConfig())
+    llm = LLM(LLMConfig(api_key="test", model="test", base_url=base_url))
+    conversations = [[f"question {i}"] for i in range(6)]
+
+    async def run():
+        batch = llm.stream_many(conversations, max_concurrency=3, typed=True)
+        texts = {}
+        async for event in batch:
+            if event.chunk is not None:
+                texts[event.index] = texts.get(event.index, "") + event.chunk.text
+        return texts, batch
+
+    texts, batch = asyncio.run(run())
+    assert texts == {i: f"Mock response to: question {i}" for i in range(6)}
+    assert [progress.chars for progress in batch.progress] == [len(texts[i]) for i in range(6)]
+    assert server.requests == 6
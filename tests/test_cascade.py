@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from mrai.agent.llm.cascade import CascadeLLM
+from mrai.agent.llm.llm import ToolCallError
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockResponse, MockServerConfig, MockToolCall
+from mrai.agent.tool.terminate_tool import Terminate
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def answering(content: str) -> MockServerConfig:
+    return MockServerConfig(responses=[MockResponse(content=content)])
+
+
+def calling_an_unknown_tool() -> MockServerConfig:
+    return MockServerConfig(responses=[MockResponse(tool_calls=[MockToolCall(name="missing")])])
+
+
+def make_cascade(mock_server, *tiers: MockServerConfig, acceptance_check=None):
+    servers, configs = [], []
+    for level, tier in enumerate(tiers):
+        server, base_url = mock_server(tier)
+        servers.append(server)
+        configs.append(LLMConfig(api_key="test", model=f"tier-{level}", base_url=base_url))
+    return CascadeLLM(configs, acceptance_check=acceptance_check), servers
+
+
+def test_a_tool_call_error_escalates_to_the_next_tier(mock_server):
+    llm, servers = make_cascade(mock_server, calling_an_unknown_tool(), answering("large"))
+    message = asyncio.run(llm.chat(MESSAGES, [Terminate()]))
+    assert message.content == "large"
+    assert [server.requests for server in servers] == [1, 1]
+    small, large = llm.cascade_stats()
+    assert small["escalations"] == {"unknown_tool": 1}
+    assert large["accepted"] == 1
+
+
+def test_the_last_tier_raises_its_tool_call_error(mock_server):
+    llm, _ = make_cascade(mock_server, calling_an_unknown_tool(), calling_an_unknown_tool())
+    with pytest.raises(ToolCallError):
+        asyncio.run(llm.chat(MESSAGES, [Terminate()]))
+    assert llm.cascade_stats()[1]["errors"] == 1
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_the_acceptance_check_rejects_a_response(mock_server, asynchronous):
+    def check(message, messages):
+        return message.content != "small"
+
+    async def async_check(message, messages):
+        await asyncio.sleep(0)
+        return check(message, messages)
+
+    llm, _ = make_cascade(
+        mock_server, answering("small"), answering("medium"), answering("large"),
+        acceptance_check=async_check if asynchronous else check
+    )
+    assert asyncio.run(llm.chat(MESSAGES)).content == "medium"
+    assert [stats["escalations"] for stats in llm.cascade_stats()] == [{"rejected": 1}, {}, {}]
+    assert [stats["calls"] for stats in llm.cascade_stats()] == [1, 1, 0]
+
+
+def test_the_last_tier_always_answers(mock_server):
+    checked = []
+
+    def reject_everything(message, messages):
+        checked.append(message.content)
+        return False
+
+    llm, _ = make_cascade(mock_server, answering("small"), answering("large"), acceptance_check=reject_everything)
+    assert asyncio.run(llm.chat(MESSAGES)).content == "large"
+    # the check is not applied to the last tier
+    assert checked == ["small"]
+    assert llm.cascade_stats()[1]["accepted"] == 1
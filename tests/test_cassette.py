@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from mrai.agent.llm.cassette import Cassette, CassetteMissError
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockServerConfig
+
+
+async def conversation(llm: LLM) -> list:
+    first = await llm.chat(["first"])
+    streamed = "".join([chunk async for chunk in llm.stream_chat(["second"])])
+    again = await llm.chat(["first"], use_cache=False)
+    return [first.content, streamed, again.content]
+
+
+@pytest.mark.parametrize("name", ["flow.jsonl", "flow.jsonl.gz"])
+def test_record_then_replay_offline(mock_server, tmp_path, name):
+    server, base_url = mock_server(MockServerConfig(template="{last_user_message} #{request_index}"))
+    config = LLMConfig(api_key="test", model="test", base_url=base_url)
+    path = str(tmp_path / name)
+
+    recorder = Cassette(path, mode="record")
+    opened = []
+    open_file = recorder._open
+    recorder._open = lambda mode: opened.append(mode) or open_file(mode)
+    recorded = asyncio.run(conversation(LLM(config, cassette=recorder)))
+    recorder.close()
+    assert recorded == ["first #0", "second #1", "first #2"]
+    assert recorder.stats()["recorded"] == 3
+    # one writer for every interaction
+    assert opened == ["a"]
+
+    player = Cassette(path, mode="replay", speed=0)
+    replayed = asyncio.run(conversation(LLM(config, cassette=player)))
+    assert replayed == recorded
+    assert server.requests == 3
+    assert player.stats()["hits"] == 3
+
+    with pytest.raises(CassetteMissError):
+        asyncio.run(LLM(config, cassette=player).chat(["unknown"]))
+
+
+def test_a_closed_recorder_appends_on_its_next_recording(mock_server, tmp_path):
+    _, base_url = mock_server()
+    config = LLMConfig(api_key="test", model="test", base_url=base_url)
+    path = str(tmp_path / "flow.jsonl.gz")
+    recorder = Cassette(path, mode="record")
+    llm = LLM(config, cassette=recorder)
+    asyncio.run(llm.chat(["one"]))
+    recorder.close()
+    asyncio.run(llm.chat(["two"]))
+    recorder.close()
+    assert Cassette(path).stats()["requests"] == 2
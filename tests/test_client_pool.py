@@ -0,0 +1,71 @@
+import asyncio
+
+import httpx
+
+from mrai.agent.llm.client_pool import ClientPool, _CountingTransport, client_pool
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.retry import RetryPolicy
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_counts_the_connections_opened_and_reused(mock_server):
+    _, base_url = mock_server()
+
+    async def run():
+        pool = ClientPool()
+        config = LLMConfig(api_key="test", model="test", base_url=base_url)
+        try:
+            client = pool.get_client(config)
+            for _ in range(3):
+                await client.chat.completions.create(model="test", messages=MESSAGES)
+            await asyncio.gather(*[client.chat.completions.create(model="test", messages=MESSAGES) for _ in range(3)])
+            return pool.stats()["endpoints"][config.base_url]
+        finally:
+            await pool.aclose()
+
+    stats = asyncio.run(run())
+    assert stats["requests"] == 6
+    # the sequential requests share one connection, the concurrent ones need up to two more
+    assert 1 <= stats["connections_opened"] <= 3
+    assert stats["connections_reused"] == 6 - stats["connections_opened"]
+
+
+def test_the_trace_of_the_caller_still_sees_every_event(mock_server):
+    _, base_url = mock_server()
+
+    async def run():
+        transport = _CountingTransport()
+        traced = []
+
+        async def trace(event_name: str, info: dict):
+            traced.append(event_name)
+
+        async with httpx.AsyncClient(transport=transport) as client:
+            await client.post(f"{base_url}/chat/completions", json={"model": "test", "messages": MESSAGES}, extensions={"trace": trace})
+        return transport.connections_opened, traced
+
+    connections_opened, traced = asyncio.run(run())
+    assert connections_opened == 1
+    assert "connection.connect_tcp.complete" in traced
+    assert "http11.receive_response_headers.complete" in traced
+
+
+def test_every_event_loop_gets_its_own_clients(mock_server):
+    server, base_url = mock_server()
+    # no retries, a client bound to a closed loop would fail its first request
+    llm = LLM(LLMConfig(api_key="test", model="test", base_url=base_url, retry_policy=RetryPolicy(max_attempts=1)))
+
+    async def run():
+        response = await llm.chat(MESSAGES)
+        chunks = [chunk async for chunk in llm.stream_chat(MESSAGES)]
+        second = await llm.chat(MESSAGES)
+        return response.content, "".join(chunks), second.content, llm.client
+
+    first = asyncio.run(run())
+    second = asyncio.run(run())
+    assert first[:3] == second[:3]
+    assert first[3] is not second[3]
+    assert server.requests == 6
+    assert client_pool.stats()["endpoints"][base_url]["connections_reused"] >= 2
@@ -0,0 +1,57 @@
+from mrai.agent.memory.compaction import ChainCompaction, SlidingWindow, StubToolResults, TokenWindow
+from mrai.agent.memory.token_counter import default_token_counter
+from mrai.agent.schema import Memory, Message, ToolCall
+from mrai.agent.tool.terminate_tool import Terminate
+
+
+def system(content: str = "prompt") -> Message:
+    return Message(role="system", content=content)
+
+
+def user(content: str) -> Message:
+    return Message(role="user", content=content)
+
+
+def tool_turn(content: str) -> list[Message]:
+    tool_call = ToolCall(
+        id="call_1", type="function", function=ToolCall.ToolCallFunction(name="terminate", arguments={}), tool=Terminate()
+    )
+    return [Message(role="assistant", content="", tool_calls=[tool_call]), Message(role="tool", content=content)]
+
+
+def test_sliding_window_keeps_the_system_messages_and_the_last_turns():
+    messages = [system(), user("a"), *tool_turn("result"), user("b"), user("c")]
+    policy = SlidingWindow(max_turns=2)
+    assert policy.compact(messages, default_token_counter) == [messages[0], messages[4], messages[5]]
+    # the tool result stays with its call
+    assert SlidingWindow(max_turns=3).compact(messages, default_token_counter)[1:3] == messages[2:4]
+    assert SlidingWindow(max_turns=4).compact(messages, default_token_counter) is messages
+
+
+def test_token_window_drops_the_oldest_turns_and_keeps_the_latest():
+    messages = [system(), user("a" * 400), user("b" * 400), user("c" * 40)]
+    compacted = TokenWindow(max_tokens=150).compact(messages, default_token_counter)
+    assert compacted == [messages[0], messages[2], messages[3]]
+    assert default_token_counter.count_messages(compacted) <= 150
+    # the latest turn is kept even when it alone is over the budget
+    assert TokenWindow(max_tokens=10).compact(messages, default_token_counter) == [messages[0], messages[3]]
+
+
+def test_stub_tool_results_keeps_the_last_results():
+    messages = [user("a"), *tool_turn("first " * 50), *tool_turn("second " * 50), *tool_turn("third")]
+    compacted = StubToolResults(keep_last=1).compact(messages, default_token_counter)
+    assert [message.content for message in compacted if message.role == "tool"] == [
+        "[tool output compacted]", "[tool output compacted]", "third"
+    ]
+    # already stubbed, nothing to do
+    assert StubToolResults(keep_last=1).compact(compacted, default_token_counter) is compacted
+
+
+def test_a_memory_compacts_on_every_added_message():
+    memory = Memory()
+    memory.set_compaction(ChainCompaction(StubToolResults(keep_last=0), SlidingWindow(max_turns=2)))
+    for message in [system(), user("a"), *tool_turn("result"), user("b")]:
+        memory.add_message(message)
+    assert [message.role for message in memory.messages] == ["system", "assistant", "tool", "user"]
+    assert memory.messages[2].content == "[tool output compacted]"
+    assert memory.token_count() == default_token_counter.count_messages(memory.messages)
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import pytest
+
+from mrai.agent.llm.deadline import DeadlineExceededError, iterate_with_deadline
+
+
+async def ticks(interval: float, count: int, closed: list):
+    try:
+        for i in range(count):
+            await asyncio.sleep(interval)
+            yield i
+    finally:
+        closed.append(True)
+
+
+def test_the_deadline_cancels_the_pending_read_and_closes_the_stream():
+    closed = []
+
+    async def run():
+        received = []
+        with pytest.raises(DeadlineExceededError):
+            async for i in iterate_with_deadline(ticks(0.05, 100, closed), time.monotonic() + 0.12):
+                received.append(i)
+        return received
+
+    assert asyncio.run(run()) == [0, 1]
+    assert closed == [True]
+
+
+def test_the_caller_is_not_cancelled_while_it_handles_a_chunk():
+    closed = []
+
+    async def run():
+        received = []
+        with pytest.raises(DeadlineExceededError):
+            async for i in iterate_with_deadline(ticks(0, 100, closed), time.monotonic() + 0.05):
+                # the deadline passes here, the caller's own await completes
+                await asyncio.sleep(0.1)
+                received.append(i)
+        return received
+
+    assert asyncio.run(run()) == [0]
+    assert closed == [True]
+
+
+def test_a_stream_ending_before_the_deadline_is_left_alone():
+    closed = []
+
+    async def run():
+        received = [i async for i in iterate_with_deadline(ticks(0, 3, closed), time.monotonic() + 5)]
+        # the task was not cancelled by the timer
+        await asyncio.sleep(0.01)
+        return received
+
+    assert asyncio.run(run()) == [0, 1, 2]
+    assert closed == [True]
@@ -0,0 +1,154 @@
+import asyncio
+from typing import Optional
+
+from mrai.agent.agent import RealtimeCallAgent, SimpleAgent
+from mrai.agent.flow.agent_flow import AgentFlow
+from mrai.agent.flow.realtime_call_agent_flow import MemoryOrganizer, RealtimeCallAgentFlow
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockResponse, MockServerConfig, MockToolCall
+from mrai.agent.llm.stream import StreamChunk
+from mrai.agent.llm.telemetry import Telemetry
+from mrai.agent.schema import FlowInput, Tool, ToolCall
+from mrai.agent.tool.terminate_tool import Terminate
+
+deadlines = []
+
+
+def terminate() -> list[ToolCall]:
+    return [ToolCall.trusted(id="call_1", type="function", name="terminate", arguments={}, tool=Terminate())]
+
+
+class BaselineAgent(SimpleAgent):
+    """An agent written against the original action(self)"""
+
+    async def action(self) -> tuple[Optional[str], list[ToolCall]]:
+        return "done", terminate()
+
+
+class DeadlineAgent(SimpleAgent):
+
+    async def action(self, deadline: Optional[float] = None) -> tuple[Optional[str], list[ToolCall]]:
+        deadlines.append(deadline)
+        return "done", terminate()
+
+
+def make_llm() -> LLM:
+    return LLM(LLMConfig(api_key="test", model="test", base_url="http://127.0.0.1:9/v1"))
+
+
+def test_action_without_kwargs_still_runs():
+    flow = AgentFlow({"primary": BaselineAgent(make_llm(), "prompt")}, timeout=5)
+    assert flow.action_kwargs(flow.agents["primary"], stop=["x"]) == {}
+    asyncio.run(flow.run(FlowInput(text="hello")))
+
+
+def test_action_gets_the_kwargs_it_accepts():
+    flow = AgentFlow({"primary": DeadlineAgent(make_llm(), "prompt")}, timeout=5)
+    asyncio.run(flow.run(FlowInput(text="hello")))
+    assert deadlines == [flow.deadline]
+    accepted = flow.action_kwargs(SimpleAgent(make_llm(), "prompt"), stop=["x"])
+    assert set(accepted) == {"stop", "flow_id", "deadline", "timeout"}
+
+
+class RecordingFlow(RealtimeCallAgentFlow):
+
+    def __init__(self, agents):
+        super().__init__(agents, memory_organizer=None)
+        self.formatted_chunks = []
+
+    async def handle_formatted_chunk(self, formatted_chunk: dict):
+        self.formatted_chunks.append(formatted_chunk)
+
+
+def test_typed_chunks_reach_handle_formatted_chunk():
+    flow = RecordingFlow({"primary": RealtimeCallAgent(make_llm(), "prompt")})
+    asyncio.run(flow.handle_stream_chunk(StreamChunk("reasoning_content", "hmm")))
+    assert flow.formatted_chunks == [{"type": "reasoning_content", "content": "hmm"}]
+
+
+class StreamChunkFlow(RealtimeCallAgentFlow):
+
+    def __init__(self, agents):
+        super().__init__(agents, memory_organizer=None)
+        self.printed = []
+
+    def print_chunk(self, kind, text):
+        self.printed.append((kind, text))
+
+
+def test_typed_chunks_skip_the_formatted_chunk_by_default():
+    flow = StreamChunkFlow({"primary": RealtimeCallAgent(make_llm(), "prompt")})
+    formatted = []
+
+    async def spy(formatted_chunk: dict):
+        formatted.append(formatted_chunk)
+
+    # an instance attribute, not an override of the class
+    flow.handle_formatted_chunk = spy
+    asyncio.run(flow.handle_stream_chunk(StreamChunk("content", "hi")))
+    assert flow.printed == [("content", "hi")]
+    assert formatted == []
+
+
+class Echo(Tool):
+
+    def __init__(self):
+        super().__init__(name="echo", description="Echo the text", parameters={
+            "text": Tool.ToolParameter(name="text", description="The text", type="string", required=True)
+        })
+
+    def execute(self, text: str):
+        echoed.append(text)
+        return text
+
+
+echoed = []
+
+
+class Observations(MemoryOrganizer):
+
+    def __init__(self):
+        self.contents = []
+        self.observations = []
+
+    async def organize(self, content_cache: str, observation: dict, memory: dict, flow_input: str):
+        self.contents.append(content_cache)
+        self.observations.append(observation)
+        return False
+
+
+def run_tag_tool_calls(mock_server, stop_at_tool_call: bool) -> tuple[Observations, Telemetry]:
+    echoed.clear()
+    _, base_url = mock_server(MockServerConfig(tool_call_style="tag", responses=[
+        MockResponse(content="Let me echo.", tool_calls=[MockToolCall(name="echo", arguments={"text": "hello"})]),
+        MockResponse(content="Done.", tool_calls=[MockToolCall(name="terminate")]),
+    ]))
+    telemetry = Telemetry()
+    llm = LLM(LLMConfig(api_key="test", model="test", base_url=base_url), telemetry=telemetry)
+    organizer = Observations()
+    flow = RealtimeCallAgentFlow(
+        {"primary": RealtimeCallAgent(llm, "prompt", tools=[Echo()])}, organizer, stop_at_tool_call=stop_at_tool_call
+    )
+    flow.print_chunk = lambda kind, text: None
+    asyncio.run(flow.run(FlowInput(text="echo hello")))
+    return organizer, telemetry
+
+
+def test_the_tool_call_tag_cut_by_the_stop_sequence_is_restored_once(mock_server):
+    organizer, telemetry = run_tag_tool_calls(mock_server, stop_at_tool_call=True)
+    # the server stopped the generation, the stream ended on its own
+    assert not telemetry.records()[0].abandoned
+    [content] = organizer.contents
+    assert content.count("</tool_call>") == 1 and content.endswith("</tool_call>")
+    assert echoed == ["hello"]
+    assert organizer.observations[0]["tool_call_result"] == {"success": True, "result": "hello"}
+
+
+def test_without_the_stop_sequence_the_tool_call_runs_once(mock_server):
+    organizer, telemetry = run_tag_tool_calls(mock_server, stop_at_tool_call=False)
+    # the flow closed the stream at the closing tag
+    assert telemetry.records()[0].abandoned
+    [content] = organizer.contents
+    assert content.count("</tool_call>") == 1
+    assert echoed == ["hello"]
@@ -0,0 +1,102 @@
+import json
+import time
+
+import httpx
+
+from mrai.agent.llm.mock_server import MockResponse, MockServerConfig, MockToolCall
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def post(base_url: str, **body) -> httpx.Response:
+    return httpx.post(f"{base_url}/chat/completions", json={"model": "mock", "messages": MESSAGES, **body}, timeout=10)
+
+
+def stream_events(base_url: str, **body) -> list:
+    events = []
+    with httpx.stream(
+        "POST", f"{base_url}/chat/completions",
+        json={"model": "mock", "messages": MESSAGES, "stream": True, **body}, timeout=10
+    ) as response:
+        for line in response.iter_lines():
+            if line.startswith("data: ") and line != "data: [DONE]":
+                events.append(json.loads(line[len("data: "):]))
+    return events
+
+
+def streamed_content(events: list) -> str:
+    return "".join(event["choices"][0]["delta"].get("content") or "" for event in events if event["choices"])
+
+
+def test_the_template_and_the_scripted_responses(mock_server):
+    _, base_url = mock_server()
+    assert post(base_url).json()["choices"][0]["message"]["content"] == "Mock response to: hi"
+
+    _, base_url = mock_server(MockServerConfig(responses=[MockResponse(content="one"), MockResponse(content="two")]))
+    assert [post(base_url).json()["choices"][0]["message"]["content"] for _ in range(3)] == ["one", "two", "one"]
+
+
+def test_the_stop_sequence_is_applied_server_side(mock_server):
+    _, base_url = mock_server(MockServerConfig(responses=[MockResponse(content="before END after")]))
+    choice = post(base_url, stop=["END"]).json()["choices"][0]
+    assert choice["message"]["content"] == "before "
+    assert choice["finish_reason"] == "stop"
+    assert streamed_content(stream_events(base_url, stop="END")) == "before "
+
+
+def test_a_stop_inside_the_tool_call_tags_drops_the_closing_tag(mock_server):
+    _, base_url = mock_server(MockServerConfig(
+        tool_call_style="tag",
+        responses=[MockResponse(content="calling", tool_calls=[MockToolCall(name="search", arguments={"q": "x"})])]
+    ))
+    content = post(base_url, stop=["</tool_call>"]).json()["choices"][0]["message"]["content"]
+    assert "<tool_call>" in content and "</tool_call>" not in content
+
+
+def test_the_usage_chunk_is_streamed_only_when_asked(mock_server):
+    _, base_url = mock_server()
+    assert all(event["choices"] for event in stream_events(base_url))
+    events = stream_events(base_url, stream_options={"include_usage": True})
+    usage = events[-1]["usage"]
+    assert events[-1]["choices"] == []
+    assert usage["completion_tokens"] == len(streamed_content(events).split())
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+
+
+def test_native_tool_calls_are_streamed_in_fragments(mock_server):
+    _, base_url = mock_server(MockServerConfig(
+        responses=[MockResponse(tool_calls=[MockToolCall(name="search", arguments={"query": "the weather"})])]
+    ))
+    tools = [{"type": "function", "function": {"name": "search", "parameters": {}}}]
+    events = stream_events(base_url, tools=tools)
+    fragments = [
+        event["choices"][0]["delta"]["tool_calls"][0]["function"]["arguments"]
+        for event in events if event["choices"] and event["choices"][0]["delta"].get("tool_calls")
+    ]
+    assert len(fragments) > 2
+    assert json.loads("".join(fragments)) == {"query": "the weather"}
+    assert events[-1]["choices"][0]["finish_reason"] == "tool_calls"
+
+
+def test_injected_errors_and_stats(mock_server):
+    server, base_url = mock_server(MockServerConfig(error_script=[429, 200, 500], retry_after=2))
+    first = post(base_url)
+    assert first.status_code == 429 and first.headers["retry-after"] == "2.0"
+    assert post(base_url).status_code == 200
+    assert post(base_url).status_code == 500
+    stats = httpx.get(f"{base_url.removesuffix('/v1')}/stats").json()
+    assert stats == {"requests": 3, "errors": {"429": 1, "500": 1}}
+    assert server.requests == 3
+
+
+def test_the_latency_and_the_stream_rate(mock_server):
+    _, base_url = mock_server(MockServerConfig(
+        time_to_first_token=0.1, tokens_per_second=50, responses=[MockResponse(content="one two three four five")]
+    ))
+    started = time.monotonic()
+    post(base_url)
+    assert time.monotonic() - started >= 0.1
+    started = time.monotonic()
+    stream_events(base_url)
+    # the time to first token, then 5 tokens at 50 per second
+    assert time.monotonic() - started >= 0.1 + 5 / 50
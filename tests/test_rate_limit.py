@@ -0,0 +1,53 @@
+import asyncio
+
+from loguru import logger
+
+from mrai.agent.llm.rate_limit import RateLimiter, RateLimiterRegistry
+
+
+def test_registry_warns_about_other_budgets():
+    registry = RateLimiterRegistry()
+    warnings = []
+    sink = logger.add(lambda message: warnings.append(message), level="WARNING")
+    try:
+        limiter = registry.get("http://llm", "model", 60, 1000)
+        assert registry.get("http://llm", "model", 60, 1000) is limiter
+        assert warnings == []
+        assert registry.get("http://llm", "model", 60, 5000) is limiter
+    finally:
+        logger.remove(sink)
+    assert len(warnings) == 1
+    assert limiter.tpm == 1000
+
+
+def test_refund_gives_the_charged_tokens_back():
+    async def run():
+        limiter = RateLimiter(tpm=1000)
+        charged = await limiter.acquire(800)
+        limiter.refund(charged)
+        # without the refund this request would wait for the bucket to refill
+        await asyncio.wait_for(limiter.acquire(800), timeout=1)
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats["refunds"] == 1
+    assert stats["refunded_tokens"] == 800
+
+
+def test_a_grant_cancelled_before_it_is_used_gives_back_the_request_slot():
+    async def run():
+        limiter = RateLimiter(rpm=1, tpm=1000)
+        await limiter.acquire(100)
+        waiting = asyncio.ensure_future(limiter.acquire(100))
+        await asyncio.sleep(0)
+        # a slot frees up, the waiter is granted, and cancelled before it resumes
+        limiter.requests.adjust(-1)
+        limiter._dispatch()
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        # without the refunded slot this request would wait a minute
+        await asyncio.wait_for(limiter.acquire(100), timeout=1)
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats["refunds"] == 1 and stats["refunded_tokens"] == 100
@@ -0,0 +1,84 @@
+import sqlite3
+import time
+
+from mrai.agent.llm.cache import ResponseCache, make_cache_key
+
+
+def payload(content: str) -> dict:
+    return {"role": "assistant", "content": content}
+
+
+def test_entries_expire_after_the_ttl():
+    cache = ResponseCache(ttl=0.05)
+    cache.set("key", payload("answer"))
+    assert cache.get("key") == payload("answer")
+    time.sleep(0.06)
+    assert cache.get("key") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_the_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", payload("a"))
+    cache.set("b", payload("b"))
+    cache.get("a")
+    cache.set("c", payload("c"))
+    assert cache.get("b") is None
+    assert cache.get("a") == payload("a") and cache.get("c") == payload("c")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    key = make_cache_key(model="test", messages=[{"role": "user", "content": "hi"}])
+    cache = ResponseCache(path=path)
+    cache.set(key, payload("answer"))
+    cache.close()
+
+    reopened = ResponseCache(path=path)
+    assert reopened.get(key) == payload("answer")
+    assert reopened.stats()["disk_hits"] == 1
+    # now in the memory tier
+    assert reopened.get(key) == payload("answer")
+    assert reopened.stats()["memory_hits"] == 1
+    reopened.close()
+
+
+def test_writes_are_committed_in_batches(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path=path, batch_size=3, flush_interval=None)
+    cache.set("a", payload("a"))
+    cache.set("b", payload("b"))
+    assert cache.stats()["commits"] == 0
+    cache.set("c", payload("c"))
+    # the writer thread commits the full batch
+    for _ in range(100):
+        if cache.stats()["commits"]:
+            break
+        time.sleep(0.01)
+    assert cache.stats()["commits"] == 1
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 3
+    cache.close()
+
+
+def test_an_entry_evicted_before_its_commit_is_still_found(tmp_path):
+    cache = ResponseCache(max_entries=1, path=str(tmp_path / "cache.sqlite"), flush_interval=None)
+    cache.set("a", payload("a"))
+    cache.set("b", payload("b"))
+    assert cache.stats()["commits"] == 0
+    assert cache.get("a") == payload("a")
+    cache.close()
+
+
+def test_an_expired_entry_is_deleted_from_the_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(max_entries=1, path=path, ttl=0.05)
+    cache.set("a", payload("a"))
+    cache.flush()
+    cache.set("b", payload("b"))
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    cache.close()
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT key FROM llm_cache").fetchall() == [("b",)]
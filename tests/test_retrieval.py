@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+
+from mrai.agent.memory.retrieval import RetrievalIndex, VectorIndex
+from mrai.agent.schema import Message, ToolCall
+from mrai.agent.tool.terminate_tool import Terminate
+from mrai.agent.tool.unbound_tool import UnboundTool
+
+
+def random_vectors(count: int, dim: int = 32, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_save_writes_the_given_path_and_load_keeps_tool_calls(tmp_path):
+    retrieval = RetrievalIndex()
+    retrieval.add_messages([
+        Message(role="user", content="hello"),
+        Message(
+            role="assistant",
+            content="",
+            tool_calls=[
+                ToolCall(
+                    id="call_1",
+                    type="function",
+                    function=ToolCall.ToolCallFunction(name="terminate", arguments={"reason": "done"}),
+                    tool=Terminate()
+                )
+            ]
+        ),
+    ])
+    path = str(tmp_path / "retrieval.index")
+    retrieval.save(path)
+    assert os.listdir(tmp_path) == ["retrieval.index"]
+
+    restored = RetrievalIndex()
+    restored.load(path)
+    assert [[message.to_dict() for message in group] for group in restored.groups] == \
+        [[message.to_dict() for message in group] for group in retrieval.groups]
+    assert isinstance(restored.groups[1][0].tool_calls[0].tool, UnboundTool)
+
+
+def test_add_never_trains_the_first_search_does():
+    index = VectorIndex(32, nlist=8, nprobe=8, ivf_min_size=100)
+    vectors = random_vectors(400)
+    for vector in vectors[:200]:
+        index.add(vector)
+    assert not index.trained
+    index.search(vectors[0], 5)
+    assert index.trained
+
+    # later vectors join the trained clusters, with every cluster probed IVF matches brute force
+    for vector in vectors[200:]:
+        index.add(vector)
+    for query in vectors[::50]:
+        assert index.search(query, 5, mode="ivf") == index.search(query, 5, mode="brute")
@@ -0,0 +1,115 @@
+import asyncio
+
+import openai
+import pytest
+
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockServerConfig
+from mrai.agent.llm.retry import HedgePolicy, LatencyTracker, RetryPolicy, RetryStats, call_hedged
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def make_llm(base_url: str, **config) -> LLM:
+    return LLM(LLMConfig(api_key="test", model="test", base_url=base_url, **config))
+
+
+def fast_retries(max_attempts: int) -> RetryPolicy:
+    return RetryPolicy(max_attempts=max_attempts, base_delay=0.01, jitter="none", respect_retry_after=False)
+
+
+def test_chat_is_retried_until_it_succeeds(mock_server):
+    server, base_url = mock_server(MockServerConfig(error_script=[500, 429, 200]))
+    llm = make_llm(base_url, retry_policy=fast_retries(3))
+    response = asyncio.run(llm.chat(MESSAGES))
+    assert response.content == "Mock response to: hi"
+    assert server.requests == 3
+    assert llm.retry_stats.snapshot() == {
+        "attempts": 3, "retries": 2, "give_ups": 0, "errors": {"server": 1, "rate_limit": 1}, "hedges": 0, "hedge_wins": 0,
+    }
+
+
+def test_retries_give_up_after_max_attempts(mock_server):
+    server, base_url = mock_server(MockServerConfig(error_script=[500] * 5))
+    llm = make_llm(base_url, retry_policy=fast_retries(2))
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(llm.chat(MESSAGES))
+    assert server.requests == 2
+    assert llm.retry_stats.give_ups == 1
+
+
+def test_client_errors_are_not_retried(mock_server):
+    server, base_url = mock_server(MockServerConfig(error_script=[400]))
+    llm = make_llm(base_url, retry_policy=fast_retries(3))
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(llm.chat(MESSAGES))
+    assert server.requests == 1
+    assert llm.retry_stats.retries == 0
+
+
+def test_a_stream_failing_before_its_first_chunk_is_retried(mock_server):
+    server, base_url = mock_server(MockServerConfig(error_script=[503, 200]))
+    llm = make_llm(base_url, retry_policy=fast_retries(3))
+
+    async def run():
+        return "".join([chunk async for chunk in llm.stream_chat(MESSAGES)])
+
+    assert asyncio.run(run()) == "Mock response to: hi"
+    assert server.requests == 2
+    assert llm.retry_stats.retries == 1
+
+
+def test_the_slow_request_is_hedged_and_the_loser_cancelled():
+    tracker = LatencyTracker()
+    for _ in range(5):
+        tracker.record(0.01)
+    stats = RetryStats()
+    calls = []
+    cancelled = []
+
+    async def request():
+        index = len(calls)
+        calls.append(index)
+        try:
+            # the first request stalls, the hedge answers right away
+            await asyncio.sleep(5 if index == 0 else 0)
+            return index
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+
+    async def run():
+        result = await call_hedged(request, HedgePolicy(min_samples=5), tracker, stats)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == 1
+    assert cancelled == [0]
+    assert stats.hedges == 1 and stats.hedge_wins == 1
+
+
+def test_no_hedge_before_enough_samples():
+    stats = RetryStats()
+    calls = []
+
+    async def request():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    tracker = LatencyTracker()
+    assert asyncio.run(call_hedged(request, HedgePolicy(min_samples=5), tracker, stats)) == "answer"
+    assert len(calls) == 1 and stats.hedges == 0
+    assert len(tracker) == 1
+
+
+def test_chat_sends_a_hedge_to_the_server(mock_server):
+    server, base_url = mock_server(MockServerConfig(time_to_first_token=0.2))
+    llm = make_llm(base_url, hedge_policy=HedgePolicy(min_samples=3))
+    for _ in range(3):
+        llm.latency_tracker.record(0.01)
+    response = asyncio.run(llm.chat(MESSAGES))
+    assert response.content == "Mock response to: hi"
+    assert server.requests == 2
+    assert llm.retry_stats.hedges == 1
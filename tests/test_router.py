@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockServerConfig
+from mrai.agent.llm.retry import RetryPolicy
+from mrai.agent.llm.router import CircuitBreaker, CircuitBreakerPolicy, EndpointConfig
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_the_breaker_opens_then_probes_then_closes():
+    breaker = CircuitBreaker(CircuitBreakerPolicy(failure_threshold=2, reset_timeout=10))
+    breaker.record_failure(now=0)
+    assert breaker.state == "closed" and breaker.available(now=0)
+    breaker.record_failure(now=1)
+    assert breaker.state == "open" and breaker.trips == 1
+    assert not breaker.available(now=5)
+
+    assert breaker.available(now=11)
+    assert breaker.state == "half_open"
+    breaker.on_selected()
+    # a single probe at a time
+    assert not breaker.available(now=11)
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.consecutive_failures == 0
+
+
+def test_a_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(CircuitBreakerPolicy(failure_threshold=1, reset_timeout=10))
+    breaker.record_failure(now=0)
+    assert breaker.available(now=10)
+    breaker.on_selected()
+    breaker.record_failure(now=10)
+    assert breaker.state == "open" and breaker.opened_at == 10
+    assert breaker.trips == 2
+    assert not breaker.available(now=15)
+
+
+def test_failover_ejects_the_failing_endpoint_until_it_recovers(mock_server):
+    failing, failing_url = mock_server(MockServerConfig(error_script=[500, 500]))
+    healthy, healthy_url = mock_server()
+    llm = LLM(LLMConfig(
+        api_key="test",
+        model="test",
+        endpoints=[EndpointConfig(base_url=failing_url), EndpointConfig(base_url=healthy_url)],
+        retry_policy=RetryPolicy(max_attempts=1),
+        circuit_breaker=CircuitBreakerPolicy(failure_threshold=2, reset_timeout=0.2)
+    ))
+    failing_endpoint = llm.router.endpoints[0]
+
+    async def chat(times: int):
+        for _ in range(times):
+            assert (await llm.chat(MESSAGES, use_cache=False)).content == "Mock response to: hi"
+
+    # each of the two failures fails over to the healthy endpoint, the second one opens the circuit
+    asyncio.run(chat(2))
+    assert failing.requests == 2
+    assert llm.router.failovers == 2
+    assert failing_endpoint.breaker.state == "open"
+
+    # ejected, the healthy endpoint serves every request
+    asyncio.run(chat(3))
+    assert failing.requests == 2
+
+    # after reset_timeout a probe goes to the recovered endpoint and closes the circuit
+    time.sleep(0.25)
+    asyncio.run(chat(1))
+    assert failing.requests == 3
+    assert failing_endpoint.breaker.state == "closed"
+    assert llm.router.stats()["endpoints"][f"{failing_url}#test"]["trips"] == 1
@@ -0,0 +1,110 @@
+import copy
+
+import pytest
+
+from mrai.agent.memory.compaction import SlidingWindow
+from mrai.agent.memory.token_counter import HeuristicTokenCounter
+from mrai.agent.schema import LLMResponse, Memory, Message, ToolCall
+from mrai.agent.tool.terminate_tool import Terminate
+
+
+def make_tool_call() -> ToolCall:
+    return ToolCall(
+        id="call_1",
+        type="function",
+        function=ToolCall.ToolCallFunction(name="terminate", arguments={"reason": "done"}),
+        tool=Terminate()
+    )
+
+
+def test_wire_form_is_read_only():
+    message = Message(role="assistant", content="hi", tool_calls=[make_tool_call()])
+    wire = message.to_dict()
+    with pytest.raises(TypeError):
+        wire["content"] = "changed"
+    with pytest.raises(TypeError):
+        wire["tool_calls"][0]["function"]["arguments"] = "{}"
+    assert message.to_dict() is wire
+    assert dict(wire)["content"] == "hi"
+
+
+def test_formatted_messages_follow_edits():
+    memory = Memory()
+    message = Message(role="user", content="hello")
+    memory.add_message(message)
+    assert memory.formatted_messages()[0]["content"] == "hello"
+
+    message.content = "edited"
+    assert memory.formatted_messages()[0]["content"] == "edited"
+
+    memory.messages = [Message(role="user", content="replaced")]
+    assert [wire["content"] for wire in memory.formatted_messages()] == ["replaced"]
+
+
+def test_token_count_follows_edits():
+    memory = Memory()
+    message = Message(role="user", content="short")
+    memory.add_message(message)
+    before = memory.token_count()
+    message.content = "a much longer message " * 20
+    assert memory.token_count() > before
+    memory.messages = [Message(role="user", content="x")]
+    assert memory.token_count() < before
+
+
+def test_trusted_construction_matches_the_validating_constructors():
+    tool_call = make_tool_call()
+    trusted_tool_call = ToolCall.trusted(
+        id="call_1", type="function", name="terminate", arguments={"reason": "done"}, tool=tool_call.tool
+    )
+    assert trusted_tool_call == tool_call
+    assert trusted_tool_call.model_fields_set == tool_call.model_fields_set
+    assert trusted_tool_call.to_dict() == tool_call.to_dict()
+
+    for role, content, tool_calls in [("user", "hello", None), ("assistant", "", [tool_call])]:
+        trusted = Message.trusted(role=role, content=content, tool_calls=[trusted_tool_call] if tool_calls else None)
+        validated = Message(role=role, content=content, tool_calls=tool_calls or [])
+        assert trusted == validated
+        assert trusted.model_dump() == validated.model_dump()
+        assert trusted.to_dict() == validated.to_dict()
+        assert copy.deepcopy(trusted) == trusted
+
+    message = {"role": "assistant", "content": "done"}
+    assert LLMResponse.trusted(content="done", message=message) == LLMResponse(content="done", message=message)
+
+
+def test_token_count_is_a_running_total(monkeypatch):
+    memory = Memory()
+    recounts = []
+    count_messages = HeuristicTokenCounter.count_messages
+    monkeypatch.setattr(
+        HeuristicTokenCounter, "count_messages",
+        lambda self, messages: recounts.append(len(messages)) or count_messages(self, messages)
+    )
+    expected = 0
+    for i in range(50):
+        message = Message(role="user", content=f"message {i} " * 10)
+        memory.add_message(message)
+        expected += memory._token_counter.count_message(message)
+        assert memory.token_count() == expected
+    # only the empty memory was counted from scratch
+    assert recounts == [0]
+
+
+def test_token_count_follows_compaction():
+    memory = Memory()
+    for i in range(10):
+        memory.add_message(Message(role="user", content=f"message {i} " * 20))
+    memory.set_compaction(SlidingWindow(max_turns=3))
+    assert len(memory.messages) == 3
+    assert memory.token_count() == memory._token_counter.count_messages(memory.messages)
+    memory.add_message(Message(role="user", content="one more"))
+    assert memory.token_count() == memory._token_counter.count_messages(memory.messages)
+
+
+def test_set_token_counter_recounts():
+    memory = Memory()
+    memory.add_message(Message(role="user", content="a" * 400))
+    before = memory.token_count()
+    memory.set_token_counter(HeuristicTokenCounter(chars_per_token=2))
+    assert memory.token_count() > before
@@ -0,0 +1,52 @@
+import time
+
+from mrai.agent.llm.semantic_cache import SemanticCache
+
+
+def payload(content: str) -> dict:
+    return {"role": "assistant", "content": content}
+
+
+def test_evicts_the_least_recently_used_entry():
+    cache = SemanticCache(max_entries=2)
+    cache.store("scope", "first question", payload("1"))
+    cache.store("scope", "second question", payload("2"))
+    assert cache.lookup("scope", "first question") is not None
+    cache.store("scope", "third question", payload("3"))
+    assert len(cache) == 2
+    assert cache.lookup("scope", "second question") is None
+    assert cache.lookup("scope", "first question").payload == payload("1")
+    assert cache.lookup("scope", "third question").payload == payload("3")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_removing_an_entry_keeps_the_others_reachable():
+    cache = SemanticCache()
+    for index in range(10):
+        cache.store(f"scope {index % 3}", f"question number {index}", payload(str(index)))
+    cache.remove(cache.lookup("scope 0", "question number 3").entry_id)
+    assert cache.lookup("scope 0", "question number 3") is None
+    for index in [0, 6, 9, 1, 2, 8]:
+        assert cache.lookup(f"scope {index % 3}", f"question number {index}").payload == payload(str(index))
+
+
+def test_expired_entries_are_removed_lazily():
+    cache = SemanticCache(ttl=0.05)
+    cache.store("a", "first question", payload("1"))
+    cache.store("b", "second question", payload("2"))
+    time.sleep(0.06)
+    assert cache.lookup("a", "first question") is None
+    assert len(cache) == 1
+    assert cache.purge_expired() == 1
+    assert len(cache) == 0
+
+
+def test_save_and_load_keep_the_entries(tmp_path):
+    path = str(tmp_path / "semantic_cache.npz")
+    cache = SemanticCache(path=path)
+    for index in range(100):
+        cache.store("scope", f"question number {index}", payload(str(index)))
+    cache.close()
+    restored = SemanticCache(path=path)
+    assert len(restored) == 100
+    assert restored.lookup("scope", "question number 42").payload == payload("42")
@@ -0,0 +1,106 @@
+import time
+
+from mrai.agent.memory.restore import bind_tools
+from mrai.agent.memory.session_store import SessionStore
+from mrai.agent.schema import Message, ToolCall
+from mrai.agent.tool.terminate_tool import Terminate
+from mrai.agent.tool.unbound_tool import UnboundTool
+
+
+def terminate_call() -> Message:
+    return Message(
+        role="assistant",
+        content="",
+        tool_calls=[
+            ToolCall(
+                id="call_1",
+                type="function",
+                function=ToolCall.ToolCallFunction(name="terminate", arguments={"reason": "done"}),
+                tool=Terminate()
+            )
+        ]
+    )
+
+
+def write_session(path: str):
+    store = SessionStore(path)
+    memory = store.open_memory("s1")
+    memory.add_message(Message(role="system", content="prompt"))
+    memory.add_message(Message(role="user", content="hello"))
+    memory.add_message(terminate_call())
+    store.close()
+
+
+def test_round_trip_keeps_tool_calls_without_the_tool(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    write_session(path)
+    store = SessionStore(path)
+    memory = store.open_memory("s1", tools=[])
+    assert [message.role for message in memory.messages] == ["system", "user", "assistant"]
+    tool_call = memory.messages[-1].tool_calls[0]
+    assert tool_call.function.name == "terminate"
+    assert tool_call.function.arguments == {"reason": "done"}
+    assert isinstance(tool_call.tool, UnboundTool)
+    assert memory.messages[-1].to_dict() == terminate_call().to_dict()
+
+    assert bind_tools(memory.messages, [Terminate()]) == 1
+    assert isinstance(memory.messages[-1].tool_calls[0].tool, Terminate)
+    store.close()
+
+
+def test_round_trip_binds_registered_tools(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    write_session(path)
+    store = SessionStore(path)
+    memory = store.open_memory("s1", tools=[Terminate()])
+    assert isinstance(memory.messages[-1].tool_calls[0].tool, Terminate)
+    store.close()
+
+
+def test_workers_handing_a_session_over_never_reuse_a_seq(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    first, second = SessionStore(path, flush_interval=None), SessionStore(path, flush_interval=None)
+    for index in range(3):
+        first.append("s1", Message(role="user", content=f"first {index}"))
+        first.flush()
+        second.append("s1", Message(role="user", content=f"second {index}"))
+        second.flush()
+    contents = [payload["content"] for payload in first.load_payloads("s1")]
+    assert contents == [f"{worker} {index}" for index in range(3) for worker in ("first", "second")]
+    assert second.length("s1") == 6
+    first.close()
+    second.close()
+
+
+def test_buffered_messages_are_committed_on_a_timer(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    store = SessionStore(path, batch_size=100, flush_interval=0.05)
+    store.append("s1", Message(role="user", content="hello"))
+    reader = SessionStore(path, flush_interval=None)
+    deadline = time.monotonic() + 2
+    while reader.length("s1") == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert reader.length("s1") == 1
+    assert store.stats()["pending"] == 0
+    reader.close()
+    store.close()
+
+
+def test_tail_starts_at_a_turn_group(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    store = SessionStore(path)
+    memory = store.open_memory("s1")
+    memory.add_message(Message(role="system", content="prompt"))
+    memory.add_message(Message(role="user", content="hello"))
+    memory.add_message(terminate_call())
+    for index in range(20):
+        memory.add_message(Message(role="tool", content=f"result {index}"))
+    memory.add_message(Message(role="user", content="again"))
+    store.flush()
+
+    tail = store.open_memory("s1", tools=[Terminate()], tail=1)
+    assert [message.content for message in tail.messages] == ["prompt", "again"]
+    tail = store.open_memory("s1", tools=[Terminate()], tail=3)
+    assert [message.role for message in tail.messages[:3]] == ["system", "assistant", "tool"]
+    assert len(tail.messages) == 23
+    store.close()
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from mrai.agent.llm.single_flight import SingleFlight
+from mrai.agent.llm.telemetry import CallRecord, Telemetry
+
+
+class Usage:
+    prompt_tokens = 10
+    completion_tokens = 5
+    prompt_tokens_details = None
+
+
+def test_followers_join_the_leader_and_share_its_usage():
+    group = SingleFlight()
+    calls = []
+
+    async def request(record: CallRecord):
+        calls.append(record)
+        await asyncio.sleep(0.05)
+        record.set_usage(Usage())
+        return "answer"
+
+    async def run():
+        records = [CallRecord("model") for _ in range(3)]
+        results = await asyncio.gather(*[group.do("key", lambda r=r: request(r), r) for r in records])
+        return records, results
+
+    records, results = asyncio.run(run())
+    assert results == ["answer"] * 3
+    assert calls == records[:1]
+    assert [record.deduplicated for record in records] == [False, True, True]
+    assert all(record.has_usage and record.completion_tokens == 5 for record in records)
+    assert group.stats()["leaders"] == 1 and group.stats()["followers"] == 2
+
+    telemetry = Telemetry()
+    for record in records:
+        telemetry.record(record)
+    totals = telemetry.by_model()["model"]
+    # billed once
+    assert totals["completion_tokens"] == 5
+    assert totals["deduplicated"] == 2
+
+
+def test_the_call_survives_the_cancelled_leader():
+    group = SingleFlight()
+
+    async def request():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        leader = asyncio.ensure_future(group.do("key", request))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(group.do("key", request))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower, leader
+
+    result, leader = asyncio.run(run())
+    assert result == "answer"
+    assert leader.cancelled()
+
+
+def test_the_error_reaches_every_caller():
+    group = SingleFlight()
+    calls = []
+
+    async def request():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*[group.do("key", request) for _ in range(3)], return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    # the key is free again
+    assert group.stats()["in_flight"] == 0
+
+
+async def numbers(count: int, started: list, closed: list, fail_at: int = -1):
+    started.append(True)
+    try:
+        for i in range(count):
+            await asyncio.sleep(0.01)
+            if i == fail_at:
+                raise ValueError("stream failed")
+            yield i
+    finally:
+        closed.append(True)
+
+
+def test_a_late_joiner_replays_the_stream_from_the_first_chunk():
+    group = SingleFlight()
+    started, closed = [], []
+
+    async def run():
+        leader = group.stream("key", lambda: numbers(5, started, closed))
+        received = [await leader.__anext__(), await leader.__anext__()]
+        follower = [i async for i in group.stream("key", lambda: numbers(5, started, closed))]
+        received += [i async for i in leader]
+        return received, follower
+
+    received, follower = asyncio.run(run())
+    assert received == follower == [0, 1, 2, 3, 4]
+    assert len(started) == 1
+    assert group.stats()["stream_followers"] == 1
+
+
+def test_the_stream_goes_on_without_its_leader_and_stops_with_the_last_subscriber():
+    group = SingleFlight()
+    started, closed = [], []
+
+    async def run():
+        leader = group.stream("key", lambda: numbers(100, started, closed))
+        follower = group.stream("key", lambda: numbers(100, started, closed))
+        await leader.__anext__()
+        received = [await follower.__anext__()]
+        await leader.aclose()
+        received += [await follower.__anext__() for _ in range(2)]
+        await follower.aclose()
+        # a subscriber arriving while the abandoned stream is cancelled starts a new one
+        restarted = [i async for i in group.stream("key", lambda: numbers(2, started, closed))]
+        await asyncio.sleep(0.05)
+        return received, restarted
+
+    assert asyncio.run(run()) == ([0, 1, 2], [0, 1])
+    assert closed == [True, True]
+    assert len(started) == 2
+    assert group.stats()["streams_in_flight"] == 0
+
+
+def test_the_stream_error_reaches_every_subscriber():
+    group = SingleFlight()
+    started, closed = [], []
+
+    async def consume():
+        received = []
+        with pytest.raises(ValueError):
+            async for i in group.stream("key", lambda: numbers(5, started, closed, fail_at=2)):
+                received.append(i)
+        return received
+
+    async def run():
+        return await asyncio.gather(consume(), consume())
+
+    assert asyncio.run(run()) == [[0, 1], [0, 1]]
+    assert len(started) == 1
@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Optional
+
+from mrai.agent.llm.stream import StreamChunk, ToolCallAssembler, ToolCallComplete, ToolCallStarted, coalesce_chunks
+
+
+def fragment(index: int, arguments: str = "", id: Optional[str] = None, name: Optional[str] = None):
+    return SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def test_fragmented_arguments_are_joined():
+    assembler = ToolCallAssembler()
+    events = assembler.feed([fragment(0, id="call_1", name="search")])
+    assert [type(event) for event in events] == [ToolCallStarted]
+    assert (events[0].id, events[0].name) == ("call_1", "search")
+    for part in ['{"qu', 'ery": "wea', 'ther"}']:
+        assert assembler.feed([fragment(0, part)]) == []
+    [complete] = assembler.finish()
+    assert isinstance(complete, ToolCallComplete)
+    assert complete.parse_arguments() == {"query": "weather"}
+    # finish is idempotent
+    assert assembler.finish() == []
+
+
+def test_a_new_index_completes_the_previous_tool_calls():
+    assembler = ToolCallAssembler()
+    assembler.feed([fragment(0, '{"a": 1}', id="call_1", name="first")])
+    events = assembler.feed([fragment(1, "", id="call_2", name="second")])
+    assert [(type(event), event.index) for event in events] == [(ToolCallComplete, 0), (ToolCallStarted, 1)]
+    assembler.feed([fragment(1, '{"b": 2}')])
+    [complete] = assembler.finish()
+    assert (complete.index, complete.name, complete.arguments) == (1, "second", '{"b": 2}')
+
+
+def test_interleaved_indices_keep_their_own_arguments():
+    assembler = ToolCallAssembler()
+    # both calls arrive in one delta, then their fragments alternate
+    events = assembler.feed([fragment(0, id="call_1", name="first"), fragment(1, id="call_2", name="second")])
+    assert [(type(event), event.index) for event in events] == [
+        (ToolCallStarted, 0), (ToolCallComplete, 0), (ToolCallStarted, 1)
+    ]
+    assembler.feed([fragment(1, '{"b"')])
+    # a late fragment of a delivered tool call is dropped
+    assembler.feed([fragment(0, "ignored")])
+    assembler.feed([fragment(1, ": 2}")])
+    [complete] = assembler.finish()
+    assert complete.parse_arguments() == {"b": 2}
+
+
+def test_the_name_arriving_late_starts_the_tool_call():
+    assembler = ToolCallAssembler()
+    assert assembler.feed([fragment(0, id="call_1")]) == []
+    [started] = assembler.feed([fragment(0, name="search")])
+    assert (started.id, started.name) == ("call_1", "search")
+    assert assembler.feed(None) == []
+    assert [event.name for event in assembler.finish()] == ["search"]
+
+
+async def items(*values):
+    for value in values:
+        if isinstance(value, float):
+            # a stall of the upstream
+            await asyncio.sleep(value)
+            continue
+        yield value
+
+
+def coalesce(*values, **kwargs) -> list:
+    async def run():
+        return [
+            (item.kind, item.text) if isinstance(item, StreamChunk) else item
+            async for item in coalesce_chunks(items(*values), **kwargs)
+        ]
+    return asyncio.run(run())
+
+
+def test_chunks_of_the_same_kind_are_merged_until_the_kind_changes():
+    assert coalesce(
+        StreamChunk("reasoning_content", "th"), StreamChunk("reasoning_content", "ink"),
+        StreamChunk("content", "an"), StreamChunk("content", "swer"),
+        max_chars=100
+    ) == [("reasoning_content", "think"), ("content", "answer")]
+
+
+def test_max_chars_flushes_the_merged_chunk():
+    assert coalesce(*[StreamChunk("content", "ab")] * 5, max_chars=4) == [
+        ("content", "abab"), ("content", "abab"), ("content", "ab")
+    ]
+
+
+def test_other_items_flush_the_buffer_and_keep_their_order():
+    tool_call = ToolCallStarted(0, "call_1", "search")
+    assert coalesce(
+        StreamChunk("content", "a"), StreamChunk("content", "b"), tool_call, StreamChunk("content", "c"),
+        max_chars=100
+    ) == [("content", "ab"), tool_call, ("content", "c")]
+
+
+def test_max_interval_flushes_while_the_upstream_stalls():
+    assert coalesce(
+        StreamChunk("content", "a"), StreamChunk("content", "b"), 0.2, StreamChunk("content", "c"),
+        max_interval=0.05
+    ) == [("content", "ab"), ("content", "c")]
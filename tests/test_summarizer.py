@@ -0,0 +1,65 @@
+import asyncio
+
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockResponse, MockServerConfig
+from mrai.agent.memory.summarizer import SUMMARY_PREFIX, SummarizingCompaction
+from mrai.agent.schema import Memory, Message
+
+
+def make_memory(turns: int) -> Memory:
+    memory = Memory()
+    memory.add_message(Message(role="system", content="prompt"))
+    for i in range(turns):
+        memory.add_message(Message(role="user", content=f"turn {i} " * 20))
+    return memory
+
+
+def make_policy(mock_server) -> SummarizingCompaction:
+    _, base_url = mock_server(MockServerConfig(responses=[MockResponse(content="the summary")]))
+    llm = LLM(LLMConfig(api_key="test", model="test", base_url=base_url))
+    return SummarizingCompaction(llm, trigger_tokens=100, keep_turns=2)
+
+
+def test_the_summary_replaces_the_summarized_turns(mock_server):
+    policy = make_policy(mock_server)
+
+    async def main() -> Memory:
+        memory = make_memory(turns=4)
+        kept = memory.messages[3:]
+        # over the trigger, the summarizer runs in the background and the memory is left as is meanwhile
+        memory.set_compaction(policy)
+        assert len(memory.messages) == 5
+        await policy.flush()
+        latest = Message(role="user", content="latest")
+        memory.add_message(latest)
+        assert memory.messages[2:] == [*kept, latest]
+        policy.cancel()
+        return memory
+
+    memory = asyncio.run(main())
+    assert memory.messages[0].content == "prompt"
+    assert memory.messages[1].role == "system"
+    assert memory.messages[1].content == SUMMARY_PREFIX + "the summary"
+    assert memory.token_count() == memory._token_counter.count_messages(memory.messages)
+    assert policy.stats.snapshot()["applied"] == 1
+    assert policy.stats.snapshot()["discarded"] == 0
+
+
+def test_the_summary_is_discarded_when_the_turns_changed_meanwhile(mock_server):
+    policy = make_policy(mock_server)
+
+    async def main() -> Memory:
+        memory = make_memory(turns=4)
+        memory.set_compaction(policy)
+        memory.messages[1] = Message(role="user", content="edited")
+        await policy.flush()
+        memory.add_message(Message(role="user", content="latest"))
+        policy.cancel()
+        return memory
+
+    memory = asyncio.run(main())
+    assert [message.content for message in memory.messages][:2] == ["prompt", "edited"]
+    assert not any(message.content.startswith(SUMMARY_PREFIX) for message in memory.messages)
+    assert policy.stats.snapshot()["applied"] == 0
+    assert policy.stats.snapshot()["discarded"] == 1
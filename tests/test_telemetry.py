@@ -0,0 +1,63 @@
+import asyncio
+
+from mrai.agent.llm.llm import LLM
+from mrai.agent.llm.llm_config import LLMConfig
+from mrai.agent.llm.mock_server import MockResponse, MockServerConfig, MockToolCall
+from mrai.agent.llm.stream import ToolCallComplete
+from mrai.agent.llm.telemetry import CallRecord, Telemetry
+from mrai.agent.schema import Tool
+from mrai.agent.tool.terminate_tool import Terminate
+
+
+class Search(Tool):
+
+    def __init__(self):
+        super().__init__(name="search", description="Search the web", parameters={
+            "query": Tool.ToolParameter(name="query", description="The query", type="string", required=True)
+        })
+
+    def execute(self, query: str):
+        return query
+
+
+def test_by_flow_keeps_the_most_recently_active_flows():
+    telemetry = Telemetry(max_flows=2)
+    for flow_id in ["a", "b", "a", "c"]:
+        telemetry.record(CallRecord("model", flow_id=flow_id))
+    by_flow = telemetry.by_flow()
+    assert list(by_flow) == ["a", "c"]
+    assert by_flow["a"]["calls"] == 2
+    assert telemetry.by_model()["model"]["calls"] == 4
+
+
+def stream_until_tool_call(mock_server, tool_calls: list[MockToolCall]) -> CallRecord:
+    _, base_url = mock_server(MockServerConfig(responses=[MockResponse(content="", tool_calls=tool_calls)]))
+    telemetry = Telemetry()
+    llm = LLM(LLMConfig(api_key="test", model="test", base_url=base_url, stream_usage=True), telemetry=telemetry)
+
+    async def run():
+        stream = llm.stream_chat(["search"], tools=[Search(), Terminate()], native_tools=True, typed=True)
+        async for chunk in stream:
+            if isinstance(chunk, ToolCallComplete):
+                # like the flow, stop the stream before running the tool
+                await stream.aclose()
+                break
+
+    asyncio.run(run())
+    return telemetry.records()[0]
+
+
+def test_closing_at_the_tool_call_keeps_the_usage(mock_server):
+    record = stream_until_tool_call(mock_server, [MockToolCall(name="search", arguments={"query": "weather in Paris"})])
+    assert record.has_usage
+    assert record.completion_tokens > 0
+    assert record.wasted_tokens == 0
+
+
+def test_the_unfinished_tool_call_of_an_abandoned_stream_is_wasted(mock_server):
+    record = stream_until_tool_call(mock_server, [
+        MockToolCall(name="search", arguments={"query": "weather"}),
+        MockToolCall(name="terminate", arguments={"reason": "a long reason that was generated for nothing"}),
+    ])
+    assert record.abandoned
+    assert record.wasted_tokens > 0
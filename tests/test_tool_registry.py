@@ -0,0 +1,54 @@
+import pytest
+
+from mrai.agent.schema import Tool
+from mrai.agent.tool.terminate_tool import Terminate
+from mrai.agent.tool.tool_registry import ToolRegistry
+
+
+class Echo(Tool):
+
+    def __init__(self, description: str = "Echo the text"):
+        super().__init__(name="echo", description=description, parameters={})
+
+    def execute(self, **kwargs):
+        return kwargs
+
+
+def test_tools_are_found_by_name_and_by_position():
+    tools = ToolRegistry([Terminate(), Echo()])
+    assert tools["echo"].name == "echo"
+    assert tools.get("missing") is None
+    with pytest.raises(KeyError):
+        tools["missing"]
+    assert [tools[0].name, tools[-1].name] == ["terminate", "echo"]
+    assert "echo" in tools and Terminate() in tools
+
+
+def test_a_tool_with_the_same_name_is_replaced_in_place():
+    tools = ToolRegistry([Echo(), Terminate()])
+    fingerprint = tools.fingerprint
+    tools.append(Echo(description="Echo it back"))
+    assert tools.names() == ["echo", "terminate"]
+    assert tools["echo"].description == "Echo it back"
+    assert tools[0] is tools["echo"]
+    assert tools.fingerprint != fingerprint
+
+
+def test_schemas_are_cached_until_the_tool_set_changes():
+    tools = ToolRegistry([Terminate()])
+    schemas = tools.schemas()
+    assert tools.schemas() is schemas
+    fingerprint = tools.fingerprint
+    tools.remove("terminate")
+    tools.remove("missing")
+    assert tools.schemas() == [] and not tools
+    assert tools.fingerprint != fingerprint
+    assert ToolRegistry([Terminate()]).fingerprint == fingerprint
+
+
+def test_removing_while_iterating():
+    tools = ToolRegistry([Terminate(), Echo()])
+    for tool in tools:
+        tools.remove(tool)
+    assert len(tools) == 0
+    assert ToolRegistry.of(tools) is tools